@@ -0,0 +1 @@
+"""Benchmarks de extremo a extremo con dobles locales de Ollama, PostgreSQL y `ssh pve`."""
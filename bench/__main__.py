@@ -0,0 +1,166 @@
+"""`python -m bench [escenario ...] [-n N] [--salida r.json] [--comparar base.json]`
+
+Levanta los dobles locales (Ollama falso, PostgreSQL desechable, `ssh` falso),
+ejecuta los escenarios y escribe p50/p95 por métrica en JSON.
+
+    python -m bench                         # todos los escenarios, 20 repeticiones
+    python -m bench historial_10k -n 50 --salida antes.json
+    python -m bench --comparar antes.json   # diferencia de p50/p95 con otra ejecución
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from contextlib import ExitStack
+from dataclasses import asdict
+from datetime import datetime
+
+from bench import ssh_falso
+from bench.ollama_falso import Guion, OllamaFalso, Regla
+from bench.postgres import PostgresTemporal, crear_esquema
+
+GUION_POR_DEFECTO = Guion(reglas=[
+    Regla(contiene="memoria libre", tool="uso_memoria"),
+    Regla(contiene="explora proxmox", tool="pve_explorar"),
+])
+
+
+def percentil(valores: list[float], p: float) -> float:
+    """Percentil con interpolación lineal entre los dos rangos más cercanos."""
+    orden = sorted(valores)
+    k = (len(orden) - 1) * p / 100
+    i = int(k)
+    if i + 1 >= len(orden):
+        return orden[-1]
+    return orden[i] + (orden[i + 1] - orden[i]) * (k - i)
+
+
+def resumir(tiempos: list[float]) -> dict:
+    ms = [t * 1000 for t in tiempos]
+    return {
+        "n": len(ms),
+        "p50_ms": round(percentil(ms, 50), 3),
+        "p95_ms": round(percentil(ms, 95), 3),
+        "media_ms": round(sum(ms) / len(ms), 3),
+        "min_ms": round(min(ms), 3),
+        "max_ms": round(max(ms), 3),
+    }
+
+
+def resumir_fraccion(valores: list[float]) -> dict:
+    return {"n": len(valores), "media": round(sum(valores) / len(valores), 4), "min": round(min(valores), 4)}
+
+
+def _commit() -> str | None:
+    try:
+        r = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                           cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return r.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def comparar(actual: dict, base: dict) -> str:
+    lineas = [f"{'métrica':<45} {'p50 base':>10} {'p50':>10} {'Δ':>8} {'p95 base':>10} {'p95':>10} {'Δ':>8}"]
+    for metrica, r in actual["resultados"].items():
+        b = base.get("resultados", {}).get(metrica)
+        if b is None or "p50_ms" not in r:
+            continue
+        d50 = 100 * (r["p50_ms"] - b["p50_ms"]) / b["p50_ms"] if b["p50_ms"] else 0.0
+        d95 = 100 * (r["p95_ms"] - b["p95_ms"]) / b["p95_ms"] if b["p95_ms"] else 0.0
+        lineas.append(f"{metrica:<45} {b['p50_ms']:>10.2f} {r['p50_ms']:>10.2f} {d50:>+7.1f}% "
+                      f"{b['p95_ms']:>10.2f} {r['p95_ms']:>10.2f} {d95:>+7.1f}%")
+    return "\n".join(lineas)
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.splitlines()[0])
+    parser.add_argument("escenarios", nargs="*", help="por defecto, todos")
+    parser.add_argument("-n", "--repeticiones", type=int, default=20)
+    parser.add_argument("--guion", help="JSON con la configuración del Ollama falso (ver bench.ollama_falso.Guion)")
+    parser.add_argument("--database-url", help="base PostgreSQL+pgvector DESECHABLE en lugar de initdb")
+    parser.add_argument("--salida", help="archivo JSON de resultados (por defecto, stdout)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para mostrar la diferencia")
+    args = parser.parse_args(argv)
+
+    guion = GUION_POR_DEFECTO
+    if args.guion:
+        with open(args.guion) as f:
+            guion = Guion.desde_dict(json.load(f))
+
+    with ExitStack() as pila:
+        temporal = tempfile.mkdtemp(prefix="chatty-bench-")
+        pila.callback(shutil.rmtree, temporal, True)
+
+        if args.database_url:
+            crear_esquema(args.database_url)
+            database_url = args.database_url
+        else:
+            try:
+                database_url = pila.enter_context(PostgresTemporal())
+            except RuntimeError as e:
+                print(f"[bench] {e}", file=sys.stderr)
+                return 2
+        ollama = pila.enter_context(OllamaFalso(guion))
+        bin_ssh = ssh_falso.instalar()
+        pila.callback(shutil.rmtree, bin_ssh, True)
+
+        os.environ.update({
+            "DATABASE_URL": database_url,
+            "CHATTY_OLLAMA_URL": ollama.url,
+            "CHATTY_EMBED_CACHE": os.path.join(temporal, "embeddings.sqlite"),
+            "CHATTY_STREAMING": "0",
+            "CHATTY_TELEMETRIA": "0",
+            "CHATTY_INDICE": "0",
+            "PATH": bin_ssh + os.pathsep + os.environ.get("PATH", ""),
+        })
+
+        # Importar después de preparar el entorno: los módulos de Chatty lo leen al cargarse
+        from bench.escenarios import ESCENARIOS
+        from memory import db, esquema
+        pila.callback(db.cerrar_pool)  # antes de parar el PostgreSQL temporal
+        esquema.aplicar()
+
+        nombres = args.escenarios or list(ESCENARIOS)
+        desconocidos = [n for n in nombres if n not in ESCENARIOS]
+        if desconocidos:
+            print(f"[bench] Escenarios desconocidos: {', '.join(desconocidos)}. "
+                  f"Disponibles: {', '.join(ESCENARIOS)}", file=sys.stderr)
+            return 2
+
+        resultados = {}
+        for nombre in nombres:
+            print(f"[bench] {nombre}...", file=sys.stderr, flush=True)
+            for metrica, tiempos in ESCENARIOS[nombre](args.repeticiones).items():
+                resumen = resumir_fraccion if metrica.startswith("recall") else resumir
+                resultados[f"{nombre}.{metrica}"] = resumen(tiempos)
+
+        informe = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "repeticiones": args.repeticiones,
+            "guion": asdict(guion),
+            "peticiones_ollama": dict(ollama.peticiones),
+            "resultados": resultados,
+        }
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    if args.comparar:
+        with open(args.comparar) as f:
+            print(comparar(informe, json.load(f)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,41 @@
+"""Arranque en frío medido por fases: `python -m bench.arranque` imprime un JSON.
+
+Lo lanza bench.escenarios en un proceso nuevo por repetición, con el entorno
+(DATABASE_URL, CHATTY_OLLAMA_URL, PATH) ya apuntando a los dobles locales.
+Reproduce los pasos del `__main__` de chatty_langgraph hasta la primera respuesta.
+"""
+
+import json
+import time
+
+_t0 = time.perf_counter()
+
+
+def main() -> None:
+    fases = {}
+    t = time.perf_counter()
+    import chatty_langgraph as chatty
+    from langchain_core.messages import HumanMessage, SystemMessage
+    fases["importar"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    chatty.aplicar_migraciones()
+    fases["migraciones"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    mensajes = chatty.cargar(presupuesto_tokens=chatty.PRESUPUESTO_MENSAJES // 2)
+    contexto = "\n\n".join(filter(None, [chatty.contexto_resumenes(), chatty.contexto_semantico()]))
+    fases["cargar_memoria"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    sistema = chatty.SYSTEM_PROMPT + ("\n\n" + contexto if contexto else "")
+    state = {"messages": [SystemMessage(content=sistema)] + mensajes + [HumanMessage(content="hola")]}
+    chatty.app.invoke(state)
+    fases["primer_turno"] = time.perf_counter() - t
+
+    fases["total"] = time.perf_counter() - _t0
+    print(json.dumps(fases))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Escenarios del benchmark. Cada uno devuelve {métrica: [segundos, ...]}.
+
+Se importan los módulos de Chatty dentro de cada escenario porque leen el
+entorno (DATABASE_URL, CHATTY_OLLAMA_URL) al importarse, y bench.__main__ lo
+prepara antes de llamar aquí.
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+N_MENSAJES = 10_000
+N_HECHOS = 10_000
+
+Resultados = dict[str, list[float]]
+
+
+def _medir(funcion: Callable[[int], object], repeticiones: int, calentamiento: int = 1) -> list[float]:
+    """Tiempos de `funcion(i)`; las primeras `calentamiento` llamadas no cuentan."""
+    for i in range(calentamiento):
+        funcion(-1 - i)
+    tiempos = []
+    for i in range(repeticiones):
+        t = time.perf_counter()
+        funcion(i)
+        tiempos.append(time.perf_counter() - t)
+    return tiempos
+
+
+def _contar(tabla: str) -> int:
+    from memory.db import get_conn
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM {tabla}")
+        return cur.fetchone()[0]
+
+
+# ── Arranque en frío ─────────────────────────────────────────────────────────
+
+def arranque_en_frio(repeticiones: int) -> Resultados:
+    """Proceso nuevo por repetición: importar, migrar, cargar memoria y primer turno."""
+    resultados: Resultados = {}
+    for _ in range(max(1, min(repeticiones, 5))):
+        r = subprocess.run([sys.executable, "-m", "bench.arranque"], cwd=RAIZ,
+                           capture_output=True, text=True, timeout=300)
+        if r.returncode != 0:
+            raise RuntimeError(f"bench.arranque falló:\n{r.stderr[-2000:]}")
+        for fase, segundos in json.loads(r.stdout.strip().splitlines()[-1]).items():
+            resultados.setdefault(fase, []).append(segundos)
+    return resultados
+
+
+# ── Historial de 10k mensajes ────────────────────────────────────────────────
+
+def _sembrar_conversaciones(n: int) -> None:
+    from memory import episodica
+
+    faltan = n - _contar("conversaciones")
+    if faltan <= 0:
+        return
+    rnd = random.Random(42)
+    inicio = datetime.now() - timedelta(seconds=faltan)
+    filas = []
+    for i in range(faltan):
+        rol = "human" if i % 2 == 0 else "ai"
+        texto = " ".join(f"palabra{rnd.randrange(500)}" for _ in range(rnd.randrange(5, 80)))
+        filas.append((episodica.AGENTE, rol, texto, inicio + timedelta(seconds=i)))
+    for i in range(0, len(filas), 1000):
+        episodica._insertar(filas[i:i + 1000])
+
+
+def historial_10k(repeticiones: int) -> Resultados:
+    import chatty_langgraph as chatty
+    from langchain_core.messages import HumanMessage, SystemMessage
+    from memory import episodica
+
+    _sembrar_conversaciones(N_MENSAJES)
+    presupuesto = chatty.PRESUPUESTO_MENSAJES // 2
+
+    historial = episodica.cargar(presupuesto_tokens=presupuesto)
+    base = [SystemMessage(content=chatty.SYSTEM_PROMPT)] + historial
+
+    def turno(texto: str) -> None:
+        chatty.app.invoke({"messages": base + [HumanMessage(content=texto)]})
+
+    return {
+        "cargar": _medir(lambda i: episodica.cargar(presupuesto_tokens=presupuesto), repeticiones),
+        "cargar_anteriores": _medir(lambda i: episodica.cargar_anteriores(), repeticiones),
+        "turno": _medir(lambda i: turno(f"pregunta {i}"), repeticiones),
+        "turno_con_tool": _medir(lambda i: turno(f"¿cuánta memoria libre hay? ({i})"), repeticiones),
+    }
+
+
+# ── pve_explorar ─────────────────────────────────────────────────────────────
+
+def pve_explorar(repeticiones: int) -> Resultados:
+    from tools import ssh_pve
+
+    return {"pve_explorar": _medir(lambda i: ssh_pve.pve_explorar.invoke({}), repeticiones)}
+
+
+# ── Búsqueda semántica con 10k hechos ────────────────────────────────────────
+
+_SERVICIOS = ["nginx", "postgres", "redis", "grafana", "jellyfin", "nextcloud", "pihole", "home-assistant",
+              "gitea", "prometheus", "minio", "traefik", "vaultwarden", "syncthing", "immich", "frigate"]
+_LUGARES = ["Madrid", "Caracas", "Valencia", "Bogotá", "Lima", "Sevilla", "Quito", "Santiago"]
+
+
+def hecho_sintetico(rnd: random.Random) -> str:
+    return rnd.choice([
+        lambda: f"La VM {rnd.randrange(100, 999)} ejecuta {rnd.choice(_SERVICIOS)} con {rnd.choice([2, 4, 8, 16])} GB de RAM",
+        lambda: f"El contenedor {rnd.choice(_SERVICIOS)} escucha en el puerto {rnd.randrange(1024, 65535)}",
+        lambda: f"El usuario vivió en {rnd.choice(_LUGARES)} durante {rnd.randrange(1, 20)} años",
+        lambda: f"Copia de seguridad de {rnd.choice(_SERVICIOS)} programada a las {rnd.randrange(24)}:00",
+    ])()
+
+
+def sembrar_hechos(n: int) -> None:
+    from memory import semantica
+
+    faltan = n - _contar("hechos")
+    rnd = random.Random(7)
+    for i in range(0, max(0, faltan), 500):
+        semantica.guardar_hechos([hecho_sintetico(rnd) for _ in range(min(500, faltan - i))], umbral=1.01)
+
+
+def busqueda_semantica_10k(repeticiones: int) -> Resultados:
+    from memory import semantica
+
+    sembrar_hechos(N_HECHOS)
+    rnd = random.Random(99)
+    # consultas distintas en cada llamada para no medir solo la caché de embeddings
+    consultas = [hecho_sintetico(rnd) for _ in range(2 * repeticiones + 4)]
+    return {
+        "buscar_hechos_similares": _medir(lambda i: semantica.buscar_hechos_similares(consultas[i + 2]), repeticiones),
+        "como_contexto": _medir(lambda i: semantica.como_contexto(consultas[repeticiones + 3 + i]), repeticiones),
+    }
+
+
+def recall_semantica(repeticiones: int) -> Resultados:
+    """Búsqueda exacta frente al índice ANN con varios ef_search: latencia y recall@k.
+    Las métricas `recall_*` son fracciones (0–1) por consulta, no segundos."""
+    from memory import embeddings, semantica
+
+    sembrar_hechos(N_HECHOS)
+    rnd = random.Random(123)
+    vectores = embeddings.get_embeddings([hecho_sintetico(rnd) for _ in range(repeticiones + 1)])
+    k = semantica.TOP_K
+    exactos = [set(semantica.buscar_por_vector(v, k, exacta=True)) for v in vectores]
+
+    resultados: Resultados = {
+        "exacta": _medir(lambda i: semantica.buscar_por_vector(vectores[i], k, exacta=True), repeticiones),
+    }
+    for ef in (16, 40, semantica.EF_SEARCH, 200):
+        resultados[f"ann_ef{ef}"] = _medir(lambda i: semantica.buscar_por_vector(vectores[i], k, ef_search=ef),
+                                           repeticiones)
+        resultados[f"recall_ef{ef}"] = [
+            len(exactos[i] & set(semantica.buscar_por_vector(vectores[i], k, ef_search=ef))) / k
+            for i in range(repeticiones)
+        ]
+    return resultados
+
+
+ESCENARIOS: dict[str, Callable[[int], Resultados]] = {
+    "arranque_en_frio": arranque_en_frio,
+    "historial_10k": historial_10k,
+    "pve_explorar": pve_explorar,
+    "busqueda_semantica_10k": busqueda_semantica_10k,
+    "recall_semantica": recall_semantica,
+}
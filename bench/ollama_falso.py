@@ -0,0 +1,175 @@
+"""Servidor Ollama falso para benchmarks: /api/chat (con y sin streaming) y /api/embed.
+
+Las respuestas se guionizan con `Guion`: latencia hasta el primer token, latencia
+por token, longitud de la respuesta y reglas que convierten un mensaje del
+usuario en una llamada a tool. Los embeddings son deterministas (hashing de
+palabras normalizado), así que textos que comparten palabras quedan cerca y las
+búsquedas por similitud devuelven resultados con sentido.
+"""
+
+import hashlib
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIMENSIONES = 768   # las de nomic-embed-text (columna vector(768))
+
+
+@dataclass
+class Regla:
+    """Si el último mensaje del usuario contiene `contiene`, el modelo llama a `tool`."""
+    contiene: str
+    tool: str
+    argumentos: dict = field(default_factory=dict)
+
+
+@dataclass
+class Guion:
+    latencia_primer_token: float = 0.05   # segundos hasta el primer token (prefill)
+    latencia_token: float = 0.004         # segundos entre tokens (decode)
+    tokens_respuesta: int = 40
+    latencia_embed: float = 0.005         # por petición a /api/embed
+    latencia_embed_texto: float = 0.0005  # por texto dentro de la petición
+    reglas: list[Regla] = field(default_factory=list)
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "Guion":
+        datos = dict(datos)
+        datos["reglas"] = [Regla(**r) for r in datos.get("reglas", [])]
+        return cls(**datos)
+
+
+def vector(texto: str, dimensiones: int = DIMENSIONES) -> list[float]:
+    """Embedding determinista: cada palabra suma ±1 en dos posiciones según su hash."""
+    v = [0.0] * dimensiones
+    for palabra in texto.lower().split():
+        h = hashlib.blake2b(palabra.encode("utf-8"), digest_size=8).digest()
+        for i in (0, 4):
+            pos = int.from_bytes(h[i:i + 3], "little") % dimensiones
+            v[pos] += 1.0 if h[i + 3] & 1 else -1.0
+    norma = math.sqrt(sum(x * x for x in v)) or 1.0
+    return [x / norma for x in v]
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    server: "OllamaFalso"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _json(self, cuerpo: dict, estado: int = 200) -> None:
+        datos = json.dumps(cuerpo).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self) -> None:
+        if self.path == "/api/version":
+            self._json({"version": "0.0.0-bench"})
+        elif self.path == "/api/tags":
+            self._json({"models": []})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self) -> None:
+        largo = int(self.headers.get("Content-Length") or 0)
+        peticion = json.loads(self.rfile.read(largo) or b"{}")
+        self.server.contar(self.path)
+        if self.path == "/api/embed":
+            self._embed(peticion)
+        elif self.path == "/api/chat":
+            self._chat(peticion)
+        elif self.path == "/api/show":
+            self._json({"modelfile": "", "parameters": "", "template": "", "capabilities": ["completion", "tools"]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def _embed(self, peticion: dict) -> None:
+        textos = peticion.get("input", [])
+        if isinstance(textos, str):
+            textos = [textos]
+        g = self.server.guion
+        time.sleep(g.latencia_embed + g.latencia_embed_texto * len(textos))
+        self._json({"model": peticion.get("model", ""), "embeddings": [vector(t) for t in textos]})
+
+    def _mensaje(self, peticion: dict) -> dict:
+        mensajes = peticion.get("messages", [])
+        ultimo = mensajes[-1] if mensajes else {}
+        if ultimo.get("role") == "user" and peticion.get("tools"):
+            disponibles = {t.get("function", {}).get("name") for t in peticion["tools"]}
+            texto = str(ultimo.get("content", "")).lower()
+            for regla in self.server.guion.reglas:
+                if regla.contiene.lower() in texto and regla.tool in disponibles:
+                    return {"role": "assistant", "content": "",
+                            "tool_calls": [{"function": {"name": regla.tool, "arguments": regla.argumentos}}]}
+        return {"role": "assistant", "content": ""}
+
+    def _chat(self, peticion: dict) -> None:
+        g = self.server.guion
+        mensaje = self._mensaje(peticion)
+        tokens = [] if mensaje.get("tool_calls") else [f"palabra{i} " for i in range(g.tokens_respuesta)]
+        base = {"model": peticion.get("model", ""), "created_at": "1970-01-01T00:00:00Z"}
+        final = {**base, "done": True, "done_reason": "stop",
+                 "prompt_eval_count": sum(len(str(m.get("content", ""))) // 4 for m in peticion.get("messages", [])),
+                 "eval_count": len(tokens)}
+        time.sleep(g.latencia_primer_token)
+
+        if not peticion.get("stream", True):
+            time.sleep(g.latencia_token * len(tokens))
+            self._json({**final, "message": {**mensaje, "content": "".join(tokens)}})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def enviar(obj: dict) -> None:
+            linea = json.dumps(obj).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(linea):x}\r\n".encode() + linea + b"\r\n")
+            self.wfile.flush()
+
+        if mensaje.get("tool_calls"):
+            enviar({**base, "done": False, "message": mensaje})
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(g.latencia_token)
+            enviar({**base, "done": False, "message": {"role": "assistant", "content": token}})
+        enviar({**final, "message": {"role": "assistant", "content": ""}})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class OllamaFalso(ThreadingHTTPServer):
+    """`with OllamaFalso(guion) as s:` arranca en un puerto libre; `s.url` es la base."""
+
+    daemon_threads = True
+
+    def __init__(self, guion: Guion | None = None, puerto: int = 0):
+        super().__init__(("127.0.0.1", puerto), _Manejador)
+        self.guion = guion or Guion()
+        self.peticiones: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._hilo: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def contar(self, ruta: str) -> None:
+        with self._lock:
+            self.peticiones[ruta] = self.peticiones.get(ruta, 0) + 1
+
+    def __enter__(self) -> "OllamaFalso":
+        self._hilo = threading.Thread(target=self.serve_forever, name="ollama-falso", daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,87 @@
+"""PostgreSQL desechable para benchmarks: initdb + pg_ctl en un directorio temporal.
+
+Crea las tablas base de la memoria (las que en producción ya existen) con la
+extensión pgvector; las migraciones de memory.esquema se aplican después como
+en el arranque de Chatty. Necesita los binarios de PostgreSQL y pgvector
+instalados; si no están, se puede pasar la URL de una base desechable.
+"""
+
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+ESQUEMA_BASE = [
+    "CREATE EXTENSION IF NOT EXISTS vector",
+    "CREATE TABLE IF NOT EXISTS conversaciones ("
+    " agente TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, timestamp TIMESTAMP NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS hechos ("
+    " id SERIAL PRIMARY KEY, agente TEXT NOT NULL, hecho TEXT NOT NULL,"
+    " embedding vector(768), timestamp TIMESTAMP NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS resumenes ("
+    " id SERIAL PRIMARY KEY, agente TEXT NOT NULL, resumen TEXT NOT NULL, timestamp TIMESTAMP NOT NULL)",
+]
+
+
+def _binario(nombre: str) -> str | None:
+    """Busca en el PATH y en /usr/lib/postgresql/*/bin (Debian no los pone en el PATH)."""
+    ruta = shutil.which(nombre)
+    if ruta:
+        return ruta
+    candidatos = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{nombre}"), reverse=True)
+    return candidatos[0] if candidatos else None
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def crear_esquema(url: str) -> None:
+    import psycopg2
+
+    conn = psycopg2.connect(url)
+    try:
+        with conn.cursor() as cur:
+            for sql in ESQUEMA_BASE:
+                cur.execute(sql)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class PostgresTemporal:
+    """`with PostgresTemporal() as url:` levanta un cluster propio y lo borra al salir."""
+
+    def __init__(self):
+        self.directorio: str | None = None
+        self.puerto = _puerto_libre()
+        self._pg_ctl = _binario("pg_ctl")
+        self._initdb = _binario("initdb")
+
+    def __enter__(self) -> str:
+        if not (self._pg_ctl and self._initdb):
+            raise RuntimeError("No se encontraron initdb/pg_ctl; usa --database-url con una base desechable.")
+        self.directorio = tempfile.mkdtemp(prefix="chatty-bench-pg-")
+        datos = os.path.join(self.directorio, "datos")
+        subprocess.run([self._initdb, "-D", datos, "-U", "bench", "-A", "trust", "--no-sync"],
+                       check=True, capture_output=True)
+        opciones = f"-p {self.puerto} -k {self.directorio} -c listen_addresses=127.0.0.1 -c fsync=off"
+        subprocess.run([self._pg_ctl, "-D", datos, "-o", opciones, "-l",
+                        os.path.join(self.directorio, "postgres.log"), "-w", "start"],
+                       check=True, capture_output=True)
+        subprocess.run([_binario("createdb") or "createdb", "-h", "127.0.0.1", "-p", str(self.puerto),
+                        "-U", "bench", "chatty"], check=True, capture_output=True)
+        url = f"postgresql://bench@127.0.0.1:{self.puerto}/chatty"
+        crear_esquema(url)
+        return url
+
+    def __exit__(self, *exc) -> None:
+        if self.directorio is None:
+            return
+        subprocess.run([self._pg_ctl, "-D", os.path.join(self.directorio, "datos"), "-m", "immediate", "stop"],
+                       capture_output=True)
+        shutil.rmtree(self.directorio, ignore_errors=True)
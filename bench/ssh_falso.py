@@ -0,0 +1,92 @@
+"""Comando `ssh` falso para benchmarks: se instala primero en el PATH.
+
+Entiende lo que usa tools.ssh_pve: arrancar la maestra (-M -N -f, crea el
+socket de control), `-O check` / `-O exit` y ejecutar un comando, al que
+responde con una salida fija parecida a la de un Proxmox real tras
+BENCH_SSH_LATENCIA segundos (BENCH_SSH_HANDSHAKE si no hay maestra).
+"""
+
+import os
+import stat
+import sys
+import tempfile
+
+RESPUESTAS = {
+    "pveversion": "pve-manager/8.2.4/faa83925c9641325 (running kernel: 6.8.8-2-pve)",
+    "qm list": "\n".join(
+        ["      VMID NAME                 STATUS     MEM(MB)    BOOTDISK(GB) PID"]
+        + [f"       {100 + i} vm-{i:02d}                running    4096              32.00 {1000 + i}"
+           for i in range(12)]
+    ),
+    "pct list": "\n".join(
+        ["VMID       Status     Lock         Name"]
+        + [f"{200 + i}        running                 ct-{i:02d}" for i in range(8)]
+    ),
+    "pvesm status": "Name             Type     Status           Total            Used       Available        %\n"
+                    "local             dir     active        98497780        12345678        81099864   12.53%\n"
+                    "local-lvm     lvmthin     active       365760512       123456789       242303723   33.75%",
+    "df -h": "Filesystem      Size  Used Avail Use% Mounted on\n/dev/mapper/pve-root   94G   12G   78G  14% /",
+    "free -h": "               total        used        free      shared  buff/cache   available\n"
+               "Mem:            62Gi        21Gi        30Gi       120Mi        11Gi        41Gi",
+    "~/scripts/estado_ups.sh": "Estado: OL\nCarga batería: 100\nCarga: 23\nAutonomía: 3540",
+}
+
+_SCRIPT = '''#!{python}
+import os, sys, time
+sys.path.insert(0, {ruta_bench!r})
+from ssh_falso import RESPUESTAS
+
+args = sys.argv[1:]
+control, orden, maestra, resto = None, None, False, []
+i = 0
+while i < len(args):
+    a = args[i]
+    if a == "-o":
+        if args[i + 1].startswith("ControlPath="):
+            control = args[i + 1].split("=", 1)[1]
+        i += 2
+        continue
+    if a == "-O":
+        orden = args[i + 1]
+        i += 2
+        continue
+    if a == "-M":
+        maestra = True
+    elif not a.startswith("-"):
+        resto.append(a)
+    i += 1
+
+hay_maestra = bool(control) and os.path.exists(control)
+if orden == "check":
+    sys.exit(0 if hay_maestra else 255)
+if orden == "exit":
+    if hay_maestra:
+        os.unlink(control)
+    sys.exit(0)
+if maestra:
+    time.sleep(float(os.environ.get("BENCH_SSH_HANDSHAKE", "0.15")))
+    if control:
+        open(control, "w").close()
+    sys.exit(0)
+
+comando = " ".join(resto[1:])
+time.sleep(float(os.environ.get("BENCH_SSH_LATENCIA" if hay_maestra else "BENCH_SSH_HANDSHAKE",
+                                "0.02" if hay_maestra else "0.15")))
+for prefijo, salida in RESPUESTAS.items():
+    if comando.startswith(prefijo):
+        print(salida)
+        break
+else:
+    print("ok")
+'''
+
+
+def instalar() -> str:
+    """Escribe el `ssh` falso en un directorio temporal y devuelve ese directorio,
+    que hay que anteponer al PATH."""
+    directorio = tempfile.mkdtemp(prefix="chatty-bench-ssh-")
+    ruta = os.path.join(directorio, "ssh")
+    with open(ruta, "w") as f:
+        f.write(_SCRIPT.format(python=sys.executable, ruta_bench=os.path.dirname(os.path.abspath(__file__))))
+    os.chmod(ruta, os.stat(ruta).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return directorio
@@ -1,22 +1,47 @@
 from langchain_ollama import ChatOllama
 from langchain_core.tools import tool
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langgraph.graph import StateGraph, END
+from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
-from typing import TypedDict, List
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage, SystemMessage
+from typing import Annotated, TypedDict, List
+from langchain_core.messages import (HumanMessage, AIMessage, AIMessageChunk, BaseMessage, RemoveMessage,
+                                     SystemMessage, ToolMessage)
+import json
 import os
 import re
 import inspect
-
-from memory.episodica import cargar, guardar
-from memory.semantica import guardar_hecho, cargar_hechos, como_contexto as contexto_semantico
+import time
+import uuid
+from datetime import datetime
+
+from memory.episodica import cargar, cargar_anteriores, guardar_async, cerrar_escritor, buscar_conversaciones, formatear_conversaciones
+from memory.episodica import como_contexto as contexto_episodico
+from memory.esquema import aplicar as aplicar_migraciones
+from memory.semantica import guardar_hechos, cargar_hechos, como_contexto as contexto_semantico
+from memory.semantica import PRESUPUESTO_CONTEXTO
 from memory.resumenes import como_contexto as contexto_resumenes
+from memory.compactacion import Compactador
+from memory.tokens import estimar_tokens, tokens_mensaje
 from tools.sistema import SISTEMA_TOOLS
 from tools.proxmox import PROXMOX_TOOLS, PROXMOX_ENABLED
 from tools.ssh_pve import SSH_PVE_TOOLS, SSH_ENABLED as SSH_PVE_ENABLED, pve_explorar, pve_ups
+from tools import telemetria
+from tools.telemetria import TELEMETRIA_TOOLS, TELEMETRIA_ENABLED
 
 MODEL = "qwen2.5:latest"
-BASE_URL = "http://127.0.0.1:11434"
+BASE_URL = os.environ.get("CHATTY_OLLAMA_URL", "http://127.0.0.1:11434")
+NUM_CTX = int(os.environ.get("CHATTY_NUM_CTX", "8192"))      # ventana de contexto de Ollama
+KEEP_ALIVE = os.environ.get("CHATTY_KEEP_ALIVE", "30m")      # mantiene el modelo (y su KV-cache) cargado
+# Tokens máximos del prompt; el resto de NUM_CTX queda para la respuesta
+PRESUPUESTO_TOKENS = int(os.environ.get("CHATTY_PRESUPUESTO_TOKENS", str(NUM_CTX - 1536)))
+MAX_CHARS_TOOL_ANTIGUA = 300    # resultados de tools de turnos anteriores se recortan a esto
+MAX_CHARS_TOOL_ACTUAL = 2000    # último recurso para el turno en curso
+FRACCION_COMPACTACION = 0.75    # se compacta al llenarse esta parte del espacio para historial
+STREAMING = os.environ.get("CHATTY_STREAMING", "1") == "1"  # imprimir tokens según llegan
+# Añadir al contexto de cada turno fragmentos relevantes de sesiones anteriores
+CONTEXTO_EPISODICO = os.environ.get("CHATTY_CONTEXTO_EPISODICO", "0") == "1"
+INICIO_SESION = datetime.now()
 
 
 # ── Tools exclusivas de Chatty ────────────────────────────────────────────────
@@ -113,10 +138,36 @@ def recordar_hecho(hecho: str) -> str:
     """Guarda un hecho importante sobre el usuario en la memoria semántica persistente.
     Úsala siempre que el usuario comparta datos personales: nombre, trabajo, ciudad,
     preferencias, habilidades o cualquier información relevante sobre él."""
-    guardar_hecho(hecho)
+    if not guardar_hechos([hecho]):
+        return f"Ya lo recordaba: {hecho}"
     return f"Recordado: {hecho}"
 
 
+@tool
+def buscar_en_historial(consulta: str, k: int = 5) -> str:
+    """Busca en las conversaciones anteriores (también de hace meses) los mensajes más
+    relevantes para la consulta. Úsala cuando el usuario se refiera a algo que se habló antes."""
+    filas = buscar_conversaciones(consulta, k)
+    if not filas:
+        return "No encontré nada relacionado en conversaciones anteriores."
+    return formatear_conversaciones(filas)
+
+
+@tool
+def ver_mensajes_anteriores(cantidad: int = 20) -> str:
+    """Muestra mensajes más antiguos de la conversación que los que tienes en contexto.
+    Cada llamada retrocede una página más. Úsala cuando el usuario pregunte por algo
+    que se dijo hace rato y no aparece en la conversación actual."""
+    mensajes = cargar_anteriores(max(1, min(cantidad, 100)))
+    if not mensajes:
+        return "No hay mensajes anteriores."
+    lineas = []
+    for m in mensajes:
+        contenido = m.content if len(m.content) <= 400 else m.content[:400] + "…"
+        lineas.append(f"{'Usuario' if isinstance(m, HumanMessage) else 'Chatty'}: {contenido}")
+    return "\n".join(lineas)
+
+
 @tool
 def ver_lo_que_recuerdo() -> str:
     """Muestra todos los hechos que recuerdas sobre el usuario."""
@@ -131,59 +182,180 @@ def ver_lo_que_recuerdo() -> str:
 CHATTY_TOOLS = [
     ejecutar_en_laptop,
     crear_archivo, eliminar_archivo, cambiar_permisos,
-    recordar_hecho, ver_lo_que_recuerdo, dia_de_la_semana,
+    recordar_hecho, ver_lo_que_recuerdo, buscar_en_historial, ver_mensajes_anteriores, dia_de_la_semana,
 ]
 
-tools = CHATTY_TOOLS + SISTEMA_TOOLS + SSH_PVE_TOOLS
+tools = (CHATTY_TOOLS + SISTEMA_TOOLS + SSH_PVE_TOOLS
+         + (PROXMOX_TOOLS if PROXMOX_ENABLED else [])
+         + (TELEMETRIA_TOOLS if TELEMETRIA_ENABLED else []))
 
 # Mapa nombre → objeto tool (para el interceptor)
 _TOOLS_MAP: dict = {t.name: t for t in tools}
 # Tools cuyo resultado no necesita re-invocación del LLM (solo guardan, no devuelven datos)
 _TOOLS_SILENCIOSAS: set = {"recordar_hecho"}
 
+# Ollama incluye el esquema JSON de cada tool en el prompt: esa parte de la ventana
+# no está disponible para el system prompt ni para el historial
+TOKENS_TOOLS = estimar_tokens(json.dumps([convert_to_openai_tool(t) for t in tools], ensure_ascii=False))
+PRESUPUESTO_MENSAJES = PRESUPUESTO_TOKENS - TOKENS_TOOLS
+
 
 # ── LLM + grafo ───────────────────────────────────────────────────────────────
 
-llm = ChatOllama(model=MODEL, base_url=BASE_URL, temperature=0.2)
+llm = ChatOllama(model=MODEL, base_url=BASE_URL, temperature=0.2,
+                 num_ctx=NUM_CTX, keep_alive=KEEP_ALIVE)
 llm_with_tools = llm.bind_tools(tools)
 
 
 class State(TypedDict):
-    messages: List[BaseMessage]
+    # Los nodos devuelven solo mensajes nuevos o cambiados (por id); RemoveMessage los quita
+    messages: Annotated[List[BaseMessage], add_messages]
+
+
+def _contexto_de(m: BaseMessage) -> str:
+    """Contexto recuperado en el turno de `m` (va en additional_kwargs, no en content)."""
+    return m.additional_kwargs.get("contexto", "") if isinstance(m, HumanMessage) else ""
+
+
+def _ensamblar(state: State) -> List[BaseMessage]:
+    """Mensajes que se envían al modelo.
+
+    El system prompt y el historial se envían igual en cada turno, byte a byte,
+    para que Ollama reutilice el prefijo ya evaluado en su KV-cache. Ollama junta
+    todos los mensajes de rol system en el bloque de sistema del principio, así
+    que los resúmenes de compactación se envían como mensajes de usuario en su
+    sitio. El contexto recuperado en cada turno se guarda en su HumanMessage y se
+    antepone al contenido al enviarlo, también en los turnos siguientes: así solo
+    se evalúa de nuevo el turno en curso."""
+    mensajes = []
+    for i, m in enumerate(state["messages"]):
+        if i and isinstance(m, SystemMessage):
+            m = HumanMessage(content=m.content)
+        elif _contexto_de(m) and isinstance(m.content, str):
+            m = HumanMessage(content=f"{_contexto_de(m)}\n\n{m.content}", id=m.id)
+        mensajes.append(m)
+    return mensajes
+
+
+def _recortar_tool(m: ToolMessage, max_chars: int) -> ToolMessage:
+    contenido = m.content if isinstance(m.content, str) else str(m.content)
+    if len(contenido) <= max_chars:
+        return m
+    recorte = f"{contenido[:max_chars]}\n...[recortado: {len(contenido) - max_chars} caracteres]"
+    return m.model_copy(update={"content": recorte})
+
+
+def contexto_node(state: State) -> State:
+    """Ajusta state["messages"] a PRESUPUESTO_MENSAJES (el presupuesto del prompt
+    menos los esquemas de las tools) antes de cada llamada al modelo.
+
+    Orden de sacrificio: (1) recortar resultados de tools de turnos anteriores,
+    (2) descartar turnos completos empezando por el más antiguo, (3) recortar
+    los resultados de tools del turno actual. El system prompt y los resúmenes
+    iniciales no se tocan; el historial completo sigue en la BD."""
+    originales = state["messages"]
+    mensajes = list(originales)
+    presupuesto = PRESUPUESTO_MENSAJES
+    costes = [tokens_mensaje(m) for m in mensajes]
+    if sum(costes) <= presupuesto:
+        return {}
+
+    inicio = 0
+    while inicio < len(mensajes) and isinstance(mensajes[inicio], SystemMessage):
+        inicio += 1
+    humanos = [i for i in range(inicio, len(mensajes)) if isinstance(mensajes[i], HumanMessage)]
+    turno_actual = humanos[-1] if humanos else len(mensajes)
+
+    # 1. Resultados de tools antiguos, del más viejo al más nuevo
+    for i in range(inicio, turno_actual):
+        if sum(costes) <= presupuesto:
+            break
+        if isinstance(mensajes[i], ToolMessage):
+            mensajes[i] = _recortar_tool(mensajes[i], MAX_CHARS_TOOL_ANTIGUA)
+            costes[i] = tokens_mensaje(mensajes[i])
+
+    # 2. Turnos completos (humano + respuestas + tools), nunca el actual
+    while sum(costes) > presupuesto and len(humanos) > 1:
+        fin = humanos[1]
+        eliminados = fin - humanos[0]
+        del mensajes[inicio:fin], costes[inicio:fin]
+        humanos = [h - eliminados for h in humanos[1:]]
+
+    # 3. Resultados de tools del turno en curso
+    if sum(costes) > presupuesto:
+        for i in range(humanos[0] if humanos else inicio, len(mensajes)):
+            if isinstance(mensajes[i], ToolMessage):
+                mensajes[i] = _recortar_tool(mensajes[i], MAX_CHARS_TOOL_ACTUAL)
+
+    # Recortar conserva el id, así que add_messages sustituye el mensaje en su sitio
+    conservados = {m.id for m in mensajes}
+    quitados = [RemoveMessage(id=m.id) for m in originales if m.id not in conservados]
+    por_id = {m.id: m for m in originales}
+    recortados = [m for m in mensajes if m is not por_id[m.id]]
+    return {"messages": quitados + recortados}
 
 
 def chat_node(state: State) -> State:
-    resp = llm_with_tools.invoke(state["messages"])
-    return {"messages": state["messages"] + [resp]}
+    resp = llm_with_tools.invoke(_ensamblar(state))
+    return {"messages": [resp]}
 
 
 graph = StateGraph(State)
+graph.add_node("contexto", contexto_node)
 graph.add_node("chat", chat_node)
 graph.add_node("tools", ToolNode(tools))
-graph.set_entry_point("chat")
+graph.set_entry_point("contexto")
+graph.add_edge("contexto", "chat")
 graph.add_conditional_edges("chat", tools_condition)
-graph.add_edge("tools", "chat")
+graph.add_edge("tools", "contexto")
 
 app = graph.compile()
 
 
+def _resumir(prompt: str, transcripcion: str) -> str:
+    r = llm.invoke([SystemMessage(content=prompt), HumanMessage(content=transcripcion)])
+    return r.content if isinstance(r.content, str) else ""
+
+
+def _umbral_compactacion(sistema: str) -> int:
+    """Tokens de historial que disparan la compactación: una fracción de lo que
+    deja PRESUPUESTO_MENSAJES tras el system prompt y el contexto por turno, para
+    que el resumen llegue antes de que contexto_node empiece a descartar turnos."""
+    espacio = PRESUPUESTO_MENSAJES - tokens_mensaje(SystemMessage(content=sistema)) - PRESUPUESTO_CONTEXTO
+    return max(1, int(espacio * FRACCION_COMPACTACION))
+
+
 # ── CLI ───────────────────────────────────────────────────────────────────────
 
+def _mensajes_del_turno(mensajes: List[BaseMessage], humano: HumanMessage) -> List[BaseMessage]:
+    """Desde el mensaje del usuario de este turno hasta el final. Se busca por id,
+    no por posición: contexto_node puede haber quitado mensajes anteriores."""
+    for i in range(len(mensajes) - 1, -1, -1):
+        if mensajes[i].id == humano.id:
+            return mensajes[i:]
+    return [humano]
+
+
 def _describir_tools() -> str:
     grupos = {
         "Archivos y sistema": ["ejecutar_en_laptop", "crear_archivo", "eliminar_archivo", "cambiar_permisos",
-                               "leer_archivo", "listar_directorio", "buscar_archivos",
-                               "buscar_contenido", "ejecutar_comando_seguro"],
+                               "leer_archivo", "buscar_en_archivo", "listar_directorio",
+                               "buscar_archivos", "buscar_contenido", "ejecutar_comando_seguro"],
         "Monitoreo":          ["info_sistema", "uso_disco", "uso_memoria",
                                "procesos_activos", "info_red", "paquetes_instalados"],
-        "Memoria":            ["recordar_hecho", "ver_lo_que_recuerdo"],
+        "Memoria":            ["recordar_hecho", "ver_lo_que_recuerdo", "buscar_en_historial",
+                               "ver_mensajes_anteriores"],
         "Utilidades":         ["dia_de_la_semana"],
     }
     if PROXMOX_ENABLED:
-        grupos["Proxmox API"] = ["proxmox_nodos", "proxmox_vms", "proxmox_cluster", "proxmox_version"]
+        grupos["Proxmox API"] = ["proxmox_nodos", "proxmox_vms", "proxmox_cambios", "proxmox_filtrar",
+                                 "proxmox_cluster", "proxmox_version"]
     if SSH_PVE_ENABLED:
         grupos["Proxmox SSH"] = ["pve_ejecutar", "pve_ups", "pve_version", "pve_vms",
-                                  "pve_contenedores", "pve_almacenamiento", "pve_logs"]
+                                  "pve_contenedores", "pve_almacenamiento", "pve_logs",
+                                  "pve_flota_vms", "pve_flota_contenedores", "pve_flota_almacenamiento"]
+    if TELEMETRIA_ENABLED:
+        grupos["Telemetría"] = ["telemetria_actual", "telemetria_tendencia"]
     lineas = []
     for grupo, nombres in grupos.items():
         lineas.append(f"  {grupo}: {', '.join(nombres)}")
@@ -283,14 +455,83 @@ def _auto_pve(texto: str) -> str:
         return ""
     t = texto.lower()
     if any(k in t for k in _KW_UPS):
-        return pve_ups.invoke({})
+        # Con el muestreador activo la última lectura está en memoria: no hay espera por SSH
+        return telemetria.lectura("ups") if TELEMETRIA_ENABLED else pve_ups.invoke({})
     if any(k in t for k in _KW_EXPLORAR):
         return pve_explorar.invoke({})
     return ""
 
 
+# ── Streaming ────────────────────────────────────────────────────────────────
+
+class _Medidor:
+    """Tiempo hasta el primer y el último token de un turno."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.primero: float | None = None
+        self.ultimo: float | None = None
+
+    def token(self) -> None:
+        ahora = time.perf_counter()
+        if self.primero is None:
+            self.primero = ahora
+        self.ultimo = ahora
+
+    def informe(self) -> str:
+        if self.primero is None:
+            return f"⏱  sin texto · total {time.perf_counter() - self.inicio:.2f}s"
+        return (f"⏱  primer token {self.primero - self.inicio:.2f}s · "
+                f"último token {self.ultimo - self.inicio:.2f}s")
+
+
+def _invocar_streaming(state: State, medidor: _Medidor) -> State:
+    """Como app.invoke(), pero imprime el texto del modelo token a token y una
+    línea de progreso por cada tool que se ejecuta."""
+    final = state
+    escribiendo = False
+    for modo, dato in app.stream(state, stream_mode=["messages", "values"]):
+        if modo == "values":
+            final = dato
+            continue
+        chunk, meta = dato
+        if isinstance(chunk, AIMessageChunk) and meta.get("langgraph_node") == "chat":
+            for tc in chunk.tool_call_chunks or []:
+                if tc.get("name"):
+                    if escribiendo:
+                        print()
+                        escribiendo = False
+                    print(f"🔧 {tc['name']}…", flush=True)
+            if isinstance(chunk.content, str) and chunk.content:
+                if not escribiendo:
+                    print("🦂 Chatty: ", end="", flush=True)
+                    escribiendo = True
+                medidor.token()
+                print(chunk.content, end="", flush=True)
+        elif isinstance(chunk, ToolMessage):
+            print(f"   ↳ {chunk.name}: {len(str(chunk.content))} caracteres", flush=True)
+    if escribiendo:
+        print("\n")
+    return final
+
+
+def _stream_llm(mensajes: List[BaseMessage], medidor: _Medidor) -> AIMessage:
+    print("🦂 Chatty: ", end="", flush=True)
+    partes = []
+    for chunk in llm.stream(mensajes):
+        if isinstance(chunk.content, str) and chunk.content:
+            medidor.token()
+            partes.append(chunk.content)
+            print(chunk.content, end="", flush=True)
+    print("\n")
+    return AIMessage(content="".join(partes))
+
+
 if __name__ == "__main__":
-    mensajes_iniciales = cargar()
+    aplicar_migraciones()
+    if TELEMETRIA_ENABLED:
+        telemetria.iniciar()
+    mensajes_iniciales = cargar(presupuesto_tokens=PRESUPUESTO_MENSAJES // 2)
 
     sistema = SYSTEM_PROMPT
     contexto = "\n\n".join(filter(None, [contexto_resumenes(), contexto_semantico()]))
@@ -298,6 +539,7 @@ if __name__ == "__main__":
         sistema += "\n\n" + contexto
 
     mensajes_iniciales = [SystemMessage(content=sistema)] + mensajes_iniciales
+    compactador = Compactador(_resumir, umbral_tokens=_umbral_compactacion(sistema))
     state: State = {"messages": mensajes_iniciales}
 
     poderes = f"archivos · sistema · memoria"
@@ -313,59 +555,79 @@ if __name__ == "__main__":
     if mensajes_iniciales:
         print()
 
-    while True:
-        user = input("👨 Tú: ").strip()
-        if user.lower() in {"salir", "exit", "quit"}:
-            break
-
-        # Buscar contexto semántico solo si el mensaje es sustancioso
-        ctx_sem = contexto_semantico(user) if len(user) >= 15 else ""
-        if ctx_sem:
-            state["messages"] = [
-                m for m in state["messages"] if not isinstance(m, SystemMessage)
-            ]
-            state["messages"] = [SystemMessage(content=SYSTEM_PROMPT + "\n\n" + ctx_sem + "\n\n" + contexto_resumenes())] + state["messages"]
-
-        n_antes = len(state["messages"])
-
-        # Opción B: pre-ejecutar tool si hay keywords de Proxmox
-        pve_ctx = _auto_pve(user)
-        if pve_ctx:
-            print("🔧 [Auto] Explorando Proxmox via SSH...\n")
-            msg = f"[Datos de Proxmox obtenidos automáticamente]:\n{pve_ctx}\n\nInstrucción del usuario: {user}"
-        else:
-            msg = user
-        state["messages"].append(HumanMessage(content=msg))
-
-        state = app.invoke(state)
-        last = state["messages"][-1]
-
-        if isinstance(last, AIMessage) and isinstance(last.content, str):
-            texto_limpio, ejecutados = _interceptar_y_ejecutar(last.content)
-
-            if ejecutados:
-                silenciosas = {k: v for k, v in ejecutados.items() if k in _TOOLS_SILENCIOSAS}
-                con_datos   = {k: v for k, v in ejecutados.items() if k not in _TOOLS_SILENCIOSAS}
-
-                # Tools silenciosas: solo confirmar, no re-invocar
-                for nombre in silenciosas:
-                    print(f"💾 [{nombre}] guardado en memoria.\n")
-
-                if con_datos:
-                    # Re-invocar LLM con los datos para que los presente correctamente
-                    ctx = "\n".join(f"[Resultado de {k}]:\n{v}" for k, v in con_datos.items())
-                    msgs_reinvoke = state["messages"] + [
-                        HumanMessage(content=f"[Datos obtenidos automáticamente]:\n{ctx}\n\nPresenta estos resultados al usuario de forma clara y en español.")
-                    ]
-                    reinvocado = llm.invoke(msgs_reinvoke)
-                    respuesta_final = reinvocado.content if isinstance(reinvocado.content, str) else texto_limpio
-                    state["messages"].append(AIMessage(content=respuesta_final))
-                else:
-                    respuesta_final = texto_limpio or "Hecho."
-                    state["messages"][-1] = AIMessage(content=respuesta_final)
-
-                print("🦂 Chatty:", respuesta_final, "\n")
+    try:
+        while True:
+            user = input("👨 Tú: ").strip()
+            if user.lower() in {"salir", "exit", "quit"}:
+                break
+
+            # Sustituir el tramo antiguo por su resumen si la compactación terminó
+            state["messages"] = compactador.aplicar(state["messages"])
+
+            # Buscar contexto semántico solo si el mensaje es sustancioso.
+            # Va con el mensaje del usuario (ver _ensamblar), no en el system prompt,
+            # para no romper el prefijo cacheado; no se persiste en el historial.
+            contexto = contexto_semantico(user) if len(user) >= 15 else ""
+            if CONTEXTO_EPISODICO and len(user) >= 15:
+                # Solo sesiones anteriores: la actual ya está en el historial del prompt
+                episodico = contexto_episodico(user, antes=INICIO_SESION)
+                contexto = "\n\n".join(filter(None, [contexto, episodico]))
+
+            # Opción B: pre-ejecutar tool si hay keywords de Proxmox
+            pve_ctx = _auto_pve(user)
+            if pve_ctx:
+                print("🔧 [Auto] Explorando Proxmox via SSH...\n")
+                msg = f"[Datos de Proxmox obtenidos automáticamente]:\n{pve_ctx}\n\nInstrucción del usuario: {user}"
             else:
-                print("🦂 Chatty:", last.content, "\n")
-
-        guardar(state["messages"][n_antes:])
+                msg = user
+            humano = HumanMessage(content=msg, id=str(uuid.uuid4()),
+                                  additional_kwargs={"contexto": contexto} if contexto else {})
+            state["messages"].append(humano)
+
+            medidor = _Medidor()
+            state = _invocar_streaming(state, medidor) if STREAMING else app.invoke(state)
+            last = state["messages"][-1]
+
+            if isinstance(last, AIMessage) and isinstance(last.content, str):
+                texto_limpio, ejecutados = _interceptar_y_ejecutar(last.content)
+
+                if ejecutados:
+                    silenciosas = {k: v for k, v in ejecutados.items() if k in _TOOLS_SILENCIOSAS}
+                    con_datos   = {k: v for k, v in ejecutados.items() if k not in _TOOLS_SILENCIOSAS}
+
+                    # Tools silenciosas: solo confirmar, no re-invocar
+                    for nombre in silenciosas:
+                        print(f"💾 [{nombre}] guardado en memoria.\n")
+
+                    if con_datos:
+                        # Re-invocar LLM con los datos para que los presente correctamente
+                        ctx = "\n".join(f"[Resultado de {k}]:\n{v}" for k, v in con_datos.items())
+                        msgs_reinvoke = _ensamblar(state) + [
+                            HumanMessage(content=f"[Datos obtenidos automáticamente]:\n{ctx}\n\nPresenta estos resultados al usuario de forma clara y en español.")
+                        ]
+                        if STREAMING:
+                            reinvocado = _stream_llm(msgs_reinvoke, medidor)
+                        else:
+                            reinvocado = llm.invoke(msgs_reinvoke)
+                        respuesta_final = reinvocado.content if isinstance(reinvocado.content, str) else texto_limpio
+                        state["messages"].append(AIMessage(content=respuesta_final))
+                    else:
+                        respuesta_final = texto_limpio or "Hecho."
+                        state["messages"][-1] = AIMessage(content=respuesta_final)
+
+                    # En streaming la respuesta ya se mostró según llegaba
+                    if not STREAMING:
+                        print("🦂 Chatty:", respuesta_final, "\n")
+                elif not STREAMING:
+                    print("🦂 Chatty:", last.content, "\n")
+
+            if STREAMING:
+                print(medidor.informe(), "\n")
+
+            guardar_async(_mensajes_del_turno(state["messages"], humano))
+            compactador.revisar(state["messages"])
+    except (KeyboardInterrupt, EOFError):
+        print()
+    finally:
+        # Drenar la cola de escritura antes de salir
+        cerrar_escritor()
@@ -0,0 +1,40 @@
+"""Mantenimiento de la memoria:
+
+    python -m memory migrar
+    python -m memory indexar [hnsw|ivfflat]
+    python -m memory compactar [umbral]
+    python -m memory embeber
+"""
+
+import sys
+
+from . import esquema
+
+
+def main(argv: list[str]) -> int:
+    orden = argv[0] if argv else ""
+    if orden == "migrar":
+        aplicadas = esquema.aplicar()
+        print("Migraciones aplicadas: " + (", ".join(aplicadas) if aplicadas else "ninguna (al día)"))
+        return 0
+    if orden == "indexar":
+        from .semantica import AGENTE
+        tipo = argv[1] if len(argv) > 1 else esquema.TIPO_INDICE_HECHOS
+        print(f"Índice reconstruido: {esquema.reconstruir_indice_hechos(AGENTE, tipo)} ({tipo})")
+        return 0
+    if orden == "compactar":
+        from . import semantica
+        umbral = float(argv[1]) if len(argv) > 1 else semantica.UMBRAL_DUPLICADO
+        asignadas, borradas = semantica.compactar(umbral)
+        print(f"Hechos compactados: {asignadas} claves asignadas, {borradas} duplicados borrados")
+        return 0
+    if orden == "embeber":
+        from .episodica import embeber_pendientes
+        print(f"Mensajes embebidos: {embeber_pendientes()}")
+        return 0
+    print("Uso: python -m memory migrar | indexar [hnsw|ivfflat] | compactar [umbral] | embeber")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+"""Compactación del historial vivo: cuando la conversación supera un umbral de
+turnos o tokens, resume en segundo plano el tramo más antiguo con el LLM,
+lo guarda en `resumenes` y lo sustituye en el estado por el resumen.
+
+El resumen es acumulativo (el tramo incluye el resumen anterior), así que cada
+sesión mantiene una sola fila en `resumenes` que se actualiza en cada pasada."""
+
+import sys
+import threading
+from typing import Callable, List
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage, BaseMessage
+from .resumenes import guardar_resumen
+from .tokens import tokens_mensaje
+
+UMBRAL_TOKENS = 6000     # tokens de historial (sin el system prompt) que disparan la compactación;
+                         # quien conoce el presupuesto del prompt pasa el suyo a Compactador
+UMBRAL_TURNOS = 30       # o turnos humanos, lo que ocurra antes
+TURNOS_A_CONSERVAR = 8   # turnos recientes que nunca se resumen
+MAX_CHARS_TOOL = 500     # recorte de resultados de tools en la transcripción
+
+PREFIJO_RESUMEN = "Resumen de la conversación anterior:\n"
+
+PROMPT_RESUMEN = (
+    "Resume en español la siguiente conversación entre el usuario y Chatty. "
+    "Conserva datos concretos (nombres, rutas, IDs de VMs, decisiones, tareas pendientes) "
+    "y omite saludos y relleno. Máximo 12 viñetas."
+)
+
+
+def _transcripcion(mensajes: List[BaseMessage]) -> str:
+    lineas = []
+    for m in mensajes:
+        contenido = m.content if isinstance(m.content, str) else str(m.content)
+        if isinstance(m, HumanMessage):
+            lineas.append(f"Usuario: {contenido}")
+        elif isinstance(m, AIMessage):
+            if contenido:
+                lineas.append(f"Chatty: {contenido}")
+            for tc in m.tool_calls or []:
+                lineas.append(f"Chatty llamó a {tc.get('name')}({tc.get('args')})")
+        elif isinstance(m, ToolMessage):
+            lineas.append(f"[{m.name or 'tool'}]: {contenido[:MAX_CHARS_TOOL]}")
+        elif isinstance(m, SystemMessage) and contenido.startswith(PREFIJO_RESUMEN):
+            lineas.append(contenido)
+    return "\n".join(lineas)
+
+
+class Compactador:
+    """`resumir(prompt, transcripcion) -> str` lo aporta quien tiene el LLM.
+
+    Uso por turno: `mensajes = c.aplicar(mensajes)` antes de invocar al modelo y
+    `c.revisar(mensajes)` después; el resumen se calcula entre ambos en un hilo."""
+
+    def __init__(self, resumir: Callable[[str, str], str],
+                 umbral_tokens: int = UMBRAL_TOKENS,
+                 umbral_turnos: int = UMBRAL_TURNOS,
+                 conservar: int = TURNOS_A_CONSERVAR):
+        self._resumir = resumir
+        self.umbral_tokens = umbral_tokens
+        self.umbral_turnos = umbral_turnos
+        self.conservar = conservar
+        self._lock = threading.Lock()
+        self._hilo: threading.Thread | None = None
+        self._fin_tramo: BaseMessage | None = None   # último mensaje del tramo en curso
+        self._resumen: str | None = None
+        self._id_resumen: int | None = None          # fila de `resumenes` de esta sesión
+
+    @staticmethod
+    def _inicio(mensajes: List[BaseMessage]) -> int:
+        """Índice del primer mensaje tras el system prompt principal."""
+        return 1 if mensajes and isinstance(mensajes[0], SystemMessage) else 0
+
+    def _fin(self, mensajes: List[BaseMessage]) -> int | None:
+        """Índice (exclusivo) del tramo a resumir: todo menos los últimos `conservar` turnos."""
+        humanos = [i for i, m in enumerate(mensajes) if isinstance(m, HumanMessage)]
+        if len(humanos) <= self.conservar:
+            return None
+        return humanos[-self.conservar]
+
+    def necesita(self, mensajes: List[BaseMessage]) -> bool:
+        historial = mensajes[self._inicio(mensajes):]
+        turnos = sum(isinstance(m, HumanMessage) for m in historial)
+        if turnos <= self.conservar:
+            return False
+        return turnos > self.umbral_turnos or sum(map(tokens_mensaje, historial)) > self.umbral_tokens
+
+    def revisar(self, mensajes: List[BaseMessage]) -> bool:
+        """Lanza la compactación en segundo plano si hace falta y no hay otra en curso."""
+        with self._lock:
+            if (self._hilo is not None and self._hilo.is_alive()) or self._resumen is not None:
+                return False
+            if not self.necesita(mensajes):
+                return False
+            fin = self._fin(mensajes)
+            tramo = mensajes[self._inicio(mensajes):fin]
+            if not tramo:
+                return False
+            self._fin_tramo = tramo[-1]
+            self._hilo = threading.Thread(
+                target=self._trabajar, args=(list(tramo),), name="compactacion", daemon=True
+            )
+            self._hilo.start()
+            return True
+
+    def _trabajar(self, tramo: List[BaseMessage]) -> None:
+        try:
+            resumen = self._resumir(PROMPT_RESUMEN, _transcripcion(tramo)).strip()
+            if resumen:
+                id_resumen = guardar_resumen(resumen, reemplaza=self._id_resumen)
+                with self._lock:
+                    self._id_resumen = id_resumen
+                    self._resumen = resumen
+        except Exception as e:
+            print(f"[memoria] No se pudo compactar el historial: {e}", file=sys.stderr)
+
+    def aplicar(self, mensajes: List[BaseMessage]) -> List[BaseMessage]:
+        """Si hay un resumen listo, sustituye su tramo por un único SystemMessage."""
+        with self._lock:
+            resumen, fin_tramo = self._resumen, self._fin_tramo
+            if resumen is None:
+                return mensajes
+            self._resumen = self._fin_tramo = None
+        # Por id: contexto_node puede haber sustituido el mensaje por una copia recortada
+        fin = next((i for i, m in enumerate(mensajes)
+                    if m is fin_tramo or (fin_tramo.id is not None and m.id == fin_tramo.id)), None)
+        if fin is None:
+            # El tramo ya no está en el estado; el resumen queda en la BD y el
+            # siguiente no lo incluirá, así que irá en una fila nueva
+            with self._lock:
+                self._id_resumen = None
+            return mensajes
+        inicio = self._inicio(mensajes)
+        return mensajes[:inicio] + [SystemMessage(content=PREFIJO_RESUMEN + resumen)] + mensajes[fin + 1:]
+
+    def esperar(self, timeout: float | None = None) -> None:
+        if self._hilo is not None:
+            self._hilo.join(timeout)
@@ -1,28 +1,194 @@
-"""Conexión compartida a PostgreSQL para los módulos de memoria."""
+"""Conexión compartida a PostgreSQL para los módulos de memoria.
 
+Pool propio y seguro entre hilos (el escritor en segundo plano y las tools
+comparten conexiones): comprueba que la conexión siga viva al entregarla,
+hace rollback de transacciones abiertas al devolverla y permite
+`with get_conn() as conn:`. Los hooks de `registrar_hook` reciben el tiempo
+de cada sentencia.
+"""
+
+import atexit
 import os
+import threading
+import time
+from typing import Callable
+
 import psycopg2
-import psycopg2.pool
+import psycopg2.extensions
 from dotenv import load_dotenv
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
 DATABASE_URL = os.environ["DATABASE_URL"]
 
-_pool: psycopg2.pool.SimpleConnectionPool | None = None
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))  # espera máx. por una conexión libre
+PING_TRAS = float(os.environ.get("DB_POOL_PING", "30"))        # inactividad antes de verificar con SELECT 1
+
+# hook(sql, segundos, error) — error es None si la sentencia terminó bien
+HookSentencia = Callable[[str, float, Exception | None], None]
+_hooks: list[HookSentencia] = []
+
+
+class PoolAgotado(psycopg2.OperationalError):
+    """No se liberó ninguna conexión dentro de POOL_TIMEOUT."""
+
+
+def registrar_hook(hook: HookSentencia) -> None:
+    _hooks.append(hook)
+
+
+def quitar_hook(hook: HookSentencia) -> None:
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def _notificar(query, duracion: float, error: Exception | None) -> None:
+    sql = query.decode("utf-8", "replace") if isinstance(query, bytes) else str(query)
+    for hook in list(_hooks):
+        try:
+            hook(sql, duracion, error)
+        except Exception:
+            pass
+
+
+class _CursorCronometrado(psycopg2.extensions.cursor):
+    """Cursor que mide cada execute/executemany y avisa a los hooks registrados."""
+
+    def execute(self, query, vars=None):
+        if not _hooks:
+            return super().execute(query, vars)
+        t0, error = time.perf_counter(), None
+        try:
+            return super().execute(query, vars)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _notificar(query, time.perf_counter() - t0, error)
+
+    def executemany(self, query, vars_list):
+        if not _hooks:
+            return super().executemany(query, vars_list)
+        t0, error = time.perf_counter(), None
+        try:
+            return super().executemany(query, vars_list)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _notificar(query, time.perf_counter() - t0, error)
+
+
+class _Pool:
+    def __init__(self, dsn: str, minconn: int, maxconn: int):
+        self._dsn = dsn
+        self._max = max(1, maxconn)
+        self._libres: list[tuple[psycopg2.extensions.connection, float]] = []
+        self._total = 0
+        self._cond = threading.Condition()
+        for _ in range(min(minconn, self._max)):
+            self._libres.append((self._conectar(), time.monotonic()))
+            self._total += 1
+
+    def _conectar(self) -> psycopg2.extensions.connection:
+        return psycopg2.connect(
+            self._dsn, options="-c client_encoding=UTF8", cursor_factory=_CursorCronometrado
+        )
+
+    @staticmethod
+    def _viva(conn, ultimo_uso: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - ultimo_uso < PING_TRAS:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obtener(self) -> psycopg2.extensions.connection:
+        limite = time.monotonic() + POOL_TIMEOUT
+        while True:
+            with self._cond:
+                while not self._libres and self._total >= self._max:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise PoolAgotado(f"Sin conexiones libres tras {POOL_TIMEOUT:.0f}s (máx. {self._max})")
+                    self._cond.wait(restante)
+                if self._libres:
+                    conn, ultimo_uso = self._libres.pop()
+                else:
+                    conn, ultimo_uso = None, 0.0
+                    self._total += 1
+
+            if conn is None:
+                try:
+                    return self._conectar()
+                except Exception:
+                    self._liberar_hueco()
+                    raise
+            if self._viva(conn, ultimo_uso):
+                return conn
+            # Conexión muerta: se descarta y se vuelve a intentar
+            self._cerrar(conn)
+            self._liberar_hueco()
+
+    def devolver(self, conn, descartar: bool = False) -> None:
+        if not conn.closed and not descartar:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                descartar = True
+        if descartar or conn.closed:
+            self._cerrar(conn)
+            self._liberar_hueco()
+            return
+        with self._cond:
+            self._libres.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _liberar_hueco(self) -> None:
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _cerrar(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def cerrar_todo(self) -> None:
+        with self._cond:
+            libres, self._libres = self._libres, []
+            self._total -= len(libres)
+        for conn, _ in libres:
+            self._cerrar(conn)
+
 
+_pool: _Pool | None = None
+_pool_lock = threading.Lock()
 
-def _get_pool() -> psycopg2.pool.SimpleConnectionPool:
+
+def _get_pool() -> _Pool:
     global _pool
     if _pool is None:
-        _pool = psycopg2.pool.SimpleConnectionPool(
-            1, 5, DATABASE_URL, options="-c client_encoding=UTF8"
-        )
+        with _pool_lock:
+            if _pool is None:
+                _pool = _Pool(DATABASE_URL, POOL_MIN, POOL_MAX)
     return _pool
 
 
 class _PooledConn:
-    """Wrapper que devuelve la conexión al pool en lugar de cerrarla."""
+    """Wrapper que devuelve la conexión al pool en lugar de cerrarla.
+    Como context manager hace rollback si el bloque lanza una excepción."""
 
     def __init__(self, conn):
         self._conn = conn
@@ -33,9 +199,33 @@ class _PooledConn:
     def commit(self):
         return self._conn.commit()
 
+    def rollback(self):
+        return self._conn.rollback()
+
     def close(self):
-        _get_pool().putconn(self._conn)
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            _get_pool().devolver(conn)
+
+    def __enter__(self) -> "_PooledConn":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and self._conn is not None and not self._conn.closed:
+            try:
+                self._conn.rollback()
+            except psycopg2.Error:
+                pass
+        self.close()
 
 
 def get_conn() -> _PooledConn:
-    return _PooledConn(_get_pool().getconn())
+    return _PooledConn(_get_pool().obtener())
+
+
+def cerrar_pool() -> None:
+    if _pool is not None:
+        _pool.cerrar_todo()
+
+
+atexit.register(cerrar_pool)
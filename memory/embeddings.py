@@ -1,13 +1,146 @@
-"""Generación de embeddings usando nomic-embed-text vía Ollama."""
+"""Generación de embeddings usando nomic-embed-text vía Ollama.
+
+Los vectores se cachean en dos niveles: un LRU en proceso y un SQLite en disco
+indexado por (modelo, sha256 del texto). Los textos que no están en caché se
+piden a Ollama en lote, usando la lista como `input` de /api/embed.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
 
 import requests
 
-OLLAMA_URL = "http://127.0.0.1:11434/api/embed"
+OLLAMA_URL = os.environ.get("CHATTY_OLLAMA_URL", "http://127.0.0.1:11434").rstrip("/") + "/api/embed"
 EMBED_MODEL = "nomic-embed-text"
 
+CACHE_LRU = 4096    # vectores en memoria
+LOTE_MAX = 64       # textos por petición a Ollama
+CACHE_PATH = os.environ.get(
+    "CHATTY_EMBED_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "chatty", "embeddings.sqlite"),
+)
+
+_lru: "OrderedDict[tuple[str, str], list[float]]" = OrderedDict()
+_lock = threading.Lock()
+_db: sqlite3.Connection | None = None
+_db_disponible = True
+_session = requests.Session()
+
+
+def _clave(texto: str) -> tuple[str, str]:
+    return EMBED_MODEL, hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _get_db() -> sqlite3.Connection | None:
+    """Abre (una vez) la caché en disco. Si no se puede, se sigue solo con el LRU."""
+    global _db, _db_disponible
+    if _db is None and _db_disponible:
+        try:
+            os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+            _db = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+            _db.execute("PRAGMA journal_mode=WAL")
+            _db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " modelo TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (modelo, hash))"
+            )
+            _db.commit()
+        except sqlite3.Error:
+            _db, _db_disponible = None, False
+    return _db
+
+
+def _lru_put(clave: tuple[str, str], vector: list[float]) -> None:
+    _lru[clave] = vector
+    _lru.move_to_end(clave)
+    while len(_lru) > CACHE_LRU:
+        _lru.popitem(last=False)
+
+
+def _leer_disco(claves: list[tuple[str, str]]) -> dict[tuple[str, str], list[float]]:
+    db = _get_db()
+    if db is None or not claves:
+        return {}
+    encontrados = {}
+    hashes = [h for _, h in claves]
+    try:
+        for i in range(0, len(hashes), 500):
+            trozo = hashes[i:i + 500]
+            filas = db.execute(
+                f"SELECT hash, vector FROM embeddings WHERE modelo = ? "
+                f"AND hash IN ({','.join('?' * len(trozo))})",
+                [EMBED_MODEL, *trozo],
+            ).fetchall()
+            for h, blob in filas:
+                encontrados[(EMBED_MODEL, h)] = array("f", blob).tolist()
+    except sqlite3.Error:
+        return {}
+    return encontrados
+
+
+def _escribir_disco(nuevos: dict[tuple[str, str], list[float]]) -> None:
+    db = _get_db()
+    if db is None or not nuevos:
+        return
+    try:
+        db.executemany(
+            "INSERT OR REPLACE INTO embeddings (modelo, hash, vector) VALUES (?, ?, ?)",
+            [(m, h, array("f", v).tobytes()) for (m, h), v in nuevos.items()],
+        )
+        db.commit()
+    except sqlite3.Error:
+        pass
+
+
+def _pedir_a_ollama(textos: list[str]) -> list[list[float]]:
+    vectores = []
+    for i in range(0, len(textos), LOTE_MAX):
+        resp = _session.post(OLLAMA_URL, json={"model": EMBED_MODEL, "input": textos[i:i + LOTE_MAX]})
+        resp.raise_for_status()
+        vectores.extend(resp.json()["embeddings"])
+    return vectores
+
+
+def get_embeddings(textos: list[str]) -> list[list[float]]:
+    """Convierte varios textos en vectores con una sola ida y vuelta a Ollama
+    para todos los que no estén ya en caché."""
+    claves = [_clave(t) for t in textos]
+    resultado: dict[tuple[str, str], list[float]] = {}
+
+    with _lock:
+        for c in claves:
+            if c in _lru:
+                _lru.move_to_end(c)
+                resultado[c] = _lru[c]
+        faltan = [c for c in dict.fromkeys(claves) if c not in resultado]
+        if faltan:
+            for c, v in _leer_disco(faltan).items():
+                _lru_put(c, v)
+                resultado[c] = v
+
+    pendientes = {c: t for c, t in zip(claves, textos) if c not in resultado}
+    if pendientes:
+        vectores = _pedir_a_ollama(list(pendientes.values()))
+        nuevos = dict(zip(pendientes.keys(), vectores))
+        with _lock:
+            for c, v in nuevos.items():
+                _lru_put(c, v)
+            _escribir_disco(nuevos)
+        resultado.update(nuevos)
+
+    return [resultado[c] for c in claves]
+
 
 def get_embedding(texto: str) -> list[float]:
     """Convierte un texto en su vector de embeddings (768 dimensiones)."""
-    resp = requests.post(OLLAMA_URL, json={"model": EMBED_MODEL, "input": texto})
-    resp.raise_for_status()
-    return resp.json()["embeddings"][0]
+    return get_embeddings([texto])[0]
+
+
+def como_literal(vector: list[float]) -> str:
+    """Vector en el formato de entrada de pgvector ('[x,y,...]') con la precisión
+    de float4, que es la que guarda la columna: ~40% más corto que str(list)."""
+    return "[" + ",".join(f"{x:.9g}" for x in vector) + "]"
@@ -1,50 +1,369 @@
-"""Memoria episódica — historial de conversación (PostgreSQL)."""
+"""Memoria episódica — historial de conversación (PostgreSQL).
 
-from typing import List
+Además de la ventana reciente que se carga al arrancar, `buscar_conversaciones`
+recupera los intercambios antiguos relevantes para una consulta, fusionando
+por rangos (RRF) la búsqueda vectorial sobre los embeddings de cada mensaje,
+que el escritor en segundo plano calcula tras insertar, y la de texto completo
+sobre la columna tsvector.
+"""
+
+import atexit
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, List
+import psycopg2
+from psycopg2.extras import execute_values
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 from .db import get_conn
+from .embeddings import como_literal, get_embedding, get_embeddings
+from .tokens import tokens_mensaje
 
 AGENTE = "chatty"
+VENTANA_TURNOS = 20     # turnos (mensajes humanos) que se cargan al arrancar
+PAGINA = 100            # filas por página al recorrer el historial hacia atrás
+LOTE_ESCRITURA = 200    # filas máximas por INSERT del escritor en segundo plano
+REINTENTOS = 5
+MAX_CHARS_EMBEDDING = 2000   # los mensajes más largos se embeben truncados
+CANDIDATOS = 30              # resultados por método antes de fusionar
+RRF_K = 60                   # constante de Reciprocal Rank Fusion
+MAX_CHARS_FRAGMENTO = 400    # recorte de cada mensaje recuperado al formatearlo
+
+Cursor = tuple[datetime, int]
 
+# Fila más antigua ya entregada; cargar_anteriores() continúa desde aquí
+_cursor: Cursor | None = None
+_agotado = False
+# Ids de la ventana que cargar() puso en el prompt; buscar_conversaciones() no los repite
+_en_contexto: set[int] = set()
 
-def cargar() -> List[BaseMessage]:
+
+def _leer_pagina(antes: Cursor | None, limite: int) -> list[tuple]:
+    """Filas (id, timestamp, role, content) más recientes que `antes`, de nueva a vieja.
+    Paginación por keyset sobre (agente, timestamp, id): sin OFFSET."""
     conn = get_conn()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT role, content FROM conversaciones "
-                "WHERE agente = %s ORDER BY timestamp ASC",
-                (AGENTE,)
+            if antes is None:
+                cur.execute(
+                    "SELECT id, timestamp, role, content FROM conversaciones "
+                    "WHERE agente = %s ORDER BY timestamp DESC, id DESC LIMIT %s",
+                    (AGENTE, limite)
+                )
+            else:
+                cur.execute(
+                    "SELECT id, timestamp, role, content FROM conversaciones "
+                    "WHERE agente = %s AND (timestamp, id) < (%s, %s) "
+                    "ORDER BY timestamp DESC, id DESC LIMIT %s",
+                    (AGENTE, antes[0], antes[1], limite)
+                )
+            return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def _a_mensaje(role: str, content: str) -> BaseMessage | None:
+    if role == "human":
+        return HumanMessage(content=content)
+    if role == "ai":
+        return AIMessage(content=content)
+    return None
+
+
+def cargar(turnos: int = VENTANA_TURNOS, presupuesto_tokens: int | None = None) -> List[BaseMessage]:
+    """Carga solo la cola del historial: los últimos `turnos` turnos o, si se indica,
+    lo que quepa en `presupuesto_tokens`. El resto queda accesible con cargar_anteriores()."""
+    global _cursor, _agotado, _en_contexto
+    _cursor, _agotado = None, False
+    seleccion: list[tuple[Cursor, BaseMessage]] = []
+    pagina: Cursor | None = None
+    humanos = tokens = 0
+    lleno = False
+
+    while not lleno and not _agotado:
+        filas = _leer_pagina(pagina, PAGINA)
+        _agotado = len(filas) < PAGINA
+        for id_, ts, role, content in filas:
+            pagina = (ts, id_)
+            m = _a_mensaje(role, content)
+            if m is None:
+                continue
+            coste = tokens_mensaje(m)
+            if presupuesto_tokens is not None and seleccion and tokens + coste > presupuesto_tokens:
+                lleno = True
+                break
+            seleccion.append((pagina, m))
+            tokens += coste
+            if isinstance(m, HumanMessage):
+                humanos += 1
+                if humanos >= turnos:
+                    lleno = True
+                    break
+
+    seleccion.reverse()
+    # Empezar siempre en un mensaje humano para no dejar respuestas huérfanas
+    while seleccion and not isinstance(seleccion[0][1], HumanMessage):
+        seleccion.pop(0)
+    if seleccion:
+        _cursor = seleccion[0][0]
+        _agotado = False
+    else:
+        _cursor = pagina
+    _en_contexto = {c[1] for c, _ in seleccion}
+    return [m for _, m in seleccion]
+
+
+def cargar_anteriores(limite: int = PAGINA) -> List[BaseMessage]:
+    """Devuelve (en orden cronológico) la página anterior a lo ya cargado.
+    Lista vacía cuando no queda historial."""
+    global _cursor, _agotado
+    if _agotado or _cursor is None:
+        return []
+    filas = _leer_pagina(_cursor, limite)
+    _agotado = len(filas) < limite
+    if filas:
+        _cursor = (filas[-1][1], filas[-1][0])
+    mensajes = [_a_mensaje(role, content) for _, _, role, content in reversed(filas)]
+    return [m for m in mensajes if m is not None]
+
+
+def _filas(mensajes: List[BaseMessage]) -> list[tuple]:
+    """(agente, role, content, timestamp) de los mensajes que se persisten.
+    El timestamp se fija aquí para conservar el orden aunque la escritura se retrase."""
+    filas = []
+    for m in mensajes:
+        if isinstance(m, HumanMessage):
+            filas.append((AGENTE, "human", m.content, datetime.now()))
+        elif isinstance(m, AIMessage) and isinstance(m.content, str):
+            filas.append((AGENTE, "ai", m.content, datetime.now()))
+    return filas
+
+
+def _insertar(filas: list[tuple]) -> list[int]:
+    """Inserta las filas y devuelve sus ids, en el mismo orden."""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            ids = execute_values(
+                cur,
+                "INSERT INTO conversaciones (agente, role, content, timestamp) VALUES %s RETURNING id",
+                filas,
+                fetch=True,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    return [row[0] for row in ids]
+
+
+def _guardar_embeddings(ids: list[int], contenidos: list[str]) -> None:
+    # Las respuestas vacías (p. ej. solo tool_calls) no tienen nada que embeber
+    pares = [(i, c) for i, c in zip(ids, contenidos) if c and c.strip()]
+    if not pares:
+        return
+    ids = [i for i, _ in pares]
+    vectores = get_embeddings([c[:MAX_CHARS_EMBEDDING] for _, c in pares])
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                "UPDATE conversaciones AS c SET embedding = v.e::vector FROM (VALUES %s) AS v(id, e) "
+                "WHERE c.id = v.id",
+                [(i, como_literal(v)) for i, v in zip(ids, vectores)],
             )
-            rows = cur.fetchall()
+        conn.commit()
     finally:
         conn.close()
 
-    mensajes = []
-    for role, content in rows:
-        if role == "human":
-            mensajes.append(HumanMessage(content=content))
-        elif role == "ai":
-            mensajes.append(AIMessage(content=content))
-    return mensajes
+
+def embeber_pendientes(lote: int = 64) -> int:
+    """Calcula los embeddings que falten (historial previo o fallos de Ollama). Devuelve cuántos."""
+    total = 0
+    while True:
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT id, content FROM conversaciones WHERE agente = %s AND embedding IS NULL "
+                    "AND content ~ '\\S' ORDER BY id LIMIT %s",
+                    (AGENTE, lote),
+                )
+                filas = cur.fetchall()
+        finally:
+            conn.close()
+        if not filas:
+            return total
+        _guardar_embeddings([f[0] for f in filas], [f[1] for f in filas])
+        total += len(filas)
 
 
 def guardar(mensajes: List[BaseMessage]) -> None:
     """Inserta solo los mensajes recibidos (sin borrar el historial previo)."""
+    filas = _filas(mensajes)
+    if filas:
+        _insertar(filas)
+
+
+class _EscritorDiferido:
+    """Hilo que persiste en lotes lo encolado por guardar_async(), con reintentos
+    ante errores transitorios de conexión."""
+
+    _FIN = object()
+
+    def __init__(self):
+        self._cola: queue.Queue = queue.Queue()
+        self._hilo: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def encolar(self, filas: list[tuple]) -> None:
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="episodica-escritor", daemon=True)
+                self._hilo.start()
+        self._cola.put(filas)
+
+    def _bucle(self) -> None:
+        while True:
+            item = self._cola.get()
+            lote, n_items, fin = [], 1, item is self._FIN
+            if not fin:
+                lote.extend(item)
+            # Agrupar lo que ya esté esperando en la cola
+            while not fin and len(lote) < LOTE_ESCRITURA:
+                try:
+                    item = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                n_items += 1
+                if item is self._FIN:
+                    fin = True
+                else:
+                    lote.extend(item)
+            if lote:
+                self._escribir(lote)
+            for _ in range(n_items):
+                self._cola.task_done()
+            if fin:
+                return
+
+    def _escribir(self, lote: list[tuple]) -> None:
+        for intento in range(REINTENTOS):
+            try:
+                ids = _insertar(lote)
+                break
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if intento == REINTENTOS - 1:
+                    print(f"[memoria] No se pudieron guardar {len(lote)} mensajes: {e}", file=sys.stderr)
+                    return
+                time.sleep(0.5 * 2 ** intento)
+            except Exception as e:
+                print(f"[memoria] Error guardando {len(lote)} mensajes: {e}", file=sys.stderr)
+                return
+        # Los mensajes ya están a salvo; sin embedding solo se pierde la búsqueda vectorial
+        try:
+            _guardar_embeddings(ids, [fila[2] for fila in lote])
+        except Exception as e:
+            print(f"[memoria] Mensajes guardados sin embedding ({e}); "
+                  f"se pueden completar con `python -m memory embeber`", file=sys.stderr)
+
+    def vaciar(self) -> None:
+        """Bloquea hasta que todo lo encolado esté escrito."""
+        if self._hilo is not None and self._hilo.is_alive():
+            self._cola.join()
+
+    def cerrar(self, timeout: float = 10.0) -> None:
+        """Drena la cola y detiene el hilo."""
+        if self._hilo is not None and self._hilo.is_alive():
+            self._cola.put(self._FIN)
+            self._hilo.join(timeout)
+
+
+_escritor = _EscritorDiferido()
+atexit.register(_escritor.cerrar)
+
+
+def guardar_async(mensajes: List[BaseMessage]) -> None:
+    """Como guardar(), pero sin esperar a la base de datos: encola y vuelve."""
+    filas = _filas(mensajes)
+    if filas:
+        _escritor.encolar(filas)
+
+
+def vaciar_pendientes() -> None:
+    _escritor.vaciar()
+
+
+def cerrar_escritor(timeout: float = 10.0) -> None:
+    _escritor.cerrar(timeout)
+
+
+# ── Recuperación por relevancia ──────────────────────────────────────────────
+
+def buscar_conversaciones(query: str, k: int = 5, antes: datetime | None = None,
+                          excluir: Iterable[int] | None = None) -> list[tuple]:
+    """Los `k` mensajes más relevantes para `query` como (timestamp, role, content).
+
+    Combina el ranking vectorial (HNSW) y el de texto completo (GIN, 'spanish')
+    con Reciprocal Rank Fusion: puntuación = Σ 1 / (RRF_K + rango). `antes`
+    excluye lo más reciente (p. ej. la sesión actual, que ya está en el prompt)
+    y `excluir` esos ids; por defecto, los de la ventana que cargó cargar()."""
+    embedding = get_embedding(query[:MAX_CHARS_EMBEDDING])
+    params = {"agente": AGENTE, "e": como_literal(embedding), "q": query, "n": CANDIDATOS,
+              "k": k, "rrf": RRF_K, "antes": antes or datetime.max,
+              "excluir": sorted(_en_contexto if excluir is None else excluir)}
     conn = get_conn()
     try:
         with conn.cursor() as cur:
-            for m in mensajes:
-                if isinstance(m, HumanMessage):
-                    cur.execute(
-                        "INSERT INTO conversaciones (agente, role, content) VALUES (%s, %s, %s)",
-                        (AGENTE, "human", m.content)
-                    )
-                elif isinstance(m, AIMessage) and isinstance(m.content, str):
-                    cur.execute(
-                        "INSERT INTO conversaciones (agente, role, content) VALUES (%s, %s, %s)",
-                        (AGENTE, "ai", m.content)
-                    )
-        conn.commit()
+            cur.execute(
+                """
+                WITH vec AS (
+                    SELECT id, row_number() OVER (ORDER BY distancia) AS r FROM (
+                        SELECT id, embedding <=> %(e)s::vector AS distancia FROM conversaciones
+                        WHERE agente = %(agente)s AND embedding IS NOT NULL AND timestamp < %(antes)s
+                          AND id <> ALL(%(excluir)s::bigint[])
+                        ORDER BY embedding <=> %(e)s::vector
+                        LIMIT %(n)s
+                    ) x
+                ),
+                txt AS (
+                    SELECT id, row_number() OVER (ORDER BY rango DESC) AS r FROM (
+                        SELECT id, ts_rank_cd(texto_busqueda, q) AS rango
+                        FROM conversaciones, websearch_to_tsquery('spanish', %(q)s) AS q
+                        WHERE agente = %(agente)s AND texto_busqueda @@ q AND timestamp < %(antes)s
+                          AND id <> ALL(%(excluir)s::bigint[])
+                        ORDER BY rango DESC
+                        LIMIT %(n)s
+                    ) x
+                )
+                SELECT c.timestamp, c.role, c.content
+                FROM (SELECT id FROM vec UNION SELECT id FROM txt) u
+                JOIN conversaciones c ON c.id = u.id
+                LEFT JOIN vec ON vec.id = u.id
+                LEFT JOIN txt ON txt.id = u.id
+                ORDER BY coalesce(1.0 / (%(rrf)s + vec.r), 0) + coalesce(1.0 / (%(rrf)s + txt.r), 0) DESC
+                LIMIT %(k)s
+                """,
+                params,
+            )
+            return cur.fetchall()
     finally:
         conn.close()
+
+
+def formatear_conversaciones(filas: list[tuple]) -> str:
+    lineas = []
+    for ts, role, content in sorted(filas):
+        texto = content if len(content) <= MAX_CHARS_FRAGMENTO else content[:MAX_CHARS_FRAGMENTO] + "…"
+        lineas.append(f"[{ts:%Y-%m-%d %H:%M}] {'Usuario' if role == 'human' else 'Chatty'}: {texto}")
+    return "\n".join(lineas)
+
+
+def como_contexto(query: str, k: int = 3, antes: datetime | None = None) -> str:
+    """Bloque de contexto con los fragmentos de conversaciones anteriores relevantes."""
+    filas = buscar_conversaciones(query, k, antes)
+    if not filas:
+        return ""
+    return "Fragmentos relevantes de conversaciones anteriores:\n" + formatear_conversaciones(filas)
@@ -0,0 +1,107 @@
+"""Migraciones del esquema de memoria (PostgreSQL).
+
+Cada migración es una lista de sentencias idempotentes; las aplicadas se
+registran en `schema_migraciones` para no repetirlas.
+
+También gestiona el índice ANN de `hechos.embedding`: uno parcial por agente
+(`WHERE agente = ...`), HNSW por defecto o IVFFlat con CHATTY_INDICE_HECHOS.
+"""
+
+import math
+import os
+import re
+
+from .db import get_conn
+
+TIPO_INDICE_HECHOS = os.environ.get("CHATTY_INDICE_HECHOS", "hnsw")   # hnsw | ivfflat
+HNSW_M = 16
+HNSW_EF_CONSTRUCCION = 64
+
+
+def nombre_indice_hechos(agente: str) -> str:
+    return "hechos_embedding_" + re.sub(r"\W", "_", agente.lower()) + "_idx"
+
+
+def sentencias_indice_hechos(agente: str, tipo: str = TIPO_INDICE_HECHOS, filas: int = 0) -> list[str]:
+    """CREATE INDEX del índice ANN parcial de `agente` (distancia coseno, la del operador <=>).
+    Para IVFFlat, `filas` fija el número de listas (filas/1000, mínimo 10, o √filas a partir de 1M)."""
+    nombre = nombre_indice_hechos(agente)
+    literal = "'" + agente.replace("'", "''") + "'"
+    if tipo == "ivfflat":
+        listas = max(10, filas // 1000 if filas <= 1_000_000 else int(math.sqrt(filas)))
+        metodo = f"ivfflat (embedding vector_cosine_ops) WITH (lists = {listas})"
+    elif tipo == "hnsw":
+        metodo = (f"hnsw (embedding vector_cosine_ops) "
+                  f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCCION})")
+    else:
+        raise ValueError(f"Tipo de índice desconocido: {tipo!r} (hnsw o ivfflat)")
+    return [f"CREATE INDEX IF NOT EXISTS {nombre} ON hechos USING {metodo} WHERE agente = {literal}"]
+
+
+MIGRACIONES: list[tuple[str, list[str]]] = [
+    ("001_conversaciones_keyset", [
+        "ALTER TABLE conversaciones ADD COLUMN IF NOT EXISTS id BIGSERIAL",
+        "CREATE INDEX IF NOT EXISTS conversaciones_agente_ts_idx "
+        "ON conversaciones (agente, timestamp DESC, id DESC)",
+    ]),
+    ("002_hechos_indice_ann", sentencias_indice_hechos("chatty")),
+    ("003_hechos_clave", [
+        "ALTER TABLE hechos ADD COLUMN IF NOT EXISTS id BIGSERIAL",
+        "ALTER TABLE hechos ADD COLUMN IF NOT EXISTS clave TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS hechos_agente_clave_idx "
+        "ON hechos (agente, clave) WHERE clave IS NOT NULL",
+    ]),
+    ("004_conversaciones_busqueda", [
+        "ALTER TABLE conversaciones ADD COLUMN IF NOT EXISTS embedding vector(768)",
+        "ALTER TABLE conversaciones ADD COLUMN IF NOT EXISTS texto_busqueda tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('spanish', content)) STORED",
+        "CREATE INDEX IF NOT EXISTS conversaciones_texto_idx ON conversaciones USING gin (texto_busqueda)",
+        "CREATE INDEX IF NOT EXISTS conversaciones_embedding_chatty_idx ON conversaciones "
+        f"USING hnsw (embedding vector_cosine_ops) WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCCION}) "
+        "WHERE agente = 'chatty'",
+    ]),
+]
+
+
+def aplicar() -> list[str]:
+    """Aplica las migraciones pendientes y devuelve sus nombres."""
+    conn = get_conn()
+    aplicadas = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migraciones ("
+                " nombre TEXT PRIMARY KEY, aplicada TIMESTAMP NOT NULL DEFAULT now())"
+            )
+            cur.execute("SELECT nombre FROM schema_migraciones")
+            hechas = {row[0] for row in cur.fetchall()}
+        conn.commit()
+        for nombre, sentencias in MIGRACIONES:
+            if nombre in hechas:
+                continue
+            with conn.cursor() as cur:
+                for sql in sentencias:
+                    cur.execute(sql)
+                cur.execute("INSERT INTO schema_migraciones (nombre) VALUES (%s)", (nombre,))
+            conn.commit()
+            aplicadas.append(nombre)
+    finally:
+        conn.close()
+    return aplicadas
+
+
+def reconstruir_indice_hechos(agente: str, tipo: str = TIPO_INDICE_HECHOS) -> str:
+    """Vuelve a crear el índice ANN de `agente` (p. ej. para pasar a IVFFlat cuando ya
+    hay datos, o recalcular sus listas tras crecer). Devuelve el nombre del índice."""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM hechos WHERE agente = %s", (agente,))
+            filas = cur.fetchone()[0]
+            cur.execute(f"DROP INDEX IF EXISTS {nombre_indice_hechos(agente)}")
+            for sql in sentencias_indice_hechos(agente, tipo, filas):
+                cur.execute(sql)
+        conn.commit()
+    finally:
+        conn.close()
+    return nombre_indice_hechos(agente)
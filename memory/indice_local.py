@@ -0,0 +1,205 @@
+"""Índice vectorial local de `hechos` (opcional, requiere NumPy).
+
+Con CHATTY_BACKEND_SEMANTICO=local, memory.semantica busca por similitud en
+una copia de los embeddings de PostgreSQL guardada como matriz float32
+contigua y mapeada desde disco (np.memmap), con las filas ya normalizadas: el
+top-k es un producto matriz-vector más `argpartition`. PostgreSQL sigue siendo
+la fuente de verdad; la copia se actualiza de forma incremental por
+(timestamp, id) en un hilo en segundo plano y se reconstruye entera si faltan
+filas (borrados).
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # el backend local es opcional
+    np = None
+
+from .db import get_conn
+
+DISPONIBLE = np is not None
+DIRECTORIO = os.environ.get(
+    "CHATTY_INDICE_LOCAL_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "chatty", "hechos"),
+)
+REFRESCO_SEG = 30            # antigüedad a partir de la cual se pide un refresco en segundo plano
+CAPACIDAD_INICIAL = 1024     # filas; el archivo dobla su tamaño al llenarse
+
+
+class _Espejo:
+    """Copia local de los embeddings de un agente: matriz en disco + metadatos JSON."""
+
+    def __init__(self, agente: str):
+        self.agente = agente
+        self.dir = os.path.join(DIRECTORIO, agente)
+        self.lock = threading.Lock()
+        self.matriz = None                  # np.memmap (capacidad, dim)
+        self.n = 0
+        self.ids: list[int] = []
+        self.textos: list[str] = []
+        self.fila: dict[int, int] = {}      # id → fila
+        self.cursor: tuple[str, int] | None = None   # (timestamp ISO, id) de la última fila vista
+        self.actualizado = 0.0
+        self.obsoleto = True
+        self._refrescando = threading.Lock()
+        self._cargar()
+
+    # ── Persistencia ─────────────────────────────────────────────────────────
+
+    def _ruta(self, nombre: str) -> str:
+        return os.path.join(self.dir, nombre)
+
+    def _cargar(self) -> None:
+        try:
+            with open(self._ruta("meta.json")) as f:
+                meta = json.load(f)
+            self.matriz = np.memmap(self._ruta("vectores.f32"), dtype=np.float32, mode="r+",
+                                    shape=(meta["capacidad"], meta["dim"]))
+        except (OSError, ValueError, KeyError):
+            return  # sin copia local todavía: se construye en el primer refresco
+        self.n, self.ids, self.textos = meta["n"], meta["ids"], meta["textos"]
+        self.cursor = tuple(meta["cursor"]) if meta["cursor"] else None
+        self.fila = {id_: i for i, id_ in enumerate(self.ids)}
+
+    def _guardar_meta(self) -> None:
+        meta = {"n": self.n, "dim": self.matriz.shape[1], "capacidad": self.matriz.shape[0],
+                "cursor": self.cursor, "ids": self.ids, "textos": self.textos}
+        tmp = self._ruta("meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._ruta("meta.json"))
+
+    def _reservar(self, filas: int, dim: int) -> None:
+        """Garantiza capacidad para `filas`; al crecer copia a un archivo nuevo del doble de tamaño."""
+        if self.matriz is not None and self.matriz.shape[0] >= filas and self.matriz.shape[1] == dim:
+            return
+        capacidad = max(CAPACIDAD_INICIAL, self.matriz.shape[0] if self.matriz is not None else 0)
+        while capacidad < filas:
+            capacidad *= 2
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self._ruta("vectores.f32.tmp")
+        nueva = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(capacidad, dim))
+        if self.matriz is not None and self.matriz.shape[1] == dim and self.n:
+            nueva[:self.n] = self.matriz[:self.n]
+        nueva.flush()
+        os.replace(tmp, self._ruta("vectores.f32"))
+        self.matriz = nueva
+
+    # ── Refresco desde PostgreSQL ────────────────────────────────────────────
+
+    def refrescar(self) -> None:
+        """Trae las filas nuevas o modificadas desde el cursor; si hay borrados, reconstruye."""
+        if not self._refrescando.acquire(blocking=False):
+            return
+        try:
+            conn = get_conn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT count(*) FROM hechos WHERE agente = %s AND embedding IS NOT NULL",
+                                (self.agente,))
+                    total = cur.fetchone()[0]
+                    cursor = self.cursor if total >= self.n else None  # menos filas: hubo borrados
+                    if cursor is None:
+                        cur.execute(
+                            "SELECT id, timestamp, hecho, embedding::text FROM hechos "
+                            "WHERE agente = %s AND embedding IS NOT NULL ORDER BY timestamp, id",
+                            (self.agente,),
+                        )
+                    else:
+                        cur.execute(
+                            "SELECT id, timestamp, hecho, embedding::text FROM hechos "
+                            "WHERE agente = %s AND embedding IS NOT NULL AND (timestamp, id) > (%s, %s) "
+                            "ORDER BY timestamp, id",
+                            (self.agente, *cursor),
+                        )
+                    filas = cur.fetchall()
+            finally:
+                conn.close()
+            with self.lock:
+                if cursor is None:
+                    self.n, self.ids, self.textos, self.fila = 0, [], [], {}
+                self._aplicar(filas)
+                if self.n != total:
+                    # upserts y borrados cruzados que el cursor no ve: copia completa la próxima vez
+                    self.cursor = None
+                self.actualizado = time.time()
+                self.obsoleto = self.cursor is None
+        except Exception as e:
+            print(f"[memoria] No se pudo refrescar el índice local: {e}", file=sys.stderr)
+        finally:
+            self._refrescando.release()
+
+    def _aplicar(self, filas: list[tuple]) -> None:
+        if not filas:
+            return
+        vectores = np.array([json.loads(e) for _, _, _, e in filas], dtype=np.float32)
+        normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+        vectores /= np.where(normas == 0, 1, normas)
+        self._reservar(self.n + len(filas), vectores.shape[1])
+        for (id_, ts, hecho, _), v in zip(filas, vectores):
+            i = self.fila.get(id_)
+            if i is None:  # fila nueva; las ya conocidas (upsert por clave) se sobrescriben
+                i = self.fila[id_] = self.n
+                self.ids.append(id_)
+                self.textos.append(hecho)
+                self.n += 1
+            else:
+                self.textos[i] = hecho
+            self.matriz[i] = v
+        ultimo = filas[-1]
+        self.cursor = (ultimo[1].isoformat(), ultimo[0])
+        self.matriz.flush()
+        self._guardar_meta()
+
+    # ── Búsqueda ─────────────────────────────────────────────────────────────
+
+    def buscar(self, embedding: list[float], top_k: int, con_vectores: bool = False) -> list | None:
+        if self.matriz is None or self.cursor is None and not self.n:
+            self.refrescar()  # primera vez: hay que esperar a tener algo
+        elif self.obsoleto or time.time() - self.actualizado > REFRESCO_SEG:
+            threading.Thread(target=self.refrescar, name="indice-local", daemon=True).start()
+        with self.lock:
+            if self.matriz is None:
+                return None
+            if not self.n:
+                return []
+            q = np.asarray(embedding, dtype=np.float32)
+            q /= np.linalg.norm(q) or 1.0
+            similitudes = self.matriz[:self.n] @ q
+            k = min(top_k, self.n)
+            mejores = np.argpartition(-similitudes, k - 1)[:k]
+            mejores = mejores[np.argsort(-similitudes[mejores])]
+            if con_vectores:
+                return [(self.textos[i], np.array(self.matriz[i])) for i in mejores]
+            return [self.textos[i] for i in mejores]
+
+
+_espejos: dict[str, _Espejo] = {}
+_espejos_lock = threading.Lock()
+
+
+def _espejo(agente: str) -> _Espejo:
+    with _espejos_lock:
+        if agente not in _espejos:
+            _espejos[agente] = _Espejo(agente)
+        return _espejos[agente]
+
+
+def buscar(agente: str, embedding: list[float], top_k: int, con_vectores: bool = False) -> list | None:
+    """Top-k por similitud coseno en la copia local: textos, o (texto, vector) con
+    `con_vectores`. None si el backend no está disponible (sin NumPy o sin poder
+    construir la copia): usar PostgreSQL."""
+    if not DISPONIBLE:
+        return None
+    return _espejo(agente).buscar(embedding, top_k, con_vectores)
+
+
+def invalidar(agente: str) -> None:
+    """Tras escribir en `hechos`: la próxima búsqueda refresca en segundo plano."""
+    if DISPONIBLE and agente in _espejos:
+        _espejos[agente].obsoleto = True
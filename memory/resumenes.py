@@ -1,40 +1,93 @@
 """Memoria de resúmenes — resúmenes de sesiones anteriores (PostgreSQL)."""
 
+import os
 from datetime import datetime
 from .db import get_conn
 
 AGENTE = "chatty"
+# Si está activo, cada lectura del contexto cacheado comprueba max(timestamp)/count(*)
+# para ver escrituras de otros procesos. Si no, solo se invalida con guardar_resumen().
+VERIFICAR_VERSION = os.environ.get("CHATTY_CACHE_VERSIONADA", "0") == "1"
+# Resúmenes más recientes que entran en el system prompt; cada uno ya acumula los anteriores de su sesión
+MAX_RESUMENES = int(os.environ.get("CHATTY_MAX_RESUMENES", "3"))
 
+_cache_contexto: str | None = None
+_cache_version: tuple | None = None
 
-def guardar_resumen(resumen: str) -> None:
+
+def guardar_resumen(resumen: str, reemplaza: int | None = None) -> int:
+    """Inserta un resumen y devuelve su id. Con `reemplaza`, actualiza esa fila
+    (resumen acumulado de la misma sesión) en lugar de añadir otra."""
+    global _cache_contexto
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            fila = None
+            if reemplaza is not None:
+                cur.execute(
+                    "UPDATE resumenes SET resumen = %s, timestamp = %s WHERE id = %s AND agente = %s RETURNING id",
+                    (resumen, datetime.now(), reemplaza, AGENTE)
+                )
+                fila = cur.fetchone()
+            if fila is None:
+                cur.execute(
+                    "INSERT INTO resumenes (agente, resumen, timestamp) VALUES (%s, %s, %s) RETURNING id",
+                    (AGENTE, resumen, datetime.now())
+                )
+                fila = cur.fetchone()
+        conn.commit()
+        _cache_contexto = None
+        return fila[0]
+    finally:
+        conn.close()
+
+
+def cargar_resumenes(limite: int | None = None) -> list[str]:
+    """Resúmenes en orden cronológico; con `limite`, solo los más recientes."""
     conn = get_conn()
     try:
         with conn.cursor() as cur:
+            if limite is None:
+                cur.execute(
+                    "SELECT resumen FROM resumenes WHERE agente = %s ORDER BY timestamp ASC",
+                    (AGENTE,)
+                )
+                return [row[0] for row in cur.fetchall()]
             cur.execute(
-                "INSERT INTO resumenes (agente, resumen, timestamp) VALUES (%s, %s, %s)",
-                (AGENTE, resumen, datetime.now())
+                "SELECT resumen FROM resumenes WHERE agente = %s ORDER BY timestamp DESC LIMIT %s",
+                (AGENTE, limite)
             )
-        conn.commit()
+            return [row[0] for row in reversed(cur.fetchall())]
     finally:
         conn.close()
 
 
-def cargar_resumenes() -> list[str]:
+def _version() -> tuple:
     conn = get_conn()
     try:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT resumen FROM resumenes WHERE agente = %s ORDER BY timestamp ASC",
+                "SELECT max(timestamp), count(*) FROM resumenes WHERE agente = %s",
                 (AGENTE,)
             )
-            return [row[0] for row in cur.fetchall()]
+            return tuple(cur.fetchone())
     finally:
         conn.close()
 
 
 def como_contexto() -> str:
-    resumenes = cargar_resumenes()
-    if not resumenes:
-        return ""
-    lineas = "\n".join(f"- {r}" for r in resumenes)
-    return f"Resumenes de conversaciones anteriores:\n{lineas}"
+    """Bloque con los MAX_RESUMENES resúmenes más recientes para el prompt.
+    Cacheado en memoria hasta el próximo guardar_resumen() (o hasta que cambie
+    la versión, si VERIFICAR_VERSION)."""
+    global _cache_contexto, _cache_version
+    version = _version() if VERIFICAR_VERSION else None
+    if _cache_contexto is not None and version == _cache_version:
+        return _cache_contexto
+    resumenes = cargar_resumenes(MAX_RESUMENES)
+    if resumenes:
+        lineas = "\n".join(f"- {r}" for r in resumenes)
+        contexto = f"Resumenes de conversaciones anteriores:\n{lineas}"
+    else:
+        contexto = ""
+    _cache_contexto, _cache_version = contexto, version
+    return contexto
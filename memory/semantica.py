@@ -1,30 +1,204 @@
-"""Memoria semántica — hechos clave del usuario (PostgreSQL + pgvector)."""
+"""Memoria semántica — hechos clave del usuario (PostgreSQL + pgvector).
 
+Los hechos con `clave` (p. ej. 'pve:vms') sustituyen a su versión anterior;
+los demás se descartan si ya hay uno casi idéntico (similitud coseno ≥
+UMBRAL_DUPLICADO). `compactar` limpia los duplicados que ya estaban guardados.
+"""
+
+import json
+import math
+import os
+import sys
+from dataclasses import dataclass, field
 from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # sin NumPy, el MMR cae a orden por relevancia
+    np = None
+from psycopg2.extras import execute_values
 from .db import get_conn
-from .embeddings import get_embedding
+from . import indice_local
+from .embeddings import como_literal, get_embedding, get_embeddings
+from .tokens import CHARS_POR_TOKEN, estimar_tokens
 
 AGENTE = "chatty"
 TOP_K = 5
+# Precisión/latencia de la búsqueda aproximada (ver memory.esquema para el índice)
+EF_SEARCH = int(os.environ.get("CHATTY_EF_SEARCH", "64"))     # HNSW: candidatos explorados (≥ top_k)
+IVF_PROBES = int(os.environ.get("CHATTY_IVF_PROBES", "10"))    # IVFFlat: listas visitadas
+
+# Contexto por turno (seleccionar_contexto)
+PRESUPUESTO_CONTEXTO = int(os.environ.get("CHATTY_PRESUPUESTO_SEMANTICO", "400"))  # tokens
+CANDIDATOS_MMR = 20        # vecinos que se piden antes de reordenar
+LAMBDA_MMR = 0.7           # 1 = solo relevancia, 0 = solo diversidad
+MAX_TOKENS_HECHO = 120     # ningún hecho ocupa más que esto
+MIN_TOKENS_HECHO = 24      # no merece la pena meter un hecho recortado a menos
+# Hechos del system prompt al arrancar (sin consulta): los más recientes que quepan
+PRESUPUESTO_HECHOS_INICIO = int(os.environ.get("CHATTY_PRESUPUESTO_HECHOS_INICIO", "800"))  # tokens
+# Escribir en stderr qué hechos entraron en el contexto de cada turno y cuáles se descartaron
+TRAZA_CONTEXTO = os.environ.get("CHATTY_TRAZA_CONTEXTO", "0") == "1"
+# Dónde se hace la búsqueda por similitud: "postgres" (pgvector) o "local" (memory.indice_local, NumPy)
+BACKEND = os.environ.get("CHATTY_BACKEND_SEMANTICO", "postgres")
+UMBRAL_DUPLICADO = float(os.environ.get("CHATTY_UMBRAL_DUPLICADO", "0.95"))  # similitud coseno
+
+# Hechos que pve_explorar guardaba sin clave: prefijo → clave que usa ahora (para `compactar`)
+CLAVES_LEGADAS = {
+    "Proxmox versión:": "pve:version",
+    "VMs en Proxmox:": "pve:vms",
+    "Contenedores LXC en Proxmox:": "pve:contenedores",
+    "Almacenamiento Proxmox:": "pve:almacenamiento",
+}
+
+# Ver memory.resumenes.VERIFICAR_VERSION
+VERIFICAR_VERSION = os.environ.get("CHATTY_CACHE_VERSIONADA", "0") == "1"
 
 _cache_hay_hechos: bool | None = None
+_cache_contexto: str | None = None      # bloque con todos los hechos (como_contexto sin query)
+_cache_version: tuple | None = None
 
 
-def guardar_hecho(hecho: str) -> None:
-    """Guarda un hecho junto con su vector de embeddings."""
-    global _cache_hay_hechos
-    embedding = get_embedding(hecho)
+def guardar_hecho(hecho: str, clave: str | None = None) -> bool:
+    """Guarda un hecho junto con su vector de embeddings. False si era un duplicado."""
+    return guardar_hechos([hecho], [clave]) > 0
+
+
+def _similitud(a: list[float], b: list[float]) -> float:
+    norma = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(x * x for x in b))
+    return sum(x * y for x, y in zip(a, b)) / norma if norma else 0.0
+
+
+def _sin_duplicados(cur, candidatos: list[tuple[str, list[float]]], umbral: float) -> list[tuple[str, list[float]]]:
+    """Quita los candidatos casi idénticos entre sí o a un hecho ya guardado.
+    La comparación con la BD es una sola consulta: el vecino más cercano de cada candidato."""
+    unicos: list[tuple[str, list[float]]] = []
+    for hecho, e in candidatos:
+        if all(_similitud(e, otro) < umbral for _, otro in unicos):
+            unicos.append((hecho, e))
+    if not unicos or umbral > 1:
+        return unicos
+    cur.execute("SET LOCAL hnsw.ef_search = %s", (EF_SEARCH,))
+    cur.execute(
+        """
+        SELECT v.i
+        FROM unnest(%s::int[], %s::text[]) AS v(i, e)
+        WHERE (SELECT h.embedding <=> v.e::vector
+               FROM hechos h
+               WHERE h.agente = %s AND h.embedding IS NOT NULL
+               ORDER BY h.embedding <=> v.e::vector
+               LIMIT 1) <= %s
+        """,
+        (list(range(len(unicos))), [como_literal(e) for _, e in unicos], AGENTE, 1 - umbral),
+    )
+    repetidos = {row[0] for row in cur.fetchall()}
+    return [c for i, c in enumerate(unicos) if i not in repetidos]
+
+
+def guardar_hechos(hechos: list[str], claves: list[str | None] | None = None,
+                   umbral: float = UMBRAL_DUPLICADO) -> int:
+    """Guarda varios hechos con un único lote de embeddings.
+
+    Los que traen clave reemplazan al hecho anterior con esa clave (upsert); el
+    resto se descarta si ya existe uno con similitud ≥ `umbral` (un umbral > 1
+    desactiva la comprobación). Devuelve cuántos se insertaron o actualizaron."""
+    global _cache_hay_hechos, _cache_contexto
+    claves = claves if claves is not None else [None] * len(hechos)
+    pares = [(h, c) for h, c in zip(hechos, claves) if h]
+    if not pares:
+        return 0
+    embeddings = get_embeddings([h for h, _ in pares])
+    ahora = datetime.now()
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            con_clave = {c: (h, e) for (h, c), e in zip(pares, embeddings) if c is not None}
+            sin_clave = _sin_duplicados(cur, [(h, e) for (h, c), e in zip(pares, embeddings) if c is None], umbral)
+            if sin_clave:
+                execute_values(
+                    cur,
+                    "INSERT INTO hechos (agente, hecho, embedding, timestamp) VALUES %s",
+                    [(AGENTE, h, como_literal(e), ahora) for h, e in sin_clave],
+                    template="(%s, %s, %s::vector, %s)",
+                )
+            if con_clave:
+                execute_values(
+                    cur,
+                    "INSERT INTO hechos (agente, clave, hecho, embedding, timestamp) VALUES %s "
+                    "ON CONFLICT (agente, clave) WHERE clave IS NOT NULL DO UPDATE "
+                    "SET hecho = EXCLUDED.hecho, embedding = EXCLUDED.embedding, timestamp = EXCLUDED.timestamp",
+                    [(AGENTE, c, h, como_literal(e), ahora) for c, (h, e) in con_clave.items()],
+                    template="(%s, %s, %s, %s::vector, %s)",
+                )
+        conn.commit()
+        guardados = len(sin_clave) + len(con_clave)
+        if guardados:
+            _cache_hay_hechos = True
+            _cache_contexto = None
+            indice_local.invalidar(AGENTE)
+    finally:
+        conn.close()
+    return guardados
+
+
+def compactar(umbral: float = UMBRAL_DUPLICADO, vecinos: int = 10) -> tuple[int, int]:
+    """Limpieza única de duplicados ya guardados. Devuelve (claves asignadas, filas borradas).
+
+    1. Los hechos de CLAVES_LEGADAS sin clave: el más reciente de cada prefijo
+       recibe la clave y los anteriores se borran.
+    2. Entre los hechos sin clave, del más reciente al más antiguo, se borran los
+       vecinos más antiguos con similitud ≥ `umbral`."""
+    global _cache_contexto
+    asignadas = borradas = 0
     conn = get_conn()
     try:
         with conn.cursor() as cur:
+            for prefijo, clave in CLAVES_LEGADAS.items():
+                cur.execute("SELECT 1 FROM hechos WHERE agente = %s AND clave = %s", (AGENTE, clave))
+                if cur.fetchone() is None:
+                    cur.execute(
+                        "UPDATE hechos SET clave = %s WHERE id = ("
+                        " SELECT id FROM hechos WHERE agente = %s AND clave IS NULL AND starts_with(hecho, %s)"
+                        " ORDER BY timestamp DESC, id DESC LIMIT 1)",
+                        (clave, AGENTE, prefijo),
+                    )
+                    asignadas += cur.rowcount
+                cur.execute(
+                    "DELETE FROM hechos WHERE agente = %s AND clave IS NULL AND starts_with(hecho, %s)",
+                    (AGENTE, prefijo),
+                )
+                borradas += cur.rowcount
+
             cur.execute(
-                "INSERT INTO hechos (agente, hecho, embedding, timestamp) VALUES (%s, %s, %s, %s)",
-                (AGENTE, hecho, str(embedding), datetime.now())
+                "SELECT id, embedding::text FROM hechos WHERE agente = %s AND clave IS NULL "
+                "AND embedding IS NOT NULL ORDER BY timestamp DESC, id DESC",
+                (AGENTE,),
             )
+            filas = cur.fetchall()
+            sin_clave = {id_ for id_, _ in filas}
+            vistos: set[int] = set()
+            duplicados: set[int] = set()
+            cur.execute("SET LOCAL hnsw.ef_search = %s", (max(EF_SEARCH, vecinos),))
+            for id_, embedding in filas:
+                if id_ in duplicados:
+                    continue
+                vistos.add(id_)
+                cur.execute(
+                    "SELECT id FROM (SELECT id, embedding <=> %s::vector AS d FROM hechos "
+                    " WHERE agente = %s AND embedding IS NOT NULL ORDER BY embedding <=> %s::vector LIMIT %s) c "
+                    "WHERE d <= %s",
+                    (embedding, AGENTE, embedding, vecinos, 1 - umbral),
+                )
+                # Un vecino ya visto y conservado lo habría borrado a él: los que quedan son más antiguos
+                duplicados.update(v for v, in cur.fetchall() if v in sin_clave and v not in vistos)
+            if duplicados:
+                cur.execute("DELETE FROM hechos WHERE id = ANY(%s)", (list(duplicados),))
+                borradas += cur.rowcount
         conn.commit()
-        _cache_hay_hechos = True
+        _cache_contexto = None
+        indice_local.invalidar(AGENTE)
     finally:
         conn.close()
+    return asignadas, borradas
 
 
 def cargar_hechos() -> list[str]:
@@ -41,27 +215,169 @@ def cargar_hechos() -> list[str]:
         conn.close()
 
 
-def buscar_hechos_similares(query: str, top_k: int = TOP_K) -> list[str]:
-    """Devuelve los hechos más relevantes para la query usando similitud vectorial."""
-    embedding = get_embedding(query)
+def _vecinos(embedding: list[float], top_k: int, ef_search: int = EF_SEARCH, probes: int = IVF_PROBES,
+             exacta: bool = False, con_vectores: bool = False) -> list[tuple]:
+    """Filas (hecho,) o (hecho, embedding como texto) de los `top_k` más cercanos por distancia coseno."""
     conn = get_conn()
     try:
         with conn.cursor() as cur:
+            # SET LOCAL: solo para esta transacción; el pool hace rollback al devolver la conexión
+            if exacta:
+                cur.execute("SET LOCAL enable_indexscan = off")
+            else:
+                cur.execute("SET LOCAL hnsw.ef_search = %s", (max(ef_search, top_k),))
+                cur.execute("SET LOCAL ivfflat.probes = %s", (probes,))
             cur.execute(
-                """
-                SELECT hecho
+                f"""
+                SELECT hecho{", embedding::text" if con_vectores else ""}
                 FROM hechos
                 WHERE agente = %s AND embedding IS NOT NULL
                 ORDER BY embedding <=> %s::vector
                 LIMIT %s
                 """,
-                (AGENTE, str(embedding), top_k)
+                (AGENTE, como_literal(embedding), top_k)
             )
-            return [row[0] for row in cur.fetchall()]
+            return cur.fetchall()
     finally:
         conn.close()
 
 
+def buscar_por_vector(embedding: list[float], top_k: int = TOP_K, ef_search: int = EF_SEARCH,
+                      probes: int = IVF_PROBES, exacta: bool = False) -> list[str]:
+    """Los `top_k` hechos más cercanos a `embedding` por distancia coseno.
+    Usa el índice ANN parcial del agente; `exacta=True` lo desactiva (recorrido completo)."""
+    return [row[0] for row in _vecinos(embedding, top_k, ef_search, probes, exacta)]
+
+
+def buscar_hechos_similares(query: str, top_k: int = TOP_K) -> list[str]:
+    """Devuelve los hechos más relevantes para la query usando similitud vectorial."""
+    embedding = get_embedding(query)
+    if BACKEND == "local":
+        resultado = indice_local.buscar(AGENTE, embedding, top_k)
+        if resultado is not None:
+            return resultado
+    return buscar_por_vector(embedding, top_k)
+
+
+def _candidatos(embedding: list[float], n: int) -> list[tuple[str, list[float]]]:
+    """Los `n` hechos más cercanos con su vector, del backend configurado."""
+    if BACKEND == "local":
+        resultado = indice_local.buscar(AGENTE, embedding, n, con_vectores=True)
+        if resultado is not None:
+            return resultado
+    return [(h, json.loads(e)) for h, e in _vecinos(embedding, n, con_vectores=True)]
+
+
+# ── Selección del contexto: MMR + empaquetado por tokens ─────────────────────
+
+@dataclass
+class ContextoSemantico:
+    """Resultado de `seleccionar_contexto`: el bloque listo para el prompt y qué entró."""
+    texto: str
+    incluidos: list[str] = field(default_factory=list)    # hechos tal como se insertaron
+    recortados: int = 0                                   # cuántos de ellos se truncaron
+    descartados: list[str] = field(default_factory=list)  # candidatos que no cupieron o eran redundantes
+    tokens: int = 0
+
+    def informe(self) -> str:
+        """Resumen legible: una cabecera con los totales y una línea por hecho (+ entró, − no)."""
+        def titulo(hecho: str) -> str:
+            primera = hecho.splitlines()[0] if hecho else ""
+            return primera if len(primera) <= 70 else primera[:69] + "…"
+        lineas = [f"contexto semántico: {len(self.incluidos)} hechos ({self.recortados} recortados), "
+                  f"{len(self.descartados)} descartados, {self.tokens} tokens"]
+        lineas += [f"  + {titulo(h)}" for h in self.incluidos]
+        lineas += [f"  − {titulo(h)}" for h in self.descartados]
+        return "\n".join(lineas)
+
+
+def _mmr(consulta: list[float], vectores: list[list[float]], lambda_: float) -> list[tuple[int, float]]:
+    """Orden de los candidatos por Maximal Marginal Relevance:
+    argmax λ·sim(consulta, d) − (1−λ)·max sim(d, elegidos). Devuelve (índice, similitud
+    máxima con los elegidos antes que él). Sin NumPy, por relevancia y sin redundancia."""
+    if np is None:
+        orden = sorted(range(len(vectores)), key=lambda i: -_similitud(consulta, vectores[i]))
+        return [(i, 0.0) for i in orden]
+    m = np.asarray(vectores, dtype=np.float32)
+    m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    q = np.asarray(consulta, dtype=np.float32)
+    q /= max(float(np.linalg.norm(q)), 1e-12)
+    relevancia = m @ q
+    similitudes = m @ m.T
+    primero = int(np.argmax(relevancia))
+    orden = [(primero, 0.0)]
+    redundancia = similitudes[primero].copy()
+    elegido = np.zeros(len(vectores), dtype=bool)
+    elegido[primero] = True
+    while len(orden) < len(vectores):
+        puntuacion = lambda_ * relevancia - (1 - lambda_) * redundancia
+        puntuacion[elegido] = -np.inf
+        j = int(np.argmax(puntuacion))
+        orden.append((j, float(redundancia[j])))
+        elegido[j] = True
+        np.maximum(redundancia, similitudes[j], out=redundancia)
+    return orden
+
+
+def _truncar(hecho: str, max_tokens: int) -> str:
+    """Recorta un hecho a ~max_tokens. Los volcados de varias líneas conservan la
+    primera (el título) y tantas filas completas como quepan; el resto se corta
+    en el último espacio."""
+    max_chars = max_tokens * CHARS_POR_TOKEN
+    if len(hecho) <= max_chars:
+        return hecho
+    lineas = hecho.splitlines()
+    if len(lineas) > 1:
+        conservadas, largo = [], 0
+        for linea in lineas:
+            if largo + len(linea) + 1 > max_chars - 20:
+                break
+            conservadas.append(linea)
+            largo += len(linea) + 1
+        if conservadas:
+            return "\n".join(conservadas) + f"\n…(+{len(lineas) - len(conservadas)} líneas)"
+    corte = hecho.rfind(" ", 0, max_chars - 1)
+    return hecho[:corte if corte > max_chars // 2 else max_chars - 1].rstrip() + "…"
+
+
+_COSTE_LINEA = estimar_tokens("- \n")   # lo que el formato "- hecho\n" añade al coste de un hecho
+
+
+def seleccionar_contexto(query: str, presupuesto: int = PRESUPUESTO_CONTEXTO, k: int = TOP_K,
+                         candidatos: int = CANDIDATOS_MMR, lambda_: float = LAMBDA_MMR) -> ContextoSemantico:
+    """Hechos para `query`: pide `candidatos` vecinos, los reordena por MMR para no
+    gastar tokens en hechos casi iguales y mete hasta `k` en `presupuesto` tokens,
+    truncando los largos (cada uno a MAX_TOKENS_HECHO como mucho). Los candidatos
+    con similitud ≥ UMBRAL_DUPLICADO a uno ya elegido se descartan sin más."""
+    embedding = get_embedding(query)
+    filas = _candidatos(embedding, max(candidatos, k))
+    if not filas:
+        return ContextoSemantico(texto="")
+    orden = _mmr(embedding, [v for _, v in filas], lambda_)
+    usados = estimar_tokens(CABECERA_HECHOS)
+    resultado = ContextoSemantico(texto="")
+    for i, redundancia in orden:
+        hecho = filas[i][0]
+        if len(resultado.incluidos) >= k or redundancia >= UMBRAL_DUPLICADO:
+            resultado.descartados.append(hecho)
+            continue
+        disponible = min(MAX_TOKENS_HECHO, presupuesto - usados)
+        # El hecho se recorta descontando lo que cuesta su línea ("- " y el salto),
+        # así el recorte siempre cabe en lo que queda
+        texto = (_truncar(hecho, disponible - _COSTE_LINEA)
+                 if disponible - _COSTE_LINEA >= MIN_TOKENS_HECHO else None)
+        coste = estimar_tokens(f"- {texto}\n") if texto else 0
+        if texto is None or usados + coste > presupuesto:
+            resultado.descartados.append(hecho)
+            continue
+        resultado.incluidos.append(texto)
+        resultado.recortados += texto != hecho
+        usados += coste
+    resultado.texto = _formatear(resultado.incluidos)
+    resultado.tokens = estimar_tokens(resultado.texto) if resultado.texto else 0
+    return resultado
+
+
 def _hay_hechos() -> bool:
     """Comprueba si existe algún hecho guardado. Cacheado en memoria durante la sesión."""
     global _cache_hay_hechos
@@ -77,14 +393,62 @@ def _hay_hechos() -> bool:
     return _cache_hay_hechos
 
 
-def como_contexto(query: str = None) -> str:
-    """Formatea hechos para inyectar al LLM.
-    Si se pasa query, devuelve solo los más relevantes por similitud.
-    Si no, devuelve todos."""
-    if not _hay_hechos():
-        return ""
-    hechos = buscar_hechos_similares(query) if query else cargar_hechos()
+def _version() -> tuple:
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT max(timestamp), count(*) FROM hechos WHERE agente = %s",
+                (AGENTE,)
+            )
+            return tuple(cur.fetchone())
+    finally:
+        conn.close()
+
+
+CABECERA_HECHOS = "Hechos que recuerdo del usuario y el sistema:"
+
+
+def _formatear(hechos: list[str]) -> str:
     if not hechos:
         return ""
     lineas = "\n".join(f"- {h}" for h in hechos)
-    return f"Hechos que recuerdo del usuario y el sistema:\n{lineas}"
+    return f"{CABECERA_HECHOS}\n{lineas}"
+
+
+def _recientes(hechos: list[str], presupuesto: int) -> list[str]:
+    """Los hechos más recientes (cada uno recortado a MAX_TOKENS_HECHO) que caben
+    en `presupuesto` tokens, en orden cronológico."""
+    elegidos, usados = [], estimar_tokens(CABECERA_HECHOS)
+    for hecho in reversed(hechos):
+        texto = _truncar(hecho, MAX_TOKENS_HECHO - _COSTE_LINEA)
+        coste = estimar_tokens(f"- {texto}\n")
+        if usados + coste > presupuesto:
+            break
+        elegidos.append(texto)
+        usados += coste
+    elegidos.reverse()
+    return elegidos
+
+
+def como_contexto(query: str = None) -> str:
+    """Formatea hechos para inyectar al LLM.
+    Si se pasa query, devuelve los más relevantes sin redundancia y dentro de
+    PRESUPUESTO_CONTEXTO tokens (ver seleccionar_contexto).
+    Si no, los más recientes dentro de PRESUPUESTO_HECHOS_INICIO tokens
+    (cacheado hasta el próximo guardar_hechos)."""
+    global _cache_contexto, _cache_version
+    if query:
+        if not _hay_hechos():
+            return ""
+        seleccion = seleccionar_contexto(query)
+        if TRAZA_CONTEXTO:
+            print(f"[memoria] {seleccion.informe()}", file=sys.stderr)
+        return seleccion.texto
+
+    version = _version() if VERIFICAR_VERSION else None
+    if _cache_contexto is not None and version == _cache_version:
+        return _cache_contexto
+    contexto = _formatear(_recientes(cargar_hechos(), PRESUPUESTO_HECHOS_INICIO))
+    _cache_contexto, _cache_version = contexto, version
+    return contexto
@@ -0,0 +1,22 @@
+"""Estimación barata de tokens para presupuestos de contexto.
+
+No usa el tokenizador real del modelo: ~4 caracteres por token es suficiente
+para decidir cuánto historial cabe en la ventana.
+"""
+
+CHARS_POR_TOKEN = 4
+
+
+def estimar_tokens(texto: str) -> int:
+    return len(texto) // CHARS_POR_TOKEN + 1
+
+
+def tokens_mensaje(mensaje) -> int:
+    """Tokens aproximados de un mensaje de LangChain (contenido + tool calls + el
+    contexto recuperado que Chatty envía antepuesto, en additional_kwargs["contexto"])."""
+    contenido = mensaje.content if isinstance(mensaje.content, str) else str(mensaje.content)
+    extra = sum(estimar_tokens(str(tc)) for tc in getattr(mensaje, "tool_calls", None) or [])
+    contexto = (getattr(mensaje, "additional_kwargs", None) or {}).get("contexto")
+    if contexto:
+        extra += estimar_tokens(contexto)
+    return estimar_tokens(contenido) + extra + 4  # +4: marcas de rol de la plantilla
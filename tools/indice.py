@@ -0,0 +1,290 @@
+"""Índice local de archivos para buscar_archivos y buscar_contenido (opt-in).
+
+Con CHATTY_INDICE=1 se mantiene en SQLite una tabla de rutas ordenada (nombre,
+mtime, tamaño) y un índice de trigramas del contenido de los archivos de texto.
+Solo se indexan las raíces de CHATTY_INDICE_RAICES (por defecto, el home); las
+búsquedas fuera de ellas siguen usando find/grep. Las búsquedas se responden
+desde el índice y paran al llegar al límite; el contenido se verifica leyendo
+solo los candidatos. El índice se refresca de forma incremental (solo se releen
+archivos cuyo mtime o tamaño cambió) en un hilo en segundo plano cuando tiene
+más de REFRESCO_SEG segundos.
+"""
+
+import fnmatch
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import time
+
+INDICE_ENABLED = os.environ.get("CHATTY_INDICE", "0") == "1"
+INDICE_PATH = os.environ.get(
+    "CHATTY_INDICE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "chatty", "indice.sqlite"),
+)
+# Raíces indexadas, separadas por os.pathsep; una búsqueda usa el índice si su ruta cae dentro de una
+RAICES = [
+    os.path.abspath(os.path.expanduser(r))
+    for r in os.environ.get("CHATTY_INDICE_RAICES", "~").split(os.pathsep) if r.strip()
+]
+REFRESCO_SEG = 300
+MAX_PROFUNDIDAD = 10
+MAX_BYTES_TEXTO = 512 * 1024   # archivos más grandes no tienen trigramas: se verifican siempre leyéndolos
+ARCHIVOS_POR_COMMIT = 500      # el primer indexado de un árbol grande se confirma por lotes
+# Montajes que no se recorren al indexar (su contenido no son archivos del usuario)
+SISTEMAS_VIRTUALES = {
+    "proc", "sysfs", "devtmpfs", "devpts", "tmpfs", "ramfs", "cgroup", "cgroup2", "securityfs",
+    "debugfs", "tracefs", "pstore", "bpf", "mqueue", "hugetlbfs", "configfs", "fusectl",
+    "autofs", "efivarfs", "binfmt_misc", "rpc_pipefs", "nsfs",
+}
+
+_local = threading.local()
+_refrescando: set[str] = set()
+_refrescando_lock = threading.Lock()
+
+
+def _db() -> sqlite3.Connection:
+    """Una conexión por hilo (el refresco corre en su propio hilo)."""
+    db = getattr(_local, "db", None)
+    if db is None:
+        os.makedirs(os.path.dirname(INDICE_PATH), exist_ok=True)
+        db = sqlite3.connect(INDICE_PATH, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS archivos (
+                id INTEGER PRIMARY KEY, ruta TEXT NOT NULL UNIQUE, nombre TEXT NOT NULL,
+                mtime REAL NOT NULL, tamano INTEGER NOT NULL, generacion INTEGER NOT NULL,
+                sin_trigramas INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS trigramas (
+                tri TEXT NOT NULL, archivo INTEGER NOT NULL, PRIMARY KEY (tri, archivo)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS trigramas_archivo ON trigramas (archivo);
+            CREATE TABLE IF NOT EXISTS raices (
+                ruta TEXT PRIMARY KEY, actualizado REAL NOT NULL, generacion INTEGER NOT NULL
+            );
+        """)
+        columnas = {c for _, c, *_ in db.execute("PRAGMA table_info(archivos)")}
+        if "sin_trigramas" not in columnas:
+            # Índice de una versión anterior: no distinguía binarios ni archivos grandes, se rehace
+            with db:
+                db.execute("ALTER TABLE archivos ADD COLUMN sin_trigramas INTEGER NOT NULL DEFAULT 0")
+                db.execute("DELETE FROM trigramas")
+                db.execute("DELETE FROM archivos")
+                db.execute("DELETE FROM raices")
+        _local.db = db
+    return db
+
+
+def _trigramas(texto: str) -> set[str]:
+    texto = texto.lower()
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _leer_texto(ruta: str) -> str | None:
+    """Contenido de un archivo de texto, o None si parece binario."""
+    try:
+        with open(ruta, "rb") as f:
+            datos = f.read(MAX_BYTES_TEXTO)
+    except OSError:
+        return None
+    if b"\0" in datos[:4096]:
+        return None
+    return datos.decode("utf-8", "replace")
+
+
+def _montajes_virtuales() -> set[str]:
+    """Puntos de montaje de SISTEMAS_VIRTUALES según /proc/mounts (vacío si no existe)."""
+    try:
+        with open("/proc/mounts") as f:
+            lineas = f.read().splitlines()
+    except OSError:
+        return set()
+    montajes = set()
+    for linea in lineas:
+        campos = linea.split()
+        if len(campos) >= 3 and campos[2] in SISTEMAS_VIRTUALES:
+            # /proc/mounts escapa espacios y similares en octal (\040)
+            montajes.add(re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), campos[1]))
+    return montajes
+
+
+def _recorrer(raiz: str):
+    """(ruta, stat) de los archivos bajo `raiz`, sin ocultos y hasta MAX_PROFUNDIDAD (como el find original).
+    No entra en montajes virtuales (/proc, /sys, /run...) que cuelguen de `raiz`."""
+    virtuales = _montajes_virtuales() - {raiz}
+    pila = [(raiz, 0)]
+    while pila:
+        directorio, nivel = pila.pop()
+        try:
+            entradas = list(os.scandir(directorio))
+        except OSError:
+            continue
+        for e in entradas:
+            if e.name.startswith("."):
+                continue
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    if nivel + 1 < MAX_PROFUNDIDAD and e.path not in virtuales:
+                        pila.append((e.path, nivel + 1))
+                elif e.is_file(follow_symlinks=False):
+                    yield e.path, e.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+
+def _rango(raiz: str) -> tuple[str, str]:
+    """Límites [desde, hasta) de las rutas bajo `raiz` en el orden del índice único de `ruta`:
+    '/' + 1 es '0', así que todo lo que empieza por 'raiz/' cae en el intervalo."""
+    prefijo = raiz.rstrip("/") + "/"
+    return prefijo, prefijo[:-1] + "0"
+
+
+def actualizar(raiz: str) -> int:
+    """Refresco incremental de `raiz`: añade, reindexa los archivos con mtime/tamaño
+    distinto y elimina los que ya no existen. Devuelve cuántos se reindexaron."""
+    db = _db()
+    fila = db.execute("SELECT generacion FROM raices WHERE ruta = ?", (raiz,)).fetchone()
+    generacion = (fila[0] if fila else 0) + 1
+    conocidos = {
+        ruta: (id_, mtime, tamano)
+        for id_, ruta, mtime, tamano in db.execute(
+            "SELECT id, ruta, mtime, tamano FROM archivos WHERE ruta >= ? AND ruta < ?",
+            _rango(raiz),
+        )
+    }
+    reindexados = 0
+    vistos = []
+    try:
+        for ruta, st in _recorrer(raiz):
+            previo = conocidos.get(ruta)
+            if previo is not None and previo[1] == st.st_mtime and previo[2] == st.st_size:
+                vistos.append((generacion, previo[0]))
+                continue
+            if previo is not None:
+                db.execute("DELETE FROM trigramas WHERE archivo = ?", (previo[0],))
+            texto = _leer_texto(ruta) if st.st_size <= MAX_BYTES_TEXTO else None
+            # Sin trigramas (binario o demasiado grande): buscar_texto lo verifica siempre, como grep
+            cur = db.execute(
+                "INSERT INTO archivos (ruta, nombre, mtime, tamano, generacion, sin_trigramas) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(ruta) DO UPDATE SET mtime = excluded.mtime, tamano = excluded.tamano, "
+                "generacion = excluded.generacion, sin_trigramas = excluded.sin_trigramas RETURNING id",
+                (ruta, os.path.basename(ruta), st.st_mtime, st.st_size, generacion, texto is None),
+            )
+            id_ = cur.fetchone()[0]
+            if texto:
+                db.executemany("INSERT OR IGNORE INTO trigramas (tri, archivo) VALUES (?, ?)",
+                               ((t, id_) for t in _trigramas(texto)))
+            reindexados += 1
+            if reindexados % ARCHIVOS_POR_COMMIT == 0:
+                db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    with db:
+        db.executemany("UPDATE archivos SET generacion = ? WHERE id = ?", vistos)
+        desaparecidos = [
+            (id_,) for id_, in db.execute(
+                "SELECT id FROM archivos WHERE ruta >= ? AND ruta < ? AND generacion < ?",
+                (*_rango(raiz), generacion),
+            )
+        ]
+        db.executemany("DELETE FROM trigramas WHERE archivo = ?", desaparecidos)
+        db.executemany("DELETE FROM archivos WHERE id = ?", desaparecidos)
+        db.execute("INSERT OR REPLACE INTO raices (ruta, actualizado, generacion) VALUES (?, ?, ?)",
+                   (raiz, time.time(), generacion))
+    return reindexados
+
+
+def _refrescar_en_segundo_plano(raiz: str) -> None:
+    with _refrescando_lock:
+        if raiz in _refrescando:
+            return
+        _refrescando.add(raiz)
+
+    def trabajo():
+        try:
+            actualizar(raiz)
+        except (sqlite3.Error, OSError):
+            pass
+        finally:
+            with _refrescando_lock:
+                _refrescando.discard(raiz)
+
+    threading.Thread(target=trabajo, name="indice-archivos", daemon=True).start()
+
+
+def _raiz_indexada(raiz: str) -> bool:
+    """True si `raiz` está dentro de una de RAICES y su índice ya existe. Si falta
+    o está viejo, programa un refresco en segundo plano de esa raíz configurada;
+    fuera de RAICES nunca se indexa (el llamador usa find/grep)."""
+    configurada = next(
+        (r for r in RAICES if raiz == r or raiz.startswith(r.rstrip("/") + "/")), None
+    )
+    if configurada is None:
+        return False
+    fila = _db().execute("SELECT actualizado FROM raices WHERE ruta = ?", (configurada,)).fetchone()
+    if fila is None or time.time() - fila[0] > REFRESCO_SEG:
+        _refrescar_en_segundo_plano(configurada)
+    return fila is not None
+
+
+def buscar_nombre(patron: str, raiz: str, limite: int) -> list[str] | None:
+    """Rutas bajo `raiz` cuyo nombre encaja con el glob `patron`.
+    None si aún no hay índice para esa raíz (el llamador debe usar find)."""
+    raiz = os.path.abspath(raiz)
+    if not _raiz_indexada(raiz):
+        return None
+    filas = _db().execute(
+        "SELECT ruta FROM archivos WHERE ruta >= ? AND ruta < ? AND nombre GLOB ? ORDER BY ruta LIMIT ?",
+        (*_rango(raiz), patron, limite),
+    )
+    return [r for r, in filas]
+
+
+def _contiene(ruta: str, aguja: bytes) -> bool:
+    try:
+        with open(ruta, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return m.find(aguja) != -1
+    except (OSError, ValueError):
+        return False
+
+
+def buscar_texto(texto: str, raiz: str, extension: str, limite: int) -> list[str] | None:
+    """Archivos bajo `raiz` que contienen `texto` (sensible a mayúsculas, como grep).
+    Los trigramas reducen los candidatos; los archivos sin trigramas (binarios o
+    de más de MAX_BYTES_TEXTO) son siempre candidatos. Cada candidato se verifica
+    leyéndolo y la búsqueda para en cuanto hay `limite` coincidencias. None si no
+    hay índice o el texto es demasiado corto para usar trigramas."""
+    raiz = os.path.abspath(raiz)
+    tris = _trigramas(texto)
+    if not tris or not _raiz_indexada(raiz):
+        return None
+    marcadores = ",".join("?" * len(tris))
+    filas = _db().execute(
+        f"""
+        SELECT a.ruta FROM archivos a
+        WHERE a.ruta >= ? AND a.ruta < ?
+          AND (a.sin_trigramas
+               OR a.id IN (SELECT archivo FROM trigramas WHERE tri IN ({marcadores})
+                           GROUP BY archivo HAVING count(*) = ?))
+        ORDER BY a.ruta
+        """,
+        (*_rango(raiz), *tris, len(tris)),
+    )
+    patron_nombre = f"*.{extension}"  # mismo filtro que grep --include
+    aguja = texto.encode("utf-8")
+    encontrados = []
+    for ruta, in filas:
+        if not fnmatch.fnmatchcase(os.path.basename(ruta), patron_nombre):
+            continue
+        if _contiene(ruta, aguja):
+            encontrados.append(ruta)
+            if len(encontrados) >= limite:
+                break
+    return encontrados
@@ -0,0 +1,188 @@
+"""Lectura por rangos de archivos grandes con mmap, sin cargarlos en memoria.
+
+Permite leer por offset de bytes, por rango de líneas (con un índice de
+offsets de salto de línea cacheado por archivo), las últimas N líneas y
+buscar un patrón devolviendo las líneas coincidentes con contexto. El índice
+de líneas se amplía de forma incremental cuando un log solo ha crecido.
+"""
+
+import bisect
+import mmap
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+
+MAX_INDICES = 8   # archivos con índice de líneas en caché
+MAX_COINCIDENCIAS = 50
+PASO = 64         # el índice guarda el offset de una de cada PASO líneas
+
+_BLOQUE = re.compile(rb"(?:[^\n]*\n){%d}" % PASO)
+
+
+class _IndiceLineas:
+    """Índice disperso: offsets[j] es el byte donde empieza la línea j*PASO (0-indexada)."""
+
+    def __init__(self):
+        self.tamano = 0
+        self.mtime = 0.0
+        self.offsets = array("Q", [0])
+        self.total = 0
+
+    def ampliar(self, m) -> None:
+        pos = self.offsets[-1]
+        while True:
+            bloque = _BLOQUE.match(m, pos)
+            if bloque is None:
+                break
+            pos = bloque.end()
+            self.offsets.append(pos)
+        resto = m[pos:]
+        self.total = (len(self.offsets) - 1) * PASO + resto.count(b"\n") + (0 if resto.endswith(b"\n") or not resto else 1)
+        self.tamano = len(m)
+
+    def inicio(self, m, linea: int) -> int:
+        """Offset del inicio de `linea` (0-indexada)."""
+        pos = self.offsets[linea // PASO]
+        for _ in range(linea % PASO):
+            pos = m.find(b"\n", pos) + 1
+        return pos
+
+    def linea_de(self, m, offset: int) -> int:
+        """Línea (0-indexada) que contiene el byte `offset`."""
+        j = bisect.bisect_right(self.offsets, offset) - 1
+        return j * PASO + m[self.offsets[j]:offset].count(b"\n")
+
+
+# ruta → índice de líneas (LRU)
+_indices: "OrderedDict[str, _IndiceLineas]" = OrderedDict()
+_indices_lock = threading.Lock()
+
+
+@contextmanager
+def _mapear(ruta: str):
+    with open(ruta, "rb") as f:
+        tamano = os.fstat(f.fileno()).st_size
+        if tamano == 0:
+            yield b""
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield m
+        finally:
+            m.close()
+
+
+def _texto(datos: bytes) -> str:
+    return datos.decode("utf-8", "replace")
+
+
+def leer_bytes(ruta: str, desde: int, n: int) -> str:
+    """`n` bytes a partir del offset `desde` (negativo: contado desde el final)."""
+    with _mapear(ruta) as m:
+        if desde < 0:
+            desde = max(0, len(m) + desde)
+        return _texto(m[desde:desde + n])
+
+
+def _indice(ruta: str, m) -> _IndiceLineas:
+    mtime = os.stat(ruta).st_mtime
+    with _indices_lock:
+        indice = _indices.pop(ruta, None)
+    if indice is not None and indice.tamano == len(m) and indice.mtime == mtime:
+        pass
+    elif indice is not None and len(m) > indice.tamano:
+        indice.ampliar(m)  # log que solo creció: se continúa desde el último bloque
+    else:
+        indice = _IndiceLineas()
+        indice.ampliar(m)
+    indice.mtime = mtime
+    with _indices_lock:
+        _indices[ruta] = indice
+        while len(_indices) > MAX_INDICES:
+            _indices.popitem(last=False)
+    return indice
+
+
+def leer_lineas(ruta: str, inicio: int, fin: int) -> tuple[str, int]:
+    """Líneas [inicio, fin] (1-indexadas, inclusivas) y el total de líneas del archivo."""
+    with _mapear(ruta) as m:
+        if not len(m):
+            return "", 0
+        indice = _indice(ruta, m)
+        inicio, fin = max(1, inicio), min(indice.total, fin)
+        if inicio > fin:
+            return "", indice.total
+        a = indice.inicio(m, inicio - 1)
+        b = indice.inicio(m, fin) if fin < indice.total else len(m)
+        return _texto(m[a:b]).rstrip("\n"), indice.total
+
+
+def cola(ruta: str, n: int) -> str:
+    """Últimas `n` líneas, buscando saltos de línea hacia atrás desde el final."""
+    with _mapear(ruta) as m:
+        fin = len(m)
+        if not fin:
+            return ""
+        pos = fin - 1 if m[fin - 1:fin] == b"\n" else fin
+        for _ in range(n):
+            pos = m.rfind(b"\n", 0, pos)
+            if pos == -1:
+                break
+        return _texto(m[pos + 1:fin]).rstrip("\n")
+
+
+def _linea_en(m, inicio: int) -> tuple[int, bytes]:
+    """(offset de la siguiente línea, contenido sin '\n') de la línea que empieza en `inicio`."""
+    fin = m.find(b"\n", inicio)
+    if fin == -1:
+        return len(m), m[inicio:]
+    return fin + 1, m[inicio:fin]
+
+
+def buscar(ruta: str, patron: str, contexto: int = 2, max_coincidencias: int = MAX_COINCIDENCIAS) -> tuple[list[str], int]:
+    """Líneas que encajan con la regex `patron`, con `contexto` líneas alrededor.
+    Devuelve (bloques formateados '>n: línea', líneas coincidentes totales)."""
+    regex = re.compile(patron.encode("utf-8"), re.MULTILINE)  # ^ y $ anclan a cada línea, no al archivo
+    mostradas_lineas: dict[int, str] = {}   # línea (0-indexada) → texto, en orden ascendente
+    marcadas: set[int] = set()
+    vistas = mostradas = 0
+    ultima_mostrada = -1     # última línea ya incluida en algún bloque
+    linea_anterior = -1
+    with _mapear(ruta) as m:
+        if not len(m):
+            return [], 0
+        indice = _indice(ruta, m)
+        for coincidencia in regex.finditer(m):
+            linea = indice.linea_de(m, coincidencia.start())
+            if linea == linea_anterior:
+                continue  # varias coincidencias en la misma línea
+            linea_anterior = linea
+            vistas += 1
+            if linea in mostradas_lineas:
+                marcadas.add(linea)  # ya salía como contexto de la anterior
+            desde = max(linea - contexto, ultima_mostrada + 1)
+            hasta = min(linea + contexto, indice.total - 1)
+            if desde > hasta or mostradas >= max_coincidencias:
+                continue  # solo cuenta si añade líneas a la salida
+            mostradas += 1
+            marcadas.add(linea)
+            pos = indice.inicio(m, desde)
+            for i in range(desde, hasta + 1):
+                pos, contenido = _linea_en(m, pos)
+                mostradas_lineas[i] = _texto(contenido)
+            ultima_mostrada = hasta
+    bloques: list[str] = []
+    actual: list[str] = []
+    anterior = -1
+    for i, texto in mostradas_lineas.items():
+        if actual and i > anterior + 1:
+            bloques += ["\n".join(actual), "--"]
+            actual = []
+        actual.append(f"{'>' if i in marcadas else ' '}{i + 1}: {texto}")
+        anterior = i
+    if actual:
+        bloques.append("\n".join(actual))
+    return bloques, vistas
@@ -0,0 +1,239 @@
+"""Métricas del sistema leídas en proceso (/proc, statvfs, uname), sin lanzar
+`free`, `ps`, `df`, `uptime` ni `uname`.
+
+Cada métrica tiene un lector que devuelve datos estructurados y un formateador
+que imita la salida del comando al que sustituye. Solo Linux: fuera de él los
+lectores lanzan OSError y tools.sistema vuelve a los comandos.
+"""
+
+import heapq
+import math
+import os
+import pwd
+import time
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGINA = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Sistemas de ficheros virtuales que `df` no muestra
+_FS_VIRTUALES = {
+    "proc", "sysfs", "devpts", "cgroup", "cgroup2", "securityfs", "pstore", "debugfs",
+    "tracefs", "configfs", "fusectl", "mqueue", "hugetlbfs", "bpf", "autofs", "binfmt_misc",
+    "rpc_pipefs", "nsfs", "efivarfs", "ramfs", "selinuxfs",
+}
+
+_usuarios: dict[int, str] = {}
+
+
+def _usuario(uid: int) -> str:
+    if uid not in _usuarios:
+        try:
+            _usuarios[uid] = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            _usuarios[uid] = str(uid)
+    return _usuarios[uid]
+
+
+def _humano(n: float, sufijos: tuple[str, ...], redondeo=round) -> str:
+    """Tamaño legible como `free -h` / `df -h`: un decimal por debajo de 10."""
+    for sufijo in sufijos:
+        if abs(n) < 1024 or sufijo == sufijos[-1]:
+            if abs(n) < 10 and sufijo != sufijos[0]:
+                return f"{redondeo(n * 10) / 10:.1f}{sufijo}"
+            return f"{redondeo(n):.0f}{sufijo}"
+        n /= 1024
+    return f"{n:.0f}{sufijos[-1]}"
+
+
+def _h_free(n: float) -> str:
+    return _humano(n, ("B", "Ki", "Mi", "Gi", "Ti", "Pi"))
+
+
+def _h_df(n: float) -> str:
+    return _humano(n, ("", "K", "M", "G", "T", "P"), redondeo=math.ceil)  # df redondea hacia arriba
+
+
+# ── Memoria ──────────────────────────────────────────────────────────────────
+
+def leer_meminfo() -> dict[str, int]:
+    """/proc/meminfo en kB."""
+    info = {}
+    with open("/proc/meminfo") as f:
+        for linea in f:
+            clave, _, resto = linea.partition(":")
+            info[clave] = int(resto.split()[0])
+    return info
+
+
+def leer_memoria() -> dict[str, int]:
+    """Columnas de `free` en bytes."""
+    m = {k: v * 1024 for k, v in leer_meminfo().items()}
+    cache = m.get("Cached", 0) + m.get("SReclaimable", 0)
+    libre = m.get("MemFree", 0)
+    return {
+        "total": m["MemTotal"],
+        "usada": m["MemTotal"] - m.get("MemAvailable", libre),  # criterio de procps-ng 4
+        "libre": libre,
+        "compartida": m.get("Shmem", 0),
+        "buff_cache": m.get("Buffers", 0) + cache,
+        "disponible": m.get("MemAvailable", libre),
+        "swap_total": m.get("SwapTotal", 0),
+        "swap_usada": m.get("SwapTotal", 0) - m.get("SwapFree", 0),
+        "swap_libre": m.get("SwapFree", 0),
+    }
+
+
+def formatear_memoria(m: dict[str, int] | None = None) -> str:
+    m = m or leer_memoria()
+    cols = ["total", "used", "free", "shared", "buff/cache", "available"]
+    filas = [
+        "       " + "".join(f"{c:>12}" for c in cols),
+        "Mem:   " + "".join(f"{_h_free(m[k]):>12}" for k in
+                           ("total", "usada", "libre", "compartida", "buff_cache", "disponible")),
+        "Swap:  " + "".join(f"{_h_free(m[k]):>12}" for k in ("swap_total", "swap_usada", "swap_libre")),
+    ]
+    return "\n".join(filas)
+
+
+# ── Discos ───────────────────────────────────────────────────────────────────
+
+def leer_discos() -> list[dict]:
+    """Particiones montadas como `df`: dispositivo, tamaño, usado, libre (bytes), uso % y punto de montaje."""
+    discos, vistos = [], set()
+    with open("/proc/mounts") as f:
+        for linea in f:
+            dispositivo, montaje, fs = linea.split()[:3]
+            if fs in _FS_VIRTUALES:
+                continue
+            montaje = montaje.replace("\\040", " ")
+            try:
+                st = os.statvfs(montaje)
+            except OSError:
+                continue
+            if st.f_blocks == 0 or (dispositivo, st.f_fsid) in vistos:
+                continue
+            vistos.add((dispositivo, st.f_fsid))
+            usado = (st.f_blocks - st.f_bfree) * st.f_frsize
+            libre = st.f_bavail * st.f_frsize
+            discos.append({
+                "dispositivo": dispositivo,
+                "tamano": st.f_blocks * st.f_frsize,
+                "usado": usado,
+                "libre": libre,
+                "uso_pct": math.ceil(100 * usado / (usado + libre)) if usado + libre else 0,
+                "montaje": montaje,
+            })
+    return discos
+
+
+def formatear_discos(discos: list[dict] | None = None) -> str:
+    discos = leer_discos() if discos is None else discos
+    ancho = max([len("Filesystem"), *(len(d["dispositivo"]) for d in discos)])
+    lineas = [f"{'Filesystem':<{ancho}} {'Size':>5} {'Used':>5} {'Avail':>5} {'Use%':>4} Mounted on"]
+    for d in discos:
+        lineas.append(f"{d['dispositivo']:<{ancho}} {_h_df(d['tamano']):>5} {_h_df(d['usado']):>5} "
+                      f"{_h_df(d['libre']):>5} {d['uso_pct']:>3}% {d['montaje']}")
+    return "\n".join(lineas)
+
+
+# ── Sistema ──────────────────────────────────────────────────────────────────
+
+def leer_carga() -> tuple[float, float, float]:
+    with open("/proc/loadavg") as f:
+        a, b, c = f.read().split()[:3]
+    return float(a), float(b), float(c)
+
+
+def formatear_uptime() -> str:
+    with open("/proc/uptime") as f:
+        segundos = int(float(f.read().split()[0]))
+    dias, resto = divmod(segundos, 86400)
+    horas, minutos = divmod(resto // 60, 60)
+    arriba = f"{dias} day{'s' if dias != 1 else ''}, " if dias else ""
+    arriba += f"{horas:2d}:{minutos:02d}" if horas else f"{minutos} min"
+    carga = ", ".join(f"{x:.2f}" for x in leer_carga())
+    return f" {time.strftime('%H:%M:%S')} up {arriba},  load average: {carga}"
+
+
+def formatear_uname() -> str:
+    u = os.uname()
+    return f"{u.sysname} {u.nodename} {u.release} {u.version} {u.machine}"
+
+
+def usuario_actual() -> str:
+    return _usuario(os.getuid())
+
+
+# ── Procesos ─────────────────────────────────────────────────────────────────
+
+def _leer_stat(pid: str) -> tuple[str, str, int, int, int] | None:
+    """(comm, estado, ticks de CPU, vsize, rss en bytes) de /proc/<pid>/stat."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            datos = f.read().decode("utf-8", "replace")
+    except OSError:
+        return None
+    cierre = datos.rfind(")")
+    comm = datos[datos.find("(") + 1:cierre]
+    campos = datos[cierre + 2:].split()
+    # campos[0] = estado (campo 3 del man proc); utime=14, stime=15, vsize=23, rss=24
+    return comm, campos[0], int(campos[11]) + int(campos[12]), int(campos[20]), int(campos[21]) * _PAGINA
+
+
+def _muestra_cpu() -> dict[str, int]:
+    ticks = {}
+    for pid in os.listdir("/proc"):
+        if pid.isdigit():
+            st = _leer_stat(pid)
+            if st is not None:
+                ticks[pid] = st[2]
+    return ticks
+
+
+def top_procesos(n: int = 30, intervalo: float = 0.25) -> list[dict]:
+    """Los `n` procesos con más CPU entre dos muestras separadas `intervalo` segundos."""
+    antes = _muestra_cpu()
+    t0 = time.monotonic()
+    time.sleep(intervalo)
+    transcurrido = time.monotonic() - t0
+    memoria_total = leer_meminfo()["MemTotal"] * 1024
+
+    candidatos = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        st = _leer_stat(pid)
+        if st is None:
+            continue
+        comm, estado, ticks, vsize, rss = st
+        delta = ticks - antes.get(pid, ticks)
+        candidatos.append((delta, rss, pid, comm, estado, vsize))
+
+    procesos = []
+    for delta, rss, pid, comm, estado, vsize in heapq.nlargest(n, candidatos):
+        try:
+            uid = os.stat(f"/proc/{pid}").st_uid
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = " ".join(f.read().decode("utf-8", "replace").replace("\0", " ").split())
+        except OSError:
+            continue
+        procesos.append({
+            "usuario": _usuario(uid),
+            "pid": int(pid),
+            "cpu_pct": 100 * delta / _CLK_TCK / transcurrido,
+            "mem_pct": 100 * rss / memoria_total if memoria_total else 0.0,
+            "vsz": vsize // 1024,
+            "rss": rss // 1024,
+            "estado": estado,
+            "comando": cmdline or f"[{comm}]",
+        })
+    return procesos
+
+
+def formatear_procesos(procesos: list[dict] | None = None) -> str:
+    procesos = top_procesos() if procesos is None else procesos
+    lineas = [f"{'USER':<10} {'PID':>7} {'%CPU':>5} {'%MEM':>5} {'VSZ':>9} {'RSS':>8} STAT COMMAND"]
+    for p in procesos:
+        lineas.append(f"{p['usuario'][:10]:<10} {p['pid']:>7} {p['cpu_pct']:>5.1f} {p['mem_pct']:>5.1f} "
+                      f"{p['vsz']:>9} {p['rss']:>8} {p['estado']:<4} {p['comando'][:120]}")
+    return "\n".join(lineas)
@@ -1,9 +1,14 @@
 """Tools de Proxmox VE — consultas de solo lectura via API."""
 
+import fnmatch
 import json
 import os
+import threading
+import time
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from langchain_core.tools import tool
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
@@ -15,18 +20,155 @@ _PVE_VERIFY_SSL    = os.environ.get("PVE_VERIFY_SSL", "false").lower() == "true"
 
 PROXMOX_ENABLED = bool(_PVE_URL and _PVE_TOKEN_ID and _PVE_TOKEN_SECRET)
 
+# TTL de la caché de respuestas (segundos) por prefijo de ruta; gana el primero que coincida
+_TTL_POR_RUTA = [
+    ("/cluster/resources", 5),
+    ("/cluster/status",    10),
+    ("/nodes",             10),
+    ("/version",           3600),
+]
+_TTL_DEFECTO = 5
 
-def _get(path: str) -> dict | list:
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_cache: dict[str, tuple[float, dict | list]] = {}   # path → (expira, datos)
+_cache_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """Sesión keep-alive compartida, con auth fija y reintentos con backoff ante 5xx."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                s.verify = _PVE_VERIFY_SSL
+                s.headers["Authorization"] = f"PVEAPIToken={_PVE_TOKEN_ID}={_PVE_TOKEN_SECRET}"
+                reintentos = Retry(
+                    total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset({"GET"}), raise_on_status=False,
+                )
+                adaptador = HTTPAdapter(max_retries=reintentos, pool_maxsize=8)
+                s.mount("https://", adaptador)
+                s.mount("http://", adaptador)
+                _session = s
+    return _session
+
+
+def _ttl(path: str) -> float:
+    return next((ttl for prefijo, ttl in _TTL_POR_RUTA if path.startswith(prefijo)), _TTL_DEFECTO)
+
+
+def invalidar_cache(path: str | None = None) -> None:
+    """Olvida las respuestas cacheadas de `path` (y sus subrutas), o todas si no se indica."""
+    with _cache_lock:
+        if path is None:
+            _cache.clear()
+        else:
+            for clave in [c for c in _cache if c.startswith(path)]:
+                del _cache[clave]
+
+
+def _get_directo(path: str) -> dict | list:
+    """GET sin pasar por la caché: ni la lee ni la actualiza."""
     if not PROXMOX_ENABLED:
         return {"error": "Proxmox no configurado. Añade PVE_URL, PVE_TOKEN_ID y PVE_TOKEN_SECRET al .env"}
-    s = requests.Session()
-    s.verify = _PVE_VERIFY_SSL
-    s.headers["Authorization"] = f"PVEAPIToken={_PVE_TOKEN_ID}={_PVE_TOKEN_SECRET}"
-    r = s.get(f"{_PVE_URL}/api2/json{path}", timeout=15)
+    r = _get_session().get(f"{_PVE_URL}/api2/json{path}", timeout=15)
     r.raise_for_status()
     return r.json().get("data", {})
 
 
+def _get(path: str, ttl: float | None = None) -> dict | list:
+    if not PROXMOX_ENABLED:
+        return _get_directo(path)
+    ahora = time.monotonic()
+    with _cache_lock:
+        cacheado = _cache.get(path)
+        if cacheado is not None and cacheado[0] > ahora:
+            return cacheado[1]
+    data = _get_directo(path)
+    with _cache_lock:
+        _cache[path] = (ahora + (_ttl(path) if ttl is None else ttl), data)
+    return data
+
+
+# ── Instantánea de guests y cambios ──────────────────────────────────────────
+
+_UMBRAL_CPU = 0.20   # variación absoluta de CPU (fracción) que se considera cambio
+_UMBRAL_MEM = 0.25   # variación relativa de RAM usada
+
+
+class _Instantanea:
+    """Última lista de guests (qemu/lxc) que vio el modelo, indexada por vmid."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.guests: dict[int, dict] | None = None
+        self.tomada: float | None = None
+
+    def actualizar(self, guests: dict[int, dict]) -> tuple[dict[int, dict] | None, float | None]:
+        """Sustituye la instantánea y devuelve la anterior con su hora."""
+        with self._lock:
+            previa = (self.guests, self.tomada)
+            self.guests, self.tomada = guests, time.time()
+            return previa
+
+
+_instantanea = _Instantanea()
+
+
+def _guests() -> dict[int, dict] | str:
+    """Guests actuales por vmid, o el mensaje de error."""
+    data = _get("/cluster/resources")
+    if isinstance(data, dict) and "error" in data:
+        return data["error"]
+    return {r["vmid"]: r for r in data if r.get("type") in ("qemu", "lxc") and "vmid" in r}
+
+
+def _formatear_guest(r: dict) -> str:
+    tipo = "VM " if r["type"] == "qemu" else "LXC"
+    estado = r.get("status", "?")
+    cpu = f"{r.get('cpu', 0)*100:.1f}%"
+    mem = r.get("mem", 0) / 1024**2
+    return f"- [{tipo}] {r.get('name','?')} (ID:{r.get('vmid','?')}) nodo:{r.get('node','?')} | {estado} | CPU {cpu} | RAM {mem:.0f} MB"
+
+
+def _ordenados(guests) -> list[dict]:
+    return sorted(guests, key=lambda x: (x.get("node", ""), x.get("vmid", 0)))
+
+
+def _diff(antes: dict[int, dict], ahora: dict[int, dict]) -> dict[str, list[str]]:
+    """Cambios entre dos instantáneas, agrupados por tipo."""
+    cambios: dict[str, list[str]] = {
+        "nuevos": [], "eliminados": [], "arrancados": [], "parados": [],
+        "migrados": [], "recursos": [],
+    }
+    for vmid in sorted(ahora.keys() - antes.keys()):
+        cambios["nuevos"].append(_formatear_guest(ahora[vmid]))
+    for vmid in sorted(antes.keys() - ahora.keys()):
+        cambios["eliminados"].append(f"- {antes[vmid].get('name', '?')} (ID:{vmid})")
+    for vmid in sorted(antes.keys() & ahora.keys()):
+        a, b = antes[vmid], ahora[vmid]
+        nombre = f"{b.get('name', '?')} (ID:{vmid})"
+        if a.get("status") != b.get("status"):
+            clave = "arrancados" if b.get("status") == "running" else "parados"
+            cambios[clave].append(f"- {nombre}: {a.get('status', '?')} → {b.get('status', '?')}")
+        if a.get("node") != b.get("node"):
+            cambios["migrados"].append(f"- {nombre}: {a.get('node', '?')} → {b.get('node', '?')}")
+        deltas = []
+        if abs(b.get("cpu", 0) - a.get("cpu", 0)) >= _UMBRAL_CPU:
+            deltas.append(f"CPU {a.get('cpu', 0)*100:.0f}% → {b.get('cpu', 0)*100:.0f}%")
+        mem_a, mem_b = a.get("mem", 0), b.get("mem", 0)
+        if mem_a and abs(mem_b - mem_a) / mem_a >= _UMBRAL_MEM:
+            deltas.append(f"RAM {mem_a / 1024**2:.0f} → {mem_b / 1024**2:.0f} MB")
+        if a.get("maxmem") != b.get("maxmem") or a.get("maxcpu") != b.get("maxcpu"):
+            deltas.append(f"límites {a.get('maxcpu', '?')} vCPU/{a.get('maxmem', 0) / 1024**3:.1f} GB → "
+                          f"{b.get('maxcpu', '?')} vCPU/{b.get('maxmem', 0) / 1024**3:.1f} GB")
+        if deltas:
+            cambios["recursos"].append(f"- {nombre}: {', '.join(deltas)}")
+    return cambios
+
+
 @tool
 def proxmox_nodos() -> str:
     """Lista los nodos del cluster Proxmox con su estado, CPU y memoria."""
@@ -46,22 +188,58 @@ def proxmox_nodos() -> str:
 @tool
 def proxmox_vms() -> str:
     """Lista todas las VMs y contenedores LXC del cluster con estado y recursos."""
-    data = _get("/cluster/resources")
-    if isinstance(data, dict) and "error" in data:
-        return data["error"]
-    recursos = [r for r in data if r.get("type") in ("qemu", "lxc")]
-    if not recursos:
+    guests = _guests()
+    if isinstance(guests, str):
+        return guests
+    _instantanea.actualizar(guests)
+    if not guests:
         return "Sin VMs ni contenedores."
-    lineas = []
-    for r in sorted(recursos, key=lambda x: (x.get("node", ""), x.get("vmid", 0))):
-        tipo = "VM " if r["type"] == "qemu" else "LXC"
-        estado = r.get("status", "?")
-        cpu = f"{r.get('cpu', 0)*100:.1f}%"
-        mem = r.get("mem", 0) / 1024**2
-        lineas.append(f"- [{tipo}] {r.get('name','?')} (ID:{r.get('vmid','?')}) nodo:{r.get('node','?')} | {estado} | CPU {cpu} | RAM {mem:.0f} MB")
+    return "\n".join(_formatear_guest(r) for r in _ordenados(guests.values()))
+
+
+@tool
+def proxmox_cambios() -> str:
+    """Muestra solo lo que cambió en VMs y contenedores desde la última vez que los consultaste:
+    creados, eliminados, arrancados, parados, migrados de nodo y cambios fuertes de CPU/RAM."""
+    guests = _guests()
+    if isinstance(guests, str):
+        return guests
+    previa, tomada = _instantanea.actualizar(guests)
+    if previa is None:
+        activos = sum(1 for r in guests.values() if r.get("status") == "running")
+        return f"Primera consulta: {len(guests)} guests ({activos} en ejecución). Usa proxmox_vms para verlos."
+    cambios = {k: v for k, v in _diff(previa, guests).items() if v}
+    hace = f"hace {time.time() - tomada:.0f}s"
+    if not cambios:
+        return f"Sin cambios desde la última consulta ({hace})."
+    lineas = [f"Cambios desde la última consulta ({hace}):"]
+    for tipo, items in cambios.items():
+        lineas.append(f"{tipo.capitalize()}:")
+        lineas.extend(items)
     return "\n".join(lineas)
 
 
+@tool
+def proxmox_filtrar(nodo: str = "", estado: str = "", nombre: str = "") -> str:
+    """Lista solo las VMs/contenedores que cumplen los filtros indicados.
+    nodo: nombre exacto del nodo; estado: 'running', 'stopped'...; nombre: patrón tipo '*web*'."""
+    guests = _guests()
+    if isinstance(guests, str):
+        return guests
+    patron = nombre.lower() if nombre else ""
+    if patron and not any(c in patron for c in "*?["):
+        patron = f"*{patron}*"
+    seleccion = [
+        r for r in guests.values()
+        if (not nodo or r.get("node") == nodo)
+        and (not estado or r.get("status") == estado)
+        and (not patron or fnmatch.fnmatch(str(r.get("name", "")).lower(), patron))
+    ]
+    if not seleccion:
+        return "Ningún guest cumple el filtro."
+    return "\n".join(_formatear_guest(r) for r in _ordenados(seleccion))
+
+
 @tool
 def proxmox_cluster() -> str:
     """Muestra el estado general del cluster Proxmox (quorum, nodos, etc.)."""
@@ -80,4 +258,5 @@ def proxmox_version() -> str:
     return f"Proxmox VE {data.get('version', '?')} (release {data.get('release', '?')})"
 
 
-PROXMOX_TOOLS = [proxmox_nodos, proxmox_vms, proxmox_cluster, proxmox_version]
+PROXMOX_TOOLS = [proxmox_nodos, proxmox_vms, proxmox_cambios, proxmox_filtrar,
+                 proxmox_cluster, proxmox_version]
@@ -3,6 +3,7 @@
 import os
 import subprocess
 from langchain_core.tools import tool
+from tools import indice, lectura, metricas
 
 MAX_FILE_CHARS = 8000
 MAX_RESULTS = 60
@@ -39,11 +40,38 @@ def listar_directorio(ruta: str) -> str:
         return f"[Error] {ex}"
 
 
+def _recortar(texto: str) -> str:
+    if len(texto) > MAX_FILE_CHARS:
+        return texto[:MAX_FILE_CHARS] + "\n...[truncado — pide un rango más pequeño]"
+    return texto
+
+
+def _rango_lineas(lineas: str) -> tuple[int, int]:
+    """'100-200' → (100, 200); '100' → (100, 100); '100-' → (100, ∞)."""
+    inicio, _, fin = lineas.partition("-")
+    inicio = int(inicio)
+    if not _:
+        return inicio, inicio
+    return inicio, int(fin) if fin.strip() else 2**63
+
+
 @tool
-def leer_archivo(ruta: str) -> str:
-    """Lee el contenido de un archivo de texto. Máximo 8000 caracteres."""
+def leer_archivo(ruta: str, desde_byte: int | None = None, lineas: str = "", cola: int = 0) -> str:
+    """Lee el contenido de un archivo de texto. Máximo 8000 caracteres.
+    Para archivos grandes (logs) lee solo una parte: `lineas='100-200'` (rango de líneas),
+    `cola=50` (últimas 50 líneas) o `desde_byte=N` (8000 bytes desde el offset N; negativo cuenta desde el final)."""
     try:
         ruta = os.path.expanduser(ruta)
+        if cola > 0:
+            return _recortar(lectura.cola(ruta, cola)) or "(archivo vacío)"
+        if lineas:
+            inicio, fin = _rango_lineas(lineas)
+            texto, total = lectura.leer_lineas(ruta, inicio, fin)
+            if not texto:
+                return f"(sin líneas en ese rango; el archivo tiene {total})"
+            return _recortar(texto) + f"\n[líneas {inicio}-{min(fin, total)} de {total}]"
+        if desde_byte is not None:
+            return lectura.leer_bytes(ruta, desde_byte, MAX_FILE_CHARS)
         with open(ruta, "r", encoding="utf-8", errors="replace") as f:
             contenido = f.read(MAX_FILE_CHARS)
         if len(contenido) == MAX_FILE_CHARS:
@@ -53,10 +81,31 @@ def leer_archivo(ruta: str) -> str:
         return f"[Error] {ex}"
 
 
+@tool
+def buscar_en_archivo(ruta: str, patron: str, contexto: int = 2) -> str:
+    """Busca una expresión regular dentro de un archivo (útil en logs grandes) y devuelve las líneas
+    coincidentes, marcadas con '>', con `contexto` líneas alrededor y su número de línea."""
+    try:
+        ruta = os.path.expanduser(ruta)
+        bloques, total = lectura.buscar(ruta, patron, contexto=contexto)
+        if not total:
+            return "(sin coincidencias)"
+        texto = _recortar("\n".join(bloques))
+        if total > lectura.MAX_COINCIDENCIAS:
+            texto += f"\n[{total} líneas coinciden; se muestran las primeras {lectura.MAX_COINCIDENCIAS}]"
+        return texto
+    except Exception as ex:
+        return f"[Error] {ex}"
+
+
 @tool
 def buscar_archivos(patron: str, ruta_base: str = "~") -> str:
     """Busca archivos por nombre o patrón glob (ej: '*.py', 'config.json') en una ruta."""
     ruta_base = os.path.expanduser(ruta_base)
+    if indice.INDICE_ENABLED:
+        rutas = indice.buscar_nombre(patron, ruta_base, MAX_RESULTS)
+        if rutas is not None:
+            return "\n".join(rutas) if rutas else "Sin resultados."
     out = _run(["find", ruta_base, "-name", patron, "-maxdepth", "10",
                 "-not", "-path", "*/.*"])
     lineas = [l for l in out.splitlines() if l][:MAX_RESULTS]
@@ -67,6 +116,10 @@ def buscar_archivos(patron: str, ruta_base: str = "~") -> str:
 def buscar_contenido(texto: str, ruta_base: str = "~", extension: str = "*") -> str:
     """Busca un texto dentro de archivos. Devuelve los archivos que lo contienen."""
     ruta_base = os.path.expanduser(ruta_base)
+    if indice.INDICE_ENABLED:
+        rutas = indice.buscar_texto(texto, ruta_base, extension, MAX_RESULTS)
+        if rutas is not None:
+            return "\n".join(rutas) if rutas else "Sin resultados."
     out = _run(["grep", "-r", "--include", f"*.{extension}", "-l", texto, ruta_base])
     lineas = [l for l in out.splitlines() if l][:MAX_RESULTS]
     return "\n".join(lineas) if lineas else "Sin resultados."
@@ -75,31 +128,48 @@ def buscar_contenido(texto: str, ruta_base: str = "~", extension: str = "*") ->
 @tool
 def info_sistema() -> str:
     """Muestra información general del sistema: hostname, kernel, uptime, usuario."""
-    return "\n".join([
-        f"Usuario: {_run(['whoami'])}",
-        f"Hostname: {_run(['hostname'])}",
-        f"Uptime: {_run(['uptime'])}",
-        f"Kernel: {_run(['uname', '-a'])}",
-    ])
+    try:
+        return "\n".join([
+            f"Usuario: {metricas.usuario_actual()}",
+            f"Hostname: {os.uname().nodename}",
+            f"Uptime: {metricas.formatear_uptime()}",
+            f"Kernel: {metricas.formatear_uname()}",
+        ])
+    except OSError:
+        return "\n".join([
+            f"Usuario: {_run(['whoami'])}",
+            f"Hostname: {_run(['hostname'])}",
+            f"Uptime: {_run(['uptime'])}",
+            f"Kernel: {_run(['uname', '-a'])}",
+        ])
 
 
 @tool
 def uso_disco() -> str:
     """Muestra el uso de disco de todas las particiones montadas."""
-    return _run(["df", "-h"])
+    try:
+        return metricas.formatear_discos()
+    except OSError:
+        return _run(["df", "-h"])
 
 
 @tool
 def uso_memoria() -> str:
     """Muestra el uso de memoria RAM y swap."""
-    return _run(["free", "-h"])
+    try:
+        return metricas.formatear_memoria()
+    except OSError:
+        return _run(["free", "-h"])
 
 
 @tool
 def procesos_activos() -> str:
     """Lista los procesos en ejecución ordenados por uso de CPU."""
-    out = _run(["ps", "aux", "--sort=-%cpu"])
-    return "\n".join(out.splitlines()[:30])
+    try:
+        return metricas.formatear_procesos(metricas.top_procesos(29))
+    except OSError:
+        out = _run(["ps", "aux", "--sort=-%cpu"])
+        return "\n".join(out.splitlines()[:30])
 
 
 @tool
@@ -137,6 +207,7 @@ def ejecutar_comando_seguro(comando: str) -> str:
 SISTEMA_TOOLS = [
     listar_directorio,
     leer_archivo,
+    buscar_en_archivo,
     buscar_archivos,
     buscar_contenido,
     info_sistema,
@@ -1,26 +1,153 @@
-"""Tool SSH para Proxmox VE — usa el alias 'ssh pve' del sistema (sin credenciales en .env)."""
+"""Tool SSH para Proxmox VE — usa el alias 'ssh pve' del sistema (sin credenciales en .env).
 
+Los comandos viajan por una conexión maestra persistente (ControlMaster de
+OpenSSH) propiedad de este módulo: el handshake se paga una vez y cada comando
+posterior solo abre un canal sobre el socket de control.
+"""
+
+import atexit
+import os
+import re
+import stat
 import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 from langchain_core.tools import tool
-from memory.semantica import guardar_hecho
+from memory.semantica import guardar_hechos
+
+load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
 SSH_ALIAS = "pve"
 SSH_ENABLED = True  # Siempre activo — depende de que 'ssh pve' esté configurado en ~/.ssh/config
+# Inventario de la flota: alias de ~/.ssh/config separados por comas (por defecto solo SSH_ALIAS)
+PVE_HOSTS = [h.strip() for h in os.environ.get("PVE_HOSTS", SSH_ALIAS).split(",") if h.strip()] or [SSH_ALIAS]
+HOST_PRINCIPAL = PVE_HOSTS[0]   # destino de las tools de un solo servidor si no se indica host
+MAX_HOSTS_PARALELO = int(os.environ.get("PVE_MAX_PARALELO", "8"))
+
+CONNECT_TIMEOUT = 10
+CONTROL_PERSIST = "10m"   # la maestra se cierra sola tras este tiempo sin uso
+# Directorio de los sockets de control: XDG_RUNTIME_DIR (privado del usuario) si existe
+CONTROL_DIR = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(), f"chatty-ssh-{os.getuid()}")
+MAX_CANALES = 8           # canales simultáneos por maestra (sshd MaxSessions es 10 por defecto)
+ESPERA_TRAS_FALLO = 120   # segundos sin reintentar la maestra tras un fallo (se conecta directo)
 
 _PROHIBIDOS = ["rm", "mv", "cp", "chmod", "chown", "dd", "mkfs", "fdisk",
                "apt", "dpkg -i", "reboot", "shutdown", "kill", "pkill",
                "passwd", "userdel", ">", ">>", "curl -o", "wget -O"]
+# Las órdenes se comparan como palabras completas ("rm" no bloquea "--output-format");
+# las redirecciones, como caracteres.
+_PATRONES_PROHIBIDOS = [(p, re.compile(re.escape(p) if not p[0].isalnum() else rf"\b{re.escape(p)}\b"))
+                        for p in _PROHIBIDOS]
+
+
+def _directorio_privado() -> bool:
+    """Crea CONTROL_DIR si falta y comprueba que es un directorio nuestro con modo 0700.
+    En /tmp otro usuario podría haberlo creado antes para hacerse con el socket de
+    control; en ese caso no se usa y ssh conecta sin multiplexar."""
+    try:
+        os.makedirs(CONTROL_DIR, mode=0o700, exist_ok=True)
+        st = os.lstat(CONTROL_DIR)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+class _Transporte:
+    """Conexión maestra SSH hacia un alias: arranque, comprobación, reconexión y cierre."""
+
+    def __init__(self, alias: str):
+        self.alias = alias
+        self.socket = os.path.join(CONTROL_DIR, f"{alias}.sock")
+        self._lock = threading.Lock()
+        self._sin_maestra_hasta = 0.0   # time.monotonic() hasta el que no se reintenta la maestra
+
+    def _base(self) -> list[str]:
+        control = self.socket if _directorio_privado() else "none"
+        return ["ssh", "-o", "BatchMode=yes", "-o", f"ConnectTimeout={CONNECT_TIMEOUT}",
+                "-o", f"ControlPath={control}"]
+
+    def activo(self) -> bool:
+        if not _directorio_privado() or not os.path.exists(self.socket):
+            return False
+        r = subprocess.run([*self._base(), "-O", "check", self.alias],
+                           capture_output=True, timeout=5)
+        return r.returncode == 0
+
+    def conectar(self) -> bool:
+        """Arranca la maestra en segundo plano (-f -N). Devuelve False si no se pudo;
+        tras un fallo no se reintenta durante ESPERA_TRAS_FALLO segundos."""
+        with self._lock:
+            if time.monotonic() < self._sin_maestra_hasta:
+                return False
+            if self.activo():
+                return True
+            try:
+                if not _directorio_privado():
+                    raise PermissionError(f"{CONTROL_DIR} no es un directorio privado")
+                try:
+                    os.unlink(self.socket)  # socket huérfano de una maestra muerta
+                except FileNotFoundError:
+                    pass
+                r = subprocess.run(
+                    [*self._base(), "-M", "-N", "-f",
+                     "-o", f"ControlPersist={CONTROL_PERSIST}",
+                     "-o", "ServerAliveInterval=15", "-o", "ServerAliveCountMax=3",
+                     self.alias],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    timeout=CONNECT_TIMEOUT + 5,
+                )
+                conectada = r.returncode == 0
+            except (OSError, subprocess.TimeoutExpired):
+                conectada = False
+            self._sin_maestra_hasta = 0.0 if conectada else time.monotonic() + ESPERA_TRAS_FALLO
+            return conectada
+
+    def ejecutar(self, comando: str, timeout: int) -> subprocess.CompletedProcess:
+        """Ejecuta sobre la maestra; si la conexión cae (código 255) reconecta y reintenta una vez.
+        Sin maestra, ssh conecta directamente (ControlMaster=no), así que nunca se pierde el comando."""
+        if not os.path.exists(self.socket):
+            self.conectar()
+        cmd = [*self._base(), "-o", "ControlMaster=no", self.alias, comando]
+        r = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        if r.returncode == 255 and not self.activo() and self.conectar():
+            r = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        return r
 
+    def cerrar(self) -> None:
+        if _directorio_privado() and os.path.exists(self.socket):
+            subprocess.run([*self._base(), "-O", "exit", self.alias],
+                           capture_output=True, timeout=5)
 
-def _ssh(comando: str, timeout: int = 30) -> str:
-    for p in _PROHIBIDOS:
-        if p in comando:
+
+_transportes: dict[str, _Transporte] = {}
+_transportes_lock = threading.Lock()
+
+
+def _transporte(alias: str = HOST_PRINCIPAL) -> _Transporte:
+    with _transportes_lock:
+        if alias not in _transportes:
+            _transportes[alias] = _Transporte(alias)
+        return _transportes[alias]
+
+
+@atexit.register
+def _cerrar_transportes() -> None:
+    for t in list(_transportes.values()):
+        try:
+            t.cerrar()
+        except Exception:
+            pass
+
+
+def _ssh(comando: str, timeout: int = 30, host: str = HOST_PRINCIPAL) -> str:
+    for p, patron in _PATRONES_PROHIBIDOS:
+        if patron.search(comando):
             return f"[Bloqueado] Comando no permitido: '{p}'"
     try:
-        r = subprocess.run(
-            ["ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=10", SSH_ALIAS, comando],
-            capture_output=True, text=True, timeout=timeout
-        )
+        r = _transporte(host).ejecutar(comando, timeout)
         salida = r.stdout.strip() or r.stderr.strip() or "(sin salida)"
         return salida
     except subprocess.TimeoutExpired:
@@ -29,80 +156,217 @@ def _ssh(comando: str, timeout: int = 30) -> str:
         return f"[Error SSH] {e}"
 
 
+def _es_error(salida: str) -> bool:
+    return salida.startswith(("[Error", "[Bloqueado"))
+
+
+def _ssh_lote(comandos: dict[str, str], timeout: int = 30, host: str = HOST_PRINCIPAL) -> dict[str, str]:
+    """Ejecuta varios comandos con nombre a la vez, cada uno en su propio canal
+    sobre la maestra y con su propio timeout. Devuelve {nombre: salida} en el
+    mismo orden; un fallo solo afecta a su entrada (ver _es_error)."""
+    if not comandos:
+        return {}
+    try:
+        _transporte(host).conectar()  # una sola maestra antes de abrir los canales
+    except Exception:
+        pass  # cada comando informará de su propio error
+    with ThreadPoolExecutor(max_workers=min(MAX_CANALES, len(comandos))) as pool:
+        futuros = {nombre: pool.submit(_ssh, cmd, timeout, host) for nombre, cmd in comandos.items()}
+        return {nombre: f.result() for nombre, f in futuros.items()}
+
+
+def _resolver_hosts(selector: str) -> list[str]:
+    """'all'/'todos'/'' → todo el inventario; si no, alias separados por comas.
+    Lanza ValueError si alguno no está en PVE_HOSTS."""
+    selector = (selector or "").strip()
+    if selector.lower() in ("", "all", "todos"):
+        return list(PVE_HOSTS)
+    hosts = [h.strip() for h in selector.split(",") if h.strip()]
+    desconocidos = [h for h in hosts if h not in PVE_HOSTS]
+    if desconocidos:
+        raise ValueError(f"Host(s) desconocido(s): {', '.join(desconocidos)}. Disponibles: {', '.join(PVE_HOSTS)}")
+    return hosts
+
+
+def _host_unico(host: str) -> str:
+    """Alias para las tools de un solo servidor: '' → HOST_PRINCIPAL.
+    Lanza ValueError si no está en PVE_HOSTS o si se piden varios."""
+    hosts = _resolver_hosts(host or HOST_PRINCIPAL)
+    if len(hosts) != 1:
+        raise ValueError("Esta tool consulta un solo host; para varios usa pve_ejecutar o las pve_flota_*.")
+    return hosts[0]
+
+
+def _ssh_en(comando: str, host: str) -> str:
+    try:
+        return _ssh(comando, host=_host_unico(host))
+    except ValueError as e:
+        return f"[Error] {e}"
+
+
+def _en_flota(comando: str, hosts: list[str], timeout: int = 30) -> dict[str, str]:
+    """Ejecuta el mismo comando en varios hosts en paralelo (pool acotado): {host: salida}."""
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_HOSTS_PARALELO, len(hosts)))) as pool:
+        futuros = {h: pool.submit(_ssh, comando, timeout, h) for h in hosts}
+        return {h: f.result() for h, f in futuros.items()}
+
+
+def _tabla_flota(resultados: dict[str, str]) -> str:
+    """Une las tablas de texto de varios hosts (qm list, pct list, pvesm status)
+    en una sola, con una columna HOST delante y una única cabecera."""
+    ancho = max([len("HOST"), *map(len, resultados)])
+    cabecera, filas, errores = None, [], []
+    for host, salida in resultados.items():
+        if _es_error(salida):
+            errores.append(f"⚠ {host}: {salida}")
+            continue
+        lineas = [l for l in salida.splitlines() if l.strip()]
+        if not lineas or salida == "(sin salida)":
+            continue
+        if cabecera is None:
+            cabecera = f"{'HOST':<{ancho}}  {lineas[0]}"
+        filas.extend(f"{host:<{ancho}}  {l}" for l in lineas[1:])
+    partes = []
+    if cabecera:
+        partes.append("\n".join([cabecera, *filas]) if filas else cabecera)
+    partes.extend(errores)
+    return "\n".join(partes) if partes else "(sin salida)"
+
+
+def _consulta_flota(comando: str, hosts: str) -> str:
+    try:
+        seleccion = _resolver_hosts(hosts)
+    except ValueError as e:
+        return f"[Error] {e}"
+    return _tabla_flota(_en_flota(comando, seleccion))
+
+
 @tool
-def pve_ejecutar(comando: str) -> str:
+def pve_ejecutar(comando: str, host: str = HOST_PRINCIPAL) -> str:
     """Ejecuta un comando de solo lectura en el servidor Proxmox VE via SSH.
     Ejemplos: 'qm list', 'pct list', 'pvesh get /nodes', 'df -h', 'cat /etc/pve-release',
-    'systemctl status pve-cluster', 'pvesm status'."""
-    return _ssh(comando)
+    'systemctl status pve-cluster', 'pvesm status'.
+    host: alias del servidor (por defecto, el primero de PVE_HOSTS), varios separados
+    por comas, o 'all' para toda la flota."""
+    try:
+        hosts = _resolver_hosts(host)
+    except ValueError as e:
+        return f"[Error] {e}"
+    if len(hosts) == 1:
+        return _ssh(comando, host=hosts[0])
+    return "\n\n".join(f"=== {h} ===\n{salida}" for h, salida in _en_flota(comando, hosts).items())
+
+
+@tool
+def pve_flota_vms(hosts: str = "all") -> str:
+    """Lista las VMs (qm list) de varios servidores Proxmox a la vez, en una sola tabla con columna HOST.
+    hosts: 'all' o alias separados por comas."""
+    return _consulta_flota("qm list", hosts)
+
+
+@tool
+def pve_flota_contenedores(hosts: str = "all") -> str:
+    """Lista los contenedores LXC (pct list) de varios servidores Proxmox en una sola tabla con columna HOST.
+    hosts: 'all' o alias separados por comas."""
+    return _consulta_flota("pct list", hosts)
+
+
+@tool
+def pve_flota_almacenamiento(hosts: str = "all") -> str:
+    """Muestra el almacenamiento (pvesm status) de varios servidores Proxmox en una sola tabla con columna HOST.
+    hosts: 'all' o alias separados por comas."""
+    return _consulta_flota("pvesm status", hosts)
 
 
 @tool
-def pve_vms() -> str:
-    """Lista todas las VMs (QEMU/KVM) del servidor Proxmox con su estado y recursos."""
-    return _ssh("qm list")
+def pve_vms(host: str = HOST_PRINCIPAL) -> str:
+    """Lista todas las VMs (QEMU/KVM) del servidor Proxmox con su estado y recursos.
+    host: alias del servidor (por defecto, el primero de PVE_HOSTS)."""
+    return _ssh_en("qm list", host)
 
 
 @tool
-def pve_contenedores() -> str:
-    """Lista todos los contenedores LXC del servidor Proxmox con su estado."""
-    return _ssh("pct list")
+def pve_contenedores(host: str = HOST_PRINCIPAL) -> str:
+    """Lista todos los contenedores LXC del servidor Proxmox con su estado.
+    host: alias del servidor (por defecto, el primero de PVE_HOSTS)."""
+    return _ssh_en("pct list", host)
 
 
 @tool
-def pve_almacenamiento() -> str:
-    """Muestra el uso de almacenamiento en el servidor Proxmox."""
-    return _ssh("pvesm status")
+def pve_almacenamiento(host: str = HOST_PRINCIPAL) -> str:
+    """Muestra el uso de almacenamiento en el servidor Proxmox.
+    host: alias del servidor (por defecto, el primero de PVE_HOSTS)."""
+    return _ssh_en("pvesm status", host)
 
 
 @tool
-def pve_version() -> str:
-    """Muestra la versión de Proxmox VE instalada."""
-    return _ssh("pveversion")
+def pve_version(host: str = HOST_PRINCIPAL) -> str:
+    """Muestra la versión de Proxmox VE instalada.
+    host: alias del servidor (por defecto, el primero de PVE_HOSTS)."""
+    return _ssh_en("pveversion", host)
 
 
 @tool
-def pve_logs(servicio: str = "pve-cluster") -> str:
+def pve_logs(servicio: str = "pve-cluster", host: str = HOST_PRINCIPAL) -> str:
     """Muestra los últimos 30 logs de un servicio Proxmox.
-    Servicios: pvedaemon, pvestatd, corosync, pve-firewall, pve-cluster."""
-    return _ssh(f"journalctl -u {servicio} -n 30 --no-pager")
+    Servicios: pvedaemon, pvestatd, corosync, pve-firewall, pve-cluster.
+    host: alias del servidor (por defecto, el primero de PVE_HOSTS)."""
+    return _ssh_en(f"journalctl -u {servicio} -n 30 --no-pager", host)
 
 
 @tool
-def pve_ups() -> str:
+def pve_ups(host: str = HOST_PRINCIPAL) -> str:
     """Muestra el estado actual del UPS (SAI) conectado al servidor Proxmox:
-    carga de batería, voltaje, carga conectada y tiempo restante."""
-    return _ssh("~/scripts/estado_ups.sh")
+    carga de batería, voltaje, carga conectada y tiempo restante.
+    host: alias del servidor (por defecto, el primero de PVE_HOSTS)."""
+    return _ssh_en("~/scripts/estado_ups.sh", host)
 
 
 @tool
-def pve_explorar() -> str:
+def pve_explorar(host: str = HOST_PRINCIPAL) -> str:
     """Explora el servidor Proxmox de forma completa: versión, nodos, VMs, contenedores,
-    almacenamiento y recursos. Guarda automáticamente los hallazgos en la memoria semántica."""
-    hallazgos = {}
-
-    hallazgos["version"]        = _ssh("pveversion")
-    hallazgos["vms"]            = _ssh("qm list")
-    hallazgos["contenedores"]   = _ssh("pct list")
-    hallazgos["almacenamiento"] = _ssh("pvesm status")
-    hallazgos["disco"]          = _ssh("df -h")
-    hallazgos["memoria"]        = _ssh("free -h")
-    hallazgos["nodos"]          = _ssh("pvesh get /nodes --output-format=json-pretty 2>/dev/null | head -50")
-
-    # Guardar hallazgos relevantes en memoria semántica
+    almacenamiento y recursos. Guarda automáticamente los hallazgos en la memoria semántica.
+    host: alias del servidor (por defecto, el primero de PVE_HOSTS)."""
+    try:
+        host = _host_unico(host)
+    except ValueError as e:
+        return f"[Error] {e}"
+    hallazgos = _ssh_lote({
+        "version":        "pveversion",
+        "vms":            "qm list",
+        "contenedores":   "pct list",
+        "almacenamiento": "pvesm status",
+        "disco":          "df -h",
+        "memoria":        "free -h",
+        "nodos":          "pvesh get /nodes --output-format=json-pretty | head -50",
+    }, host=host)
+
+    # Guardar hallazgos relevantes en memoria semántica (un solo lote).
+    # Con clave: cada exploración reemplaza la anterior en vez de acumular copias.
+    # El alias por defecto conserva las claves y textos de siempre; los demás hosts llevan el suyo.
+    prefijo, donde = ("pve", "") if host == SSH_ALIAS else (f"pve:{host}", f" ({host})")
+    hechos, claves = [], []
     if not hallazgos["version"].startswith("[Error"):
-        guardar_hecho(f"Proxmox versión: {hallazgos['version']}")
+        hechos.append(f"Proxmox{donde} versión: {hallazgos['version']}")
+        claves.append(f"{prefijo}:version")
     if not hallazgos["vms"].startswith("[Error") and hallazgos["vms"] != "(sin salida)":
-        guardar_hecho(f"VMs en Proxmox:\n{hallazgos['vms']}")
+        hechos.append(f"VMs en Proxmox{donde}:\n{hallazgos['vms']}")
+        claves.append(f"{prefijo}:vms")
     if not hallazgos["contenedores"].startswith("[Error") and hallazgos["contenedores"] != "(sin salida)":
-        guardar_hecho(f"Contenedores LXC en Proxmox:\n{hallazgos['contenedores']}")
+        hechos.append(f"Contenedores LXC en Proxmox{donde}:\n{hallazgos['contenedores']}")
+        claves.append(f"{prefijo}:contenedores")
     if not hallazgos["almacenamiento"].startswith("[Error"):
-        guardar_hecho(f"Almacenamiento Proxmox:\n{hallazgos['almacenamiento']}")
+        hechos.append(f"Almacenamiento Proxmox{donde}:\n{hallazgos['almacenamiento']}")
+        claves.append(f"{prefijo}:almacenamiento")
+    guardar_hechos(hechos, claves)
 
     # Construir resumen legible
-    lineas = ["=== Exploración Proxmox ==="]
+    lineas = [f"=== Exploración Proxmox ({host}) ===" if len(PVE_HOSTS) > 1 else "=== Exploración Proxmox ==="]
     for clave, valor in hallazgos.items():
         lineas.append(f"\n--- {clave.upper()} ---\n{valor}")
+    fallidos = [clave for clave, valor in hallazgos.items() if _es_error(valor)]
+    if fallidos:
+        lineas.append(f"\n⚠ Sin datos de: {', '.join(fallidos)}")
     lineas.append("\n✓ Hallazgos guardados en memoria.")
     return "\n".join(lineas)
 
@@ -111,4 +375,7 @@ SSH_PVE_TOOLS = [
     pve_ejecutar,
     pve_ups,
     pve_explorar,
+    pve_flota_vms,
+    pve_flota_contenedores,
+    pve_flota_almacenamiento,
 ]
@@ -0,0 +1,242 @@
+"""Telemetría en segundo plano: UPS, nodos Proxmox y memoria local.
+
+Un hilo opcional (CHATTY_TELEMETRIA=1) muestrea cada fuente con su propio
+intervalo y guarda los valores numéricos en series circulares de tamaño fijo
+respaldadas por `array`. Las tools leen la última muestra al instante; si está
+vieja la devuelven igualmente y piden una actualización en segundo plano
+(stale-while-revalidate).
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Callable
+from langchain_core.tools import tool
+
+from tools import metricas
+from tools.proxmox import PROXMOX_ENABLED, _get_directo
+from tools.ssh_pve import SSH_ENABLED, _ssh, _es_error
+
+TELEMETRIA_ENABLED = os.environ.get("CHATTY_TELEMETRIA", "0") == "1"
+CAPACIDAD = 1440          # muestras por serie (24 h a una por minuto)
+INTERVALO_UPS = 60
+INTERVALO_NODOS = 30
+INTERVALO_LOCAL = 10
+
+_RE_NUMERICO = re.compile(r"^\s*([^:=]+?)\s*[:=]\s*(-?\d+(?:[.,]\d+)?)")
+
+
+class SerieCircular:
+    """Buffer circular de (timestamp, valor) sobre dos arrays de doubles."""
+
+    def __init__(self, capacidad: int = CAPACIDAD):
+        self.capacidad = capacidad
+        self._ts = array("d", bytes(8 * capacidad))
+        self._val = array("d", bytes(8 * capacidad))
+        self._pos = 0
+        self._n = 0
+
+    def agregar(self, valor: float, ts: float | None = None) -> None:
+        self._ts[self._pos] = time.time() if ts is None else ts
+        self._val[self._pos] = valor
+        self._pos = (self._pos + 1) % self.capacidad
+        self._n = min(self._n + 1, self.capacidad)
+
+    def ultima(self) -> tuple[float, float] | None:
+        if not self._n:
+            return None
+        i = (self._pos - 1) % self.capacidad
+        return self._ts[i], self._val[i]
+
+    def ventana(self, segundos: float) -> list[float]:
+        """Valores de los últimos `segundos`, del más reciente al más antiguo."""
+        desde = time.time() - segundos
+        valores = []
+        for k in range(1, self._n + 1):
+            i = (self._pos - k) % self.capacidad
+            if self._ts[i] < desde:
+                break
+            valores.append(self._val[i])
+        return valores
+
+    def estadisticas(self, segundos: float) -> tuple[float, float, float, int] | None:
+        """(mínimo, máximo, media, n) en la ventana, o None si no hay muestras."""
+        valores = self.ventana(segundos)
+        if not valores:
+            return None
+        return min(valores), max(valores), sum(valores) / len(valores), len(valores)
+
+
+_series: dict[str, SerieCircular] = {}
+_series_lock = threading.Lock()
+
+
+def _registrar(metrica: str, valor: float, ts: float) -> None:
+    with _series_lock:
+        serie = _series.get(metrica)
+        if serie is None:
+            serie = _series[metrica] = SerieCircular()
+        serie.agregar(valor, ts)
+
+
+def _clave(texto: str) -> str:
+    """'Carga batería (%)' → 'carga_bateria': minúsculas, sin tildes y con '_' como separador."""
+    sin_tildes = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode()
+    return re.sub(r"\W+", "_", sin_tildes.strip().lower()).strip("_")
+
+
+# ── Fuentes ───────────────────────────────────────────────────────────────────
+
+def _leer_ups() -> tuple[str, dict[str, float]]:
+    texto = _ssh("~/scripts/estado_ups.sh")
+    if _es_error(texto):
+        raise RuntimeError(texto)
+    valores = {}
+    for linea in texto.splitlines():
+        m = _RE_NUMERICO.match(linea)
+        if m:
+            valores[f"ups.{_clave(m.group(1))}"] = float(m.group(2).replace(",", "."))
+    return texto, valores
+
+
+def _leer_nodos() -> tuple[str, dict[str, float]]:
+    # Directo: la muestra no debe pisar la entrada de /nodes que usan las tools con su TTL
+    data = _get_directo("/nodes")
+    if isinstance(data, dict) and "error" in data:
+        raise RuntimeError(data["error"])
+    valores, lineas = {}, []
+    for n in data:
+        nombre = n.get("node", "?")
+        cpu = n.get("cpu", 0) * 100
+        mem = 100 * n.get("mem", 0) / n["maxmem"] if n.get("maxmem") else 0.0
+        valores[f"nodo.{nombre}.cpu_pct"] = cpu
+        valores[f"nodo.{nombre}.mem_pct"] = mem
+        lineas.append(f"- {nombre}: {n.get('status', '?')} | CPU {cpu:.1f}% | RAM {mem:.1f}%")
+    return "\n".join(lineas) or "Sin nodos.", valores
+
+
+def _leer_local() -> tuple[str, dict[str, float]]:
+    info = metricas.leer_meminfo()
+    total, disponible = info["MemTotal"], info.get("MemAvailable", info["MemFree"])
+    mem_pct = 100 * (total - disponible) / total
+    load1, load5, load15 = metricas.leer_carga()
+    texto = (f"RAM usada {mem_pct:.1f}% ({(total - disponible) / 1024**2:.1f}/{total / 1024**2:.1f} GiB) | "
+             f"carga {load1:.2f} {load5:.2f} {load15:.2f}")
+    return texto, {"local.mem_pct": mem_pct, "local.load1": load1}
+
+
+class _Fuente:
+    """Última lectura de una fuente, con refresco en segundo plano cuando caduca."""
+
+    def __init__(self, nombre: str, leer: Callable[[], tuple[str, dict[str, float]]], intervalo: float):
+        self.nombre = nombre
+        self._leer = leer
+        self.intervalo = intervalo
+        self.texto: str | None = None
+        self.ts: float = 0.0          # hora de la última lectura buena
+        self.intento: float = 0.0     # hora del último intento (bueno o no)
+        self.error: str | None = None
+        self._actualizando = threading.Lock()
+
+    def refrescar(self) -> None:
+        if not self._actualizando.acquire(blocking=False):
+            return  # ya hay un refresco en curso
+        self.intento = time.time()
+        try:
+            texto, valores = self._leer()
+            ahora = time.time()
+            for metrica, valor in valores.items():
+                _registrar(metrica, valor, ahora)
+            self.texto, self.ts, self.error = texto, ahora, None
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self._actualizando.release()
+
+    def leer(self) -> str:
+        """Devuelve la última lectura al instante; si caducó, lanza un refresco en segundo plano.
+        Solo bloquea la primera vez, cuando aún no hay nada que devolver."""
+        if self.texto is None:
+            self.refrescar()
+            if self.texto is None:
+                return f"[Error] {self.nombre}: {self.error or 'sin datos'}"
+        edad = time.time() - self.ts
+        if edad > self.intervalo:
+            threading.Thread(target=self.refrescar, daemon=True).start()
+        return f"{self.texto}\n(muestra de hace {edad:.0f}s)"
+
+
+_fuentes: dict[str, _Fuente] = {"local": _Fuente("local", _leer_local, INTERVALO_LOCAL)}
+if SSH_ENABLED:
+    _fuentes["ups"] = _Fuente("ups", _leer_ups, INTERVALO_UPS)
+if PROXMOX_ENABLED:
+    _fuentes["nodos"] = _Fuente("nodos", _leer_nodos, INTERVALO_NODOS)
+
+
+# ── Hilo muestreador ──────────────────────────────────────────────────────────
+
+_hilo: threading.Thread | None = None
+_parar = threading.Event()
+
+
+def _bucle() -> None:
+    while not _parar.is_set():
+        ahora = time.time()
+        for fuente in _fuentes.values():
+            if ahora - fuente.intento >= fuente.intervalo:
+                fuente.refrescar()
+        _parar.wait(min(f.intervalo for f in _fuentes.values()) / 2)
+
+
+def iniciar() -> None:
+    """Arranca el muestreador (idempotente)."""
+    global _hilo
+    if _hilo is None or not _hilo.is_alive():
+        _parar.clear()
+        _hilo = threading.Thread(target=_bucle, name="telemetria", daemon=True)
+        _hilo.start()
+
+
+def detener() -> None:
+    _parar.set()
+
+
+def lectura(fuente: str) -> str:
+    f = _fuentes.get(fuente)
+    if f is None:
+        return f"[Error] Fuente desconocida '{fuente}'. Disponibles: {', '.join(_fuentes)}"
+    return f.leer()
+
+
+# ── Tools ────────────────────────────────────────────────────────────────────
+
+@tool
+def telemetria_actual(fuente: str = "ups") -> str:
+    """Devuelve al instante la última muestra de una fuente de telemetría:
+    'ups' (SAI del servidor), 'nodos' (CPU/RAM de los nodos Proxmox) o 'local' (RAM y carga de la laptop)."""
+    return lectura(fuente)
+
+
+@tool
+def telemetria_tendencia(metrica: str = "", minutos: int = 60) -> str:
+    """Mínimo, máximo y media de una métrica en los últimos `minutos` (p. ej. 'ups.carga_bateria',
+    'nodo.pve.cpu_pct', 'local.mem_pct'). Sin métrica, lista las disponibles."""
+    with _series_lock:
+        if not metrica:
+            if not _series:
+                return "Aún no hay muestras."
+            return "Métricas disponibles:\n" + "\n".join(f"- {m}" for m in sorted(_series))
+        serie = _series.get(metrica)
+        stats = serie.estadisticas(minutos * 60) if serie else None
+    if serie is None:
+        return f"[Error] Métrica desconocida '{metrica}'. Llama sin argumentos para ver las disponibles."
+    if stats is None:
+        return f"Sin muestras de {metrica} en los últimos {minutos} min."
+    minimo, maximo, media, n = stats
+    return f"{metrica} (últimos {minutos} min, {n} muestras): mín {minimo:.2f} | máx {maximo:.2f} | media {media:.2f}"
+
+
+TELEMETRIA_TOOLS = [telemetria_actual, telemetria_tendencia]